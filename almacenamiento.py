@@ -0,0 +1,204 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from configuracion import valor_configuracion
+
+# Dónde se guardan los informes generados y los zips anuales:
+# - 'local': archivos en un directorio (por defecto el de la aplicación; puede ser un volumen compartido)
+# - 'objetos': almacén de objetos al estilo S3 sobre un directorio, con caché local de lectura
+ALMACENAMIENTO = valor_configuracion("almacenamiento", "local")
+ALMACENAMIENTO_RAIZ = valor_configuracion("almacenamiento_raiz", ".")
+ALMACENAMIENTO_CACHE_DIR = valor_configuracion("almacenamiento_cache_dir",
+                                               os.path.join(tempfile.gettempdir(), "certificos_cache"))
+# Transferencias simultáneas al subir, descargar o eliminar varios archivos a la vez
+ALMACENAMIENTO_HILOS = valor_configuracion("almacenamiento_hilos", 8)
+
+_EJECUTOR_TRANSFERENCIAS = ThreadPoolExecutor(max_workers=ALMACENAMIENTO_HILOS, thread_name_prefix="almacenamiento")
+
+# Las claves son rutas relativas con "/" (las guardadas en la base con "\" también se aceptan)
+def normalizar_clave(clave):
+    return clave.replace("\\", "/")
+
+# Función para escribir un archivo de forma atómica: quien lo lea a la vez (otra instancia de la
+# aplicación) ve el contenido anterior o el nuevo, nunca uno a medio escribir
+def _escribir_atomico(ruta, contenido):
+    directorio = os.path.dirname(ruta) or "."
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, prefix=".tmp_")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.remove(temporal)
+        raise
+
+# Interfaz de los almacenamientos. La firma de un archivo cambia cada vez que cambia su contenido
+# (sirve para validar cachés); copia_local devuelve una ruta en disco que solo debe leerse.
+class Almacenamiento:
+    def leer(self, clave):
+        raise NotImplementedError
+
+    def guardar(self, clave, contenido):
+        raise NotImplementedError
+
+    def eliminar(self, clave):
+        raise NotImplementedError
+
+    def firma(self, clave):
+        raise NotImplementedError
+
+    def copia_local(self, clave):
+        raise NotImplementedError
+
+    def existe(self, clave):
+        return self.firma(clave) is not None
+
+    # Subida en paralelo de varios archivos {clave: contenido}
+    def guardar_varios(self, archivos):
+        list(_EJECUTOR_TRANSFERENCIAS.map(lambda archivo: self.guardar(*archivo), archivos.items()))
+
+    # Descarga en paralelo de varios archivos: {clave: contenido o None si no existe}
+    def leer_varios(self, claves):
+        claves = list(claves)
+        return dict(zip(claves, _EJECUTOR_TRANSFERENCIAS.map(self.leer, claves)))
+
+    def eliminar_varios(self, claves):
+        list(_EJECUTOR_TRANSFERENCIAS.map(self.eliminar, claves))
+
+# Almacenamiento en un directorio del sistema de archivos (local o montado desde otro servidor)
+class AlmacenamientoLocal(Almacenamiento):
+    def __init__(self, raiz):
+        self.raiz = raiz
+
+    def ruta(self, clave):
+        return os.path.join(self.raiz, normalizar_clave(clave).replace("/", os.sep))
+
+    def leer(self, clave):
+        try:
+            with open(self.ruta(clave), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def guardar(self, clave, contenido):
+        _escribir_atomico(self.ruta(clave), contenido)
+
+    def eliminar(self, clave):
+        try:
+            os.remove(self.ruta(clave))
+        except FileNotFoundError:
+            pass
+
+    def firma(self, clave):
+        try:
+            estado = os.stat(self.ruta(clave))
+        except OSError:
+            return None
+        return estado.st_mtime_ns, estado.st_size
+
+    def copia_local(self, clave):
+        ruta = self.ruta(clave)
+        return ruta if os.path.exists(ruta) else None
+
+# Almacén de objetos con la semántica de S3 sobre un directorio local, como sustituto de un servicio
+# compatible con S3: claves planas, cada objeto se escribe y se lee entero y lleva su ETag (MD5 del
+# contenido). Las lecturas pasan por una caché local en disco indexada por ETag, así que un objeto
+# sin cambios se descarga una sola vez por servidor.
+class AlmacenamientoObjetos(Almacenamiento):
+    def __init__(self, raiz, cache_dir):
+        self.raiz = raiz
+        self.cache_dir = cache_dir
+        os.makedirs(raiz, exist_ok=True)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _ruta_objeto(self, clave):
+        return os.path.join(self.raiz, quote(normalizar_clave(clave), safe=""))
+
+    def _ruta_cache(self, clave, etag):
+        return os.path.join(self.cache_dir, f"{quote(normalizar_clave(clave), safe='')}.{etag}")
+
+    # Equivalente a HEAD: los metadatos del objeto, o None si no existe
+    def _metadatos(self, clave):
+        try:
+            with open(self._ruta_objeto(clave) + ".meta", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def guardar(self, clave, contenido):
+        ruta = self._ruta_objeto(clave)
+        _escribir_atomico(ruta, contenido)
+        _escribir_atomico(ruta + ".meta", json.dumps({
+            'etag': hashlib.md5(contenido).hexdigest(), 'tamano': len(contenido)}).encode("utf-8"))
+
+    def eliminar(self, clave):
+        ruta = self._ruta_objeto(clave)
+        for ruta_parte in (ruta + ".meta", ruta):
+            try:
+                os.remove(ruta_parte)
+            except FileNotFoundError:
+                pass
+        self._limpiar_cache(clave)
+
+    def _limpiar_cache(self, clave):
+        for ruta_cache in glob.glob(glob.escape(self._ruta_cache(clave, "")) + "*"):
+            try:
+                os.remove(ruta_cache)
+            except FileNotFoundError:
+                pass
+
+    def firma(self, clave):
+        metadatos = self._metadatos(clave)
+        return (metadatos['etag'], metadatos['tamano']) if metadatos else None
+
+    # Función para asegurar la copia en caché del objeto y devolver su ruta (None si el objeto no existe)
+    def copia_local(self, clave):
+        metadatos = self._metadatos(clave)
+        if metadatos is None:
+            return None
+        ruta_cache = self._ruta_cache(clave, metadatos['etag'])
+        if not os.path.exists(ruta_cache):
+            try:
+                with open(self._ruta_objeto(clave), "rb") as f:
+                    contenido = f.read()
+            except FileNotFoundError:
+                return None
+            # Solo se conserva la versión vigente de cada objeto en la caché
+            self._limpiar_cache(clave)
+            _escribir_atomico(ruta_cache, contenido)
+        return ruta_cache
+
+    def leer(self, clave):
+        ruta_cache = self.copia_local(clave)
+        if ruta_cache is None:
+            return None
+        with open(ruta_cache, "rb") as f:
+            return f.read()
+
+# Función para crear el almacenamiento según la configuración
+def crear_almacenamiento(tipo=ALMACENAMIENTO, raiz=ALMACENAMIENTO_RAIZ, cache_dir=ALMACENAMIENTO_CACHE_DIR):
+    if tipo == "local":
+        return AlmacenamientoLocal(raiz)
+    if tipo == "objetos":
+        return AlmacenamientoObjetos(raiz, cache_dir)
+    raise ValueError(f"Tipo de almacenamiento desconocido: {tipo}")
+
+_almacenamiento = None
+
+# Función para obtener el almacenamiento del proceso (se crea al primer uso)
+def get_almacenamiento():
+    global _almacenamiento
+    if _almacenamiento is None:
+        _almacenamiento = crear_almacenamiento()
+    return _almacenamiento
+
+# Función para usar otro almacenamiento en el proceso (por ejemplo, en pruebas o benchmarks)
+def configurar_almacenamiento(almacenamiento):
+    global _almacenamiento
+    _almacenamiento = almacenamiento
@@ -0,0 +1,240 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import streamlit as st
+
+from base_datos import conectar, get_anios_archivados, get_version_datos
+from configuracion import valor_configuracion
+
+ANALITICA_DIR = valor_configuracion("analitica_dir", "analitica")
+SNAPSHOT_ANALITICO = os.path.join(ANALITICA_DIR, "certificados.arrow")
+
+os.makedirs(ANALITICA_DIR, exist_ok=True)
+
+# Las sesiones de Streamlit son hilos del mismo proceso: el snapshot se regenera de a una
+_bloqueo_snapshot = threading.RLock()
+
+# ==================== SNAPSHOT ANALÍTICO COLUMNAR ====================
+
+# Consulta que desnormaliza certificados con sus obras y el resumen de sus facturas
+CONSULTA_SNAPSHOT = """
+    SELECT c.id, c.numero_certificado, c.obra_id, o.nombre AS obra_nombre, o.codigo AS obra_codigo,
+           c.fecha, c.contrato, c.contratista, c.valor_contrato, c.valor_pagado, c.total_facturas,
+           c.estado, COALESCE(f.num_facturas, 0) AS num_facturas,
+           COALESCE(f.importe_facturas, 0.0) AS importe_facturas
+    FROM {esquema}.certificados c
+    JOIN main.obras o ON c.obra_id = o.id
+    LEFT JOIN (SELECT certificado_id, COUNT(*) AS num_facturas, SUM(importe) AS importe_facturas
+               FROM {esquema}.facturas GROUP BY certificado_id) f ON f.certificado_id = c.id
+"""
+
+# Función para materializar el snapshot columnar (Arrow IPC sin compresión, apto para memory-map)
+# con los certificados vivos y los de los años archivados
+def generar_snapshot_analitico():
+    with _bloqueo_snapshot:
+        return _generar_snapshot_analitico()
+
+def _generar_snapshot_analitico():
+    conn = conectar()
+    try:
+        # La versión se lee en la misma transacción de lectura que los datos
+        conn.execute("BEGIN")
+        version = conn.execute("SELECT version FROM version_datos WHERE id = 1").fetchone()[0]
+        partes = [pd.read_sql_query(CONSULTA_SNAPSHOT.format(esquema="main"), conn).assign(archivado=False)]
+        conn.commit()
+        for anio, db_path, _, _, _ in get_anios_archivados():
+            conn.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+            partes.append(pd.read_sql_query(CONSULTA_SNAPSHOT.format(esquema="archivo"), conn).assign(archivado=True))
+            conn.execute("DETACH DATABASE archivo")
+    finally:
+        conn.close()
+
+    df = pd.concat([parte for parte in partes if not parte.empty] or partes[:1], ignore_index=True)
+    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+    for columna in ('valor_contrato', 'valor_pagado', 'total_facturas', 'importe_facturas'):
+        df[columna] = df[columna].astype('float64').fillna(0.0)
+    df['estado'] = df['estado'].fillna('Activo').astype('category')
+    df['obra_nombre'] = df['obra_nombre'].astype('category')
+
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), b'version_datos': str(version).encode()})
+
+    # Escritura atómica en un temporal propio para no exponer un snapshot a medio escribir a otras
+    # sesiones ni a otros procesos
+    descriptor, temporal = tempfile.mkstemp(dir=ANALITICA_DIR, prefix=".tmp_", suffix=".arrow")
+    os.close(descriptor)
+    try:
+        feather.write_feather(tabla, temporal, compression='uncompressed')
+        os.replace(temporal, SNAPSHOT_ANALITICO)
+    except BaseException:
+        os.remove(temporal)
+        raise
+    return version
+
+# Función para leer la versión de datos con la que se generó el snapshot (solo lee el esquema)
+def get_version_snapshot():
+    if not os.path.exists(SNAPSHOT_ANALITICO):
+        return None
+    with pa.memory_map(SNAPSHOT_ANALITICO) as fuente:
+        metadatos = pa.ipc.open_file(fuente).schema.metadata or {}
+    version = metadatos.get(b'version_datos')
+    return int(version) if version is not None else None
+
+# Lectura del snapshot mediante memory-map, cacheada por versión de datos.
+# El DataFrame devuelto es compartido entre sesiones: no debe modificarse en el lugar.
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _leer_snapshot_analitico(version):
+    return feather.read_table(SNAPSHOT_ANALITICO, memory_map=True).to_pandas()
+
+# Función para obtener la versión de datos de un snapshot al día, regenerándolo solo si los datos cambiaron
+def _version_snapshot_al_dia():
+    version = get_version_datos()
+    if get_version_snapshot() != version:
+        with _bloqueo_snapshot:
+            # Otra sesión pudo regenerarlo mientras se esperaba el bloqueo
+            version = get_version_datos()
+            if get_version_snapshot() != version:
+                version = generar_snapshot_analitico()
+    return version
+
+# Función para obtener el snapshot analítico, regenerándolo solo si los datos cambiaron
+def get_snapshot_analitico():
+    return _leer_snapshot_analitico(_version_snapshot_al_dia())
+
+# Totales por contratista
+def totales_por_contratista(df):
+    activos = df[df['estado'] == 'Activo']
+    return (activos.assign(contratista=activos['contratista'].fillna('').replace('', 'Sin contratista'))
+            .groupby('contratista', observed=True)
+            .agg(certificados=('id', 'size'), valor_pagado=('valor_pagado', 'sum'),
+                 total_facturas=('total_facturas', 'sum'))
+            .sort_values('valor_pagado', ascending=False)
+            .reset_index())
+
+# Progreso de pagos por obra: lo certificado frente al valor de los contratos de la obra
+def progreso_pagos_por_obra(df):
+    activos = df[df['estado'] == 'Activo']
+    # Cada contrato se cuenta una sola vez, con su valor más reciente
+    contratos = (activos.sort_values('fecha')
+                 .drop_duplicates(['obra_nombre', 'contrato'], keep='last')
+                 .groupby('obra_nombre', observed=True)['valor_contrato'].sum())
+    pagado = activos.groupby('obra_nombre', observed=True)['valor_pagado'].sum()
+    progreso = pd.DataFrame({'valor_contrato': contratos, 'valor_pagado': pagado}).fillna(0.0)
+    progreso['progreso'] = (progreso['valor_pagado'] / progreso['valor_contrato'].where(progreso['valor_contrato'] > 0)).fillna(0.0)
+    return progreso.reset_index().rename(columns={'index': 'obra_nombre'})
+
+# Tendencia mensual de certificados por estado
+def tendencia_estados(df):
+    return (df.dropna(subset=['fecha'])
+            .assign(mes=lambda d: d['fecha'].dt.to_period('M').dt.to_timestamp())
+            .pivot_table(index='mes', columns='estado', values='id', aggfunc='size', fill_value=0, observed=True)
+            .sort_index())
+
+# ==================== ESTIMADOS DE PRODUCCIÓN ====================
+
+# Meses de la media móvil y de la ventana de la tendencia lineal, y horizonte máximo de las proyecciones
+MESES_MEDIA_MOVIL = 3
+MESES_TENDENCIA = 12
+HORIZONTE_PROYECCION = 120
+
+# Series mensuales de lo certificado (certificados activos), como tablas meses × obras con los meses
+# sin certificados en cero, desde el primer mes con datos hasta el último de cualquier obra
+def series_mensuales(df):
+    activos = df[(df['estado'] == 'Activo') & df['fecha'].notna()]
+    mensual = (activos.assign(mes=activos['fecha'].dt.to_period('M'))
+               .pivot_table(index='mes', columns='obra_nombre', values=['valor_pagado', 'total_facturas'],
+                            aggfunc='sum', fill_value=0.0, observed=True))
+    if mensual.empty:
+        vacia = pd.DataFrame(index=pd.PeriodIndex([], freq='M'), dtype='float64')
+        return {'valor_pagado': vacia, 'total_facturas': vacia}
+    meses = pd.period_range(mensual.index.min(), mensual.index.max(), freq='M')
+    mensual = mensual.reindex(meses, fill_value=0.0)
+    return {columna: mensual[columna].astype('float64') for columna in ('valor_pagado', 'total_facturas')}
+
+# Función para convertir meses contados desde un mes base en fechas (primer día del mes); NaN da NaT
+def _sumar_meses(mes_base, meses):
+    ordinales = mes_base.ordinal + np.asarray(meses, dtype='float64')
+    return pd.to_datetime({'year': ordinales // 12 + 1970, 'month': ordinales % 12 + 1, 'day': 1}, errors='coerce')
+
+# Estimados de producción por obra: saldo del contrato, media móvil y tendencia lineal de lo pagado
+# cada mes, y fecha estimada de terminación con cada método. Todo se calcula a la vez para todas las
+# obras con operaciones vectorizadas sobre la tabla meses × obras.
+def estimar_produccion(df, meses_media=MESES_MEDIA_MOVIL, meses_tendencia=MESES_TENDENCIA,
+                       horizonte=HORIZONTE_PROYECCION):
+    series = series_mensuales(df)
+    pagado, facturado = series['valor_pagado'], series['total_facturas']
+    if pagado.empty:
+        return {'resumen': pd.DataFrame(), 'pagado': pagado, 'facturado': facturado,
+                'media_movil': pagado, 'tendencia': pagado}
+    ultimo_mes = pagado.index[-1]
+
+    # Saldo del contrato: valor de los contratos de la obra menos lo pagado acumulado
+    progreso = progreso_pagos_por_obra(df).set_index('obra_nombre').reindex(pagado.columns)
+    valor_contrato = progreso['valor_contrato'].fillna(0.0).to_numpy()
+    acumulado = pagado.to_numpy().sum(axis=0)
+    saldo = np.where(valor_contrato > 0, np.clip(valor_contrato - acumulado, 0.0, None), np.nan)
+
+    # Media móvil de los últimos meses
+    media_movil = pagado.rolling(meses_media, min_periods=1).mean()
+    media = media_movil.to_numpy()[-1]
+
+    # Tendencia lineal por mínimos cuadrados sobre la ventana de los últimos meses (x centrada en cero)
+    ventana = pagado.to_numpy()[-meses_tendencia:]
+    k = len(ventana)
+    x = np.arange(k) - (k - 1) / 2
+    nivel = ventana.mean(axis=0)
+    pendiente = (x @ (ventana - nivel)) / (x @ x) if k > 1 else np.zeros(ventana.shape[1])
+    pasos = np.arange(1, horizonte + 1)[:, None]
+    proyectado = np.clip(nivel + pendiente * ((k - 1) / 2 + pasos), 0.0, None)
+
+    # Meses hasta cubrir el saldo: con la media, saldo / ritmo mensual; con la tendencia, el primer mes
+    # del horizonte en que lo proyectado acumulado alcanza el saldo (NaN si no lo alcanza)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        meses_media_fin = np.where(saldo == 0, 0.0, np.where(media > 0, np.ceil(saldo / media), np.nan))
+    alcanza = proyectado.cumsum(axis=0) >= saldo
+    meses_tendencia_fin = np.where(saldo == 0, 0.0,
+                                   np.where(alcanza.any(axis=0), alcanza.argmax(axis=0) + 1.0, np.nan))
+
+    resumen = pd.DataFrame({
+        'obra_nombre': pagado.columns.astype(str),
+        'valor_contrato': valor_contrato,
+        'pagado_acumulado': acumulado,
+        'facturado_acumulado': facturado.to_numpy().sum(axis=0),
+        'saldo': saldo,
+        'media_movil': media,
+        'tendencia_mensual': pendiente,
+        'proximo_mes': proyectado[0],
+        'fin_media_movil': _sumar_meses(ultimo_mes, meses_media_fin),
+        'fin_tendencia': _sumar_meses(ultimo_mes, meses_tendencia_fin),
+    })
+    resumen['progreso'] = np.where(valor_contrato > 0, acumulado / np.where(valor_contrato > 0, valor_contrato, 1.0), np.nan)
+    tendencia = pd.DataFrame(proyectado, columns=pagado.columns,
+                             index=pd.period_range(ultimo_mes + 1, periods=horizonte, freq='M'))
+    return {'resumen': resumen.sort_values('saldo', ascending=False, na_position='last').reset_index(drop=True),
+            'pagado': pagado, 'facturado': facturado, 'media_movil': media_movil, 'tendencia': tendencia}
+
+# Estimados calculados una sola vez por versión de los datos y compartidos entre sesiones
+# (como el snapshot, no deben modificarse en el lugar)
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _estimados_produccion(version):
+    return estimar_produccion(_leer_snapshot_analitico(version))
+
+# Función para obtener los estimados de producción de todas las obras (con todo el historial, incluidos
+# los años archivados)
+def get_estimados_produccion():
+    return _estimados_produccion(_version_snapshot_al_dia())
+
+# Serie mensual de una obra para graficar: lo pagado, su media móvil y la tendencia proyectada
+def proyeccion_obra(estimados, obra_nombre, meses_futuros=12):
+    historico = pd.DataFrame({'Pagado': estimados['pagado'][obra_nombre],
+                              'Media móvil': estimados['media_movil'][obra_nombre]})
+    futuro = estimados['tendencia'][obra_nombre].head(meses_futuros).rename('Tendencia')
+    serie = pd.concat([historico, futuro], axis=1)
+    serie.index = serie.index.to_timestamp()
+    return serie
+
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import traceback
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import lru_cache
+from urllib.parse import parse_qs, quote, urlsplit
+
+import base_datos
+from base_datos import (
+    COLUMNAS_CERTIFICADO, DB_POOL_TAMANO, ZIP_SEPARADOR, activar_pool_conexiones, buscar_certificados_con_filtros,
+    es_certificado_archivado, get_all_obras, get_certificado_archivado, get_certificado_by_id,
+    get_facturas_by_certificado_id, get_version_datos, leer_archivo_certificado, ruta_local,
+)
+from configuracion import valor_configuracion
+from informes import FORMATOS_POR_DEFECTO, RENDERIZADORES, ruta_informe
+
+# Configuración del servicio (ver configuracion.py)
+API_HOST = valor_configuracion("api_host", "127.0.0.1")
+API_PUERTO = valor_configuracion("api_puerto", 8502)
+API_LIMITE_POR_DEFECTO = 50
+API_LIMITE_MAXIMO = 500
+# Segundos que una conexión keep-alive puede quedar inactiva antes de cerrarla
+API_TIEMPO_INACTIVIDAD = 15
+# Cuerpos a partir de este tamaño (informes) se escriben aparte de la cabecera para no copiarlos al unirlos
+API_CUERPO_SEPARADO = 64 * 1024
+
+# Nombres de los campos en las respuestas, en el mismo orden que las tuplas de base_datos
+CAMPOS_CERTIFICADO = [columna.strip().split(".")[-1] for columna in COLUMNAS_CERTIFICADO.split(",")] + [
+    'obra_nombre', 'obra_codigo']
+CAMPOS_FACTURA = ['proveedor', 'numero_factura', 'importe', 'codigo']
+CAMPOS_OBRA = ['id', 'nombre', 'codigo', 'aprobacion', 'plantilla', 'aprobacion_desde', 'aprobacion_hasta']
+
+ESTADOS_HTTP = {
+    200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 500: "Internal Server Error",
+}
+
+# Las consultas a SQLite son bloqueantes: se ejecutan en hilos, con una conexión del pool por hilo
+_EJECUTOR_CONSULTAS = ThreadPoolExecutor(max_workers=DB_POOL_TAMANO, thread_name_prefix="api")
+
+# Error que se devuelve al cliente con su código HTTP
+class ErrorHttp(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.mensaje = mensaje
+
+# ==================== CONSULTAS ====================
+
+# Función para convertir un certificado (tupla) en diccionario para la respuesta
+def _certificado_a_dict(certificado):
+    datos = dict(zip(CAMPOS_CERTIFICADO, certificado[:len(CAMPOS_CERTIFICADO)]))
+    datos['archivado'] = es_certificado_archivado(certificado)
+    datos['descargas'] = {formato: f"/api/certificados/{certificado[0]}/archivo?formato={formato}"
+                          for formato in FORMATOS_POR_DEFECTO}
+    return datos
+
+# Orden del listado (el mismo que la búsqueda de la aplicación), con el id como desempate para el cursor
+def _clave_orden(certificado):
+    return (certificado[13], -certificado[1], certificado[0])
+
+# Resultado completo de una búsqueda, ordenado y cacheado por versión de los datos: las páginas
+# siguientes de la misma búsqueda no vuelven a consultar la base mientras nada cambie
+@lru_cache(maxsize=64)
+def _certificados_filtrados(filtros, version):
+    obras_ids, estados, fecha_inicio, fecha_fin, contratista = filtros
+    certificados = buscar_certificados_con_filtros(list(obras_ids) or None, list(estados) or None,
+                                                   fecha_inicio, fecha_fin, contratista)
+    return sorted(certificados, key=_clave_orden)
+
+# Función para codificar la posición de la última fila entregada como cursor opaco
+def _codificar_cursor(certificado):
+    clave = json.dumps(_clave_orden(certificado), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(clave).decode("ascii").rstrip("=")
+
+def _decodificar_cursor(cursor):
+    try:
+        nombre, numero_negativo, certificado_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return (str(nombre), int(numero_negativo), int(certificado_id))
+    except (ValueError, TypeError):
+        raise ErrorHttp(400, "Cursor inválido")
+
+# Funciones para leer los parámetros de la consulta
+def _parametro(parametros, nombre, defecto=None):
+    valores = parametros.get(nombre)
+    return valores[-1] if valores else defecto
+
+def _parametro_fecha(parametros, nombre):
+    valor = _parametro(parametros, nombre)
+    try:
+        return date.fromisoformat(valor) if valor else None
+    except ValueError:
+        raise ErrorHttp(400, f"El parámetro '{nombre}' debe ser una fecha AAAA-MM-DD")
+
+def _parametro_entero(parametros, nombre, defecto=None):
+    valor = _parametro(parametros, nombre)
+    try:
+        return int(valor) if valor is not None else defecto
+    except ValueError:
+        raise ErrorHttp(400, f"El parámetro '{nombre}' debe ser un número entero")
+
+# GET /api/certificados?obra=1&obra=2&estado=Activo&desde=2025-01-01&hasta=2025-12-31&contratista=texto
+#                      &limite=50&cursor=...
+def listar_certificados(parametros, version):
+    try:
+        obras_ids = tuple(sorted(int(obra) for obra in parametros.get('obra', [])))
+    except ValueError:
+        raise ErrorHttp(400, "El parámetro 'obra' debe ser el id numérico de una obra")
+    filtros = (
+        obras_ids,
+        tuple(sorted(parametros.get('estado', []))),
+        _parametro_fecha(parametros, 'desde'),
+        _parametro_fecha(parametros, 'hasta'),
+        _parametro(parametros, 'contratista') or None,
+    )
+    limite = min(max(_parametro_entero(parametros, 'limite', API_LIMITE_POR_DEFECTO), 1), API_LIMITE_MAXIMO)
+
+    certificados = _certificados_filtrados(filtros, version)
+    cursor = _parametro(parametros, 'cursor')
+    inicio = bisect_right(certificados, _decodificar_cursor(cursor), key=_clave_orden) if cursor else 0
+    pagina = certificados[inicio:inicio + limite]
+    hay_mas = inicio + limite < len(certificados)
+    return {
+        'certificados': [_certificado_a_dict(certificado) for certificado in pagina],
+        'total': len(certificados),
+        'siguiente': _codificar_cursor(pagina[-1]) if hay_mas else None,
+        'version': version,
+    }
+
+# Función para buscar un certificado en la base viva y, si no está, en los años archivados
+def _buscar_certificado(certificado_id):
+    certificado = get_certificado_by_id(certificado_id)
+    if certificado is not None:
+        return certificado, get_facturas_by_certificado_id(certificado_id)
+    certificado, facturas = get_certificado_archivado(certificado_id)
+    if certificado is None:
+        raise ErrorHttp(404, f"No existe el certificado {certificado_id}")
+    return certificado, facturas
+
+# GET /api/certificados/<id>
+def obtener_certificado(parametros, version, certificado_id):
+    certificado, facturas = _buscar_certificado(certificado_id)
+    datos = _certificado_a_dict(certificado)
+    datos['aprobacion'] = certificado[15]
+    datos['version'] = certificado[16]
+    datos['facturas'] = [dict(zip(CAMPOS_FACTURA, factura)) for factura in facturas]
+    return datos
+
+# GET /api/certificados/<id>/archivo?formato=xlsx|pdf
+def descargar_archivo(parametros, version, certificado_id):
+    formato = _parametro(parametros, 'formato', FORMATOS_POR_DEFECTO[0])
+    if formato not in RENDERIZADORES:
+        raise ErrorHttp(400, f"Formato no disponible: {formato}")
+    certificado, _ = _buscar_certificado(certificado_id)
+    if not certificado[9]:
+        raise ErrorHttp(404, "El certificado no tiene archivo asociado")
+    ruta = ruta_informe(certificado[9], formato)
+    contenido = leer_archivo_certificado(ruta)
+    if contenido is None:
+        raise ErrorHttp(404, f"No se encontró el archivo {formato} del certificado")
+    nombre = os.path.basename(ruta_local(ruta.split(ZIP_SEPARADOR)[-1]))
+    return RENDERIZADORES[formato]['mime'], contenido, {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(nombre)}"}
+
+# GET /api/obras
+def listar_obras(parametros, version):
+    return {'obras': [dict(zip(CAMPOS_OBRA, obra)) for obra in get_all_obras()], 'version': version}
+
+# GET /api/salud
+def salud(parametros, version):
+    return {'estado': "ok", 'version': version}
+
+# Función para elegir el manejador según la ruta: devuelve (función, argumentos de la ruta)
+def _resolver_ruta(partes):
+    if partes[:1] != ['api']:
+        raise ErrorHttp(404, "Ruta no encontrada")
+    partes = partes[1:]
+    if partes == ['salud']:
+        return salud, ()
+    if partes == ['obras']:
+        return listar_obras, ()
+    if partes == ['certificados']:
+        return listar_certificados, ()
+    if len(partes) in (2, 3) and partes[0] == 'certificados' and partes[1].isdigit():
+        if len(partes) == 2:
+            return obtener_certificado, (int(partes[1]),)
+        if partes[2] == 'archivo':
+            return descargar_archivo, (int(partes[1]),)
+    raise ErrorHttp(404, "Ruta no encontrada")
+
+# ==================== SERVIDOR HTTP ====================
+
+def _json(datos):
+    return "application/json; charset=utf-8", json.dumps(datos, ensure_ascii=False, default=str).encode("utf-8"), {}
+
+def _respuesta(estado, cuerpo=b"", tipo=None, cabeceras=None, incluir_cuerpo=True, mantener_conexion=True):
+    lineas = [f"HTTP/1.1 {estado} {ESTADOS_HTTP[estado]}", f"Content-Length: {len(cuerpo)}",
+              f"Connection: {'keep-alive' if mantener_conexion else 'close'}"]
+    if tipo:
+        lineas.append(f"Content-Type: {tipo}")
+    lineas.extend(f"{nombre}: {valor}" for nombre, valor in (cabeceras or {}).items())
+    cabecera = ("\r\n".join(lineas) + "\r\n\r\n").encode("latin-1")
+    if not incluir_cuerpo or not cuerpo:
+        return [cabecera]
+    if len(cuerpo) < API_CUERPO_SEPARADO:
+        return [cabecera + cuerpo]
+    return [cabecera, memoryview(cuerpo)]
+
+# Función para atender una petición: GET condicional con ETag según la versión de los datos
+async def _atender_peticion(metodo, destino, cabeceras):
+    loop = asyncio.get_running_loop()
+    if metodo not in ("GET", "HEAD"):
+        raise ErrorHttp(405, "Solo se admiten consultas GET")
+    url = urlsplit(destino)
+    manejador, argumentos = _resolver_ruta([parte for parte in url.path.split("/") if parte])
+
+    # Cualquier escritura en la base incrementa la versión, así que sirve de ETag para toda la API
+    version = await loop.run_in_executor(_EJECUTOR_CONSULTAS, get_version_datos)
+    etag = f'"{version}"'
+    cabeceras_cache = {'ETag': etag, 'Cache-Control': "no-cache"}
+    etags_cliente = [valor.strip() for valor in cabeceras.get('if-none-match', "").split(",")]
+    if etag in etags_cliente or "*" in etags_cliente:
+        return 304, None, b"", cabeceras_cache
+
+    resultado = await loop.run_in_executor(_EJECUTOR_CONSULTAS, manejador, parse_qs(url.query), version, *argumentos)
+    tipo, cuerpo, cabeceras_extra = _json(resultado) if isinstance(resultado, dict) else resultado
+    return 200, tipo, cuerpo, {**cabeceras_cache, **cabeceras_extra}
+
+# Función para atender una conexión (HTTP/1.1 con keep-alive; las peticiones se responden en orden)
+async def _atender_conexion(lector, escritor):
+    try:
+        while True:
+            try:
+                linea = await asyncio.wait_for(lector.readline(), API_TIEMPO_INACTIVIDAD)
+            except asyncio.TimeoutError:
+                break
+            if not linea.strip():
+                break
+            try:
+                metodo, destino, version_http = linea.decode("latin-1").split()
+            except ValueError:
+                escritor.writelines(_respuesta(400, mantener_conexion=False))
+                break
+
+            cabeceras = {}
+            while True:
+                linea = await lector.readline()
+                if linea in (b"\r\n", b"\n", b""):
+                    break
+                nombre, _, valor = linea.decode("latin-1").partition(":")
+                cabeceras[nombre.strip().lower()] = valor.strip()
+            # La API no recibe cuerpos, pero si llega alguno se descarta para no desincronizar la conexión
+            longitud = cabeceras.get('content-length', "0")
+            if longitud.isdigit() and int(longitud):
+                await lector.readexactly(int(longitud))
+            mantener = version_http == "HTTP/1.1" and cabeceras.get('connection', "").lower() != "close"
+
+            try:
+                estado, tipo, cuerpo, cabeceras_respuesta = await _atender_peticion(metodo, destino, cabeceras)
+            except ErrorHttp as e:
+                estado, cabeceras_respuesta = e.estado, {}
+                tipo, cuerpo, _ = _json({'error': e.mensaje})
+            except Exception:
+                traceback.print_exc()
+                estado, cabeceras_respuesta = 500, {}
+                tipo, cuerpo, _ = _json({'error': "Error interno del servidor"})
+
+            for parte in _respuesta(estado, cuerpo, tipo, cabeceras_respuesta,
+                                    incluir_cuerpo=metodo != "HEAD", mantener_conexion=mantener):
+                escritor.write(parte)
+            await escritor.drain()
+            if not mantener:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        escritor.close()
+
+# Función para iniciar el servidor (devuelve el asyncio.Server ya escuchando)
+async def iniciar_servidor(host=API_HOST, puerto=API_PUERTO):
+    activar_pool_conexiones(DB_POOL_TAMANO)
+    return await asyncio.start_server(_atender_conexion, host, puerto)
+
+async def _servir(host, puerto):
+    servidor = await iniciar_servidor(host, puerto)
+    print(f"API de certificados (solo lectura) en http://{host}:{puerto}/api/certificados")
+    async with servidor:
+        await servidor.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP de solo lectura para consultar certificados.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--puerto", type=int, default=API_PUERTO)
+    args = parser.parse_args()
+
+    base_datos.init_db()
+    try:
+        asyncio.run(_servir(args.host, args.puerto))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,1263 @@
+import sqlite3
+import os
+import queue
+import random
+import re
+import threading
+import time
+import unicodedata
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache, wraps
+from io import BytesIO
+
+import pandas as pd
+import streamlit as st
+
+from almacenamiento import get_almacenamiento, normalizar_clave
+from configuracion import valor_configuracion
+
+# Configuración de la base de datos y directorios (ver configuracion.py)
+DB_NAME = valor_configuracion("db_name", "certificados.db")
+EXCEL_TEMPLATES_DIR = valor_configuracion("plantillas_dir", "data")
+# Directorio local de las bases SQLite de los años archivados
+ARCHIVO_DIR = valor_configuracion("archivo_dir", "archivo_historico")
+# Prefijos de las claves de los informes y de los zips anuales en el almacenamiento (ver almacenamiento.py)
+CERTIFICADOS_DIR = "certificados_generados"
+ARCHIVO_ZIP_DIR = "archivo_historico"
+
+# Concurrencia: tiempo de espera de SQLite ante bloqueos y reintentos con espera exponencial
+DB_BUSY_TIMEOUT_MS = valor_configuracion("db_busy_timeout_ms", 5000)
+DB_REINTENTOS = valor_configuracion("db_reintentos", 5)
+DB_ESPERA_INICIAL = valor_configuracion("db_espera_inicial", 0.05)
+# Conexiones que se mantienen abiertas cuando se activa el pool (ver activar_pool_conexiones)
+DB_POOL_TAMANO = valor_configuracion("db_pool_tamano", 8)
+
+# Memoria máxima (en MB) de la caché de informes compartida por todas las sesiones
+CACHE_ARCHIVOS_MB = valor_configuracion("cache_archivos_mb", 64.0)
+
+# Separador entre el zip anual y el archivo interno en archivo_path de certificados archivados
+ZIP_SEPARADOR = "::"
+
+# Otros formatos del informe que se guardan junto al Excel con el mismo nombre
+EXTENSIONES_INFORME_ADICIONALES = (".pdf",)
+
+# Columnas de un certificado en el orden histórico de la tabla. Las consultas las listan explícitamente
+# para que las posiciones de las tuplas (obra_nombre en 13, obra_codigo en 14) no cambien al agregar columnas.
+COLUMNAS_CERTIFICADO = """c.id, c.numero_certificado, c.obra_id, c.fecha, c.contrato, c.contratista,
+    c.valor_contrato, c.valor_pagado, c.total_facturas, c.archivo_path, c.fecha_generacion,
+    c.estado, c.comentario_estado"""
+
+# Normalización difusa de proveedores para detectar facturas duplicadas: ignora mayúsculas, tildes,
+# puntuación, formas jurídicas y el orden de las palabras. Si se cambia, ejecutar recalcular_claves_facturas().
+NORMALIZACION_DIFUSA_PROVEEDOR = valor_configuracion("normalizacion_difusa_proveedor", True)
+PALABRAS_IGNORADAS_PROVEEDOR = {'sa', 'srl', 'surl', 'sl', 'ltda', 'mipyme', 'cna', 'tcp', 'empresa',
+                                'de', 'del', 'la', 'las', 'el', 'los', 'y'}
+
+# Crear directorios necesarios
+os.makedirs(EXCEL_TEMPLATES_DIR, exist_ok=True)
+os.makedirs(ARCHIVO_DIR, exist_ok=True)
+
+# Error de concurrencia optimista: el certificado cambió desde que se cargó para editar
+class ConflictoEdicion(Exception):
+    pass
+
+# Función para abrir una conexión con el tiempo de espera configurado ante bloqueos
+# (si hay un pool de conexiones activo, se reutiliza una de sus conexiones)
+def conectar():
+    if _pool_conexiones is not None and _pool_conexiones.db_name == DB_NAME:
+        return _pool_conexiones.obtener()
+    return _abrir_conexion(DB_NAME)
+
+def _abrir_conexion(db_name, **opciones):
+    conn = sqlite3.connect(db_name, timeout=DB_BUSY_TIMEOUT_MS / 1000, **opciones)
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    # En modo WAL, NORMAL es seguro ante caídas de la aplicación y evita un fsync por transacción
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+# Conexión que, al cerrarse, vuelve a su pool en lugar de cerrarse de verdad
+class _ConexionReutilizable(sqlite3.Connection):
+    pool = None
+
+    def close(self):
+        if self.pool is not None and self.pool.devolver(self):
+            return
+        super().close()
+
+# Pool de conexiones para procesos de larga duración que atienden muchas consultas cortas (por ejemplo,
+# la API). Las funciones de este módulo no cambian: siguen llamando a conectar() y conn.close().
+class PoolConexiones:
+    def __init__(self, db_name, tamano):
+        self.db_name = db_name
+        self.tamano = tamano
+        self._libres = queue.LifoQueue()
+
+    def obtener(self):
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            conn = _abrir_conexion(self.db_name, factory=_ConexionReutilizable, check_same_thread=False)
+            conn.pool = self
+            return conn
+
+    def devolver(self, conn):
+        # Una conexión solo se reutiliza limpia: sin transacción abierta ni bases anuales adjuntas
+        if conn.in_transaction:
+            conn.rollback()
+        adjuntas = [fila[1] for fila in conn.execute("PRAGMA database_list") if fila[1] not in ('main', 'temp')]
+        if adjuntas or self._libres.qsize() >= self.tamano or self is not _pool_conexiones:
+            return False
+        self._libres.put_nowait(conn)
+        return True
+
+    def cerrar(self):
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            conn.pool = None
+            conn.close()
+
+_pool_conexiones = None
+
+# Función para activar el pool de conexiones del proceso
+def activar_pool_conexiones(tamano=DB_POOL_TAMANO):
+    global _pool_conexiones
+    cerrar_pool_conexiones()
+    _pool_conexiones = PoolConexiones(DB_NAME, tamano)
+    return _pool_conexiones
+
+# Función para cerrar el pool de conexiones y volver a abrir una conexión por consulta
+def cerrar_pool_conexiones():
+    global _pool_conexiones
+    pool, _pool_conexiones = _pool_conexiones, None
+    if pool is not None:
+        pool.cerrar()
+
+# Decorador para reintentar escrituras cuando la base está bloqueada por otro usuario,
+# con espera exponencial y variación aleatoria para no sincronizar los reintentos
+def con_reintentos(funcion):
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        for intento in range(DB_REINTENTOS + 1):
+            try:
+                return funcion(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                mensaje = str(e).lower()
+                if intento == DB_REINTENTOS or ('locked' not in mensaje and 'busy' not in mensaje):
+                    raise
+                time.sleep(DB_ESPERA_INICIAL * (2 ** intento) * random.uniform(0.5, 1.5))
+    return envoltura
+
+# Función para dividir un texto en palabras normalizadas (sin tildes, minúsculas, sin puntuación)
+def _palabras_normalizadas(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode().lower()
+    return re.findall(r'[a-z0-9]+', texto.replace('.', ''))
+
+# Función para normalizar el nombre de un proveedor
+def normalizar_proveedor(proveedor, difusa=None):
+    palabras = _palabras_normalizadas(proveedor)
+    if NORMALIZACION_DIFUSA_PROVEEDOR if difusa is None else difusa:
+        palabras = sorted(p for p in palabras if p not in PALABRAS_IGNORADAS_PROVEEDOR) or palabras
+    return ' '.join(palabras)
+
+# Función para normalizar un número de factura ("F-0012", "f 12" y "F12" son la misma factura)
+def normalizar_numero_factura(numero_factura):
+    partes = re.findall(r'[a-z]+|[0-9]+', ' '.join(_palabras_normalizadas(numero_factura)))
+    return '-'.join(p.lstrip('0') or '0' if p.isdigit() else p for p in partes)
+
+# Clave normalizada (proveedor, número de factura) usada por el índice de duplicados
+def clave_factura(proveedor, numero_factura):
+    return f"{normalizar_proveedor(proveedor)}|{normalizar_numero_factura(numero_factura)}"
+
+# Función para agregar y rellenar la columna clave_factura en un esquema (base viva o archivo anual)
+def _migrar_clave_factura(conn, esquema='main'):
+    columnas = [fila[1] for fila in conn.execute(f"PRAGMA {esquema}.table_info(facturas)")]
+    if columnas and 'clave_factura' not in columnas:
+        conn.execute(f"ALTER TABLE {esquema}.facturas ADD COLUMN clave_factura TEXT")
+    if columnas:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {esquema}.idx_facturas_clave ON facturas (clave_factura)")
+        conn.execute(f"""UPDATE {esquema}.facturas SET clave_factura = clave_factura_sql(proveedor, numero_factura)
+                         WHERE clave_factura IS NULL""")
+
+# Función para agregar la columna de versión (concurrencia optimista) en un esquema
+def _migrar_version_certificado(conn, esquema='main'):
+    columnas = [fila[1] for fila in conn.execute(f"PRAGMA {esquema}.table_info(certificados)")]
+    if columnas and 'version' not in columnas:
+        conn.execute(f"ALTER TABLE {esquema}.certificados ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+# Función para agregar a las obras la plantilla de Excel de sus certificados (NULL = plantilla por defecto)
+def _migrar_plantilla_obra(conn):
+    columnas = [fila[1] for fila in conn.execute("PRAGMA main.table_info(obras)")]
+    if 'plantilla' not in columnas:
+        conn.execute("ALTER TABLE obras ADD COLUMN plantilla TEXT")
+
+# Función para agregar a las obras el período de su aprobación (NULL = sin límite por ese extremo);
+# las fechas de sus certificados deben caer dentro de él (ver validacion.py)
+def _migrar_periodo_aprobacion_obra(conn):
+    columnas = [fila[1] for fila in conn.execute("PRAGMA main.table_info(obras)")]
+    for columna in ('aprobacion_desde', 'aprobacion_hasta'):
+        if columna not in columnas:
+            conn.execute(f"ALTER TABLE obras ADD COLUMN {columna} TEXT")
+
+# Función para conectar con la función de normalización registrada en SQLite
+def _conectar_con_clave_factura():
+    conn = conectar()
+    conn.create_function("clave_factura_sql", 2, clave_factura, deterministic=True)
+    return conn
+
+# Función para recalcular todas las claves (por ejemplo, tras cambiar la normalización difusa)
+@con_reintentos
+def recalcular_claves_facturas():
+    conn = _conectar_con_clave_factura()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("UPDATE facturas SET clave_factura = NULL")
+    _migrar_clave_factura(conn)
+    conn.commit()
+    for anio, db_path, _, _, _ in get_anios_archivados():
+        conn.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE archivo.facturas SET clave_factura = NULL")
+        _migrar_clave_factura(conn, 'archivo')
+        conn.commit()
+        conn.execute("DETACH DATABASE archivo")
+    conn.close()
+
+# Inicializar la base de datos
+def init_db():
+    conn = conectar()
+    c = conn.cursor()
+    
+    # Vacuum incremental: el espacio libre se devuelve por partes desde el mantenimiento (ver mantenimiento.py).
+    # Solo tiene efecto en una base nueva y antes de pasar a WAL; las existentes las convierte el mantenimiento.
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    # Modo WAL: los lectores no bloquean al escritor y viceversa (se guarda en el propio archivo)
+    c.execute("PRAGMA journal_mode = WAL")
+    
+    # Crear tabla para obras
+    c.execute('''CREATE TABLE IF NOT EXISTS obras (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT UNIQUE NOT NULL,
+        codigo INTEGER NOT NULL,
+        aprobacion TEXT NOT NULL
+    )''')
+    
+    # Crear tabla para certificados (con UNIQUE constraint correcta y nuevos campos para estado)
+    c.execute('''CREATE TABLE IF NOT EXISTS certificados (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        numero_certificado INTEGER NOT NULL,
+        obra_id INTEGER,
+        fecha DATE NOT NULL,
+        contrato TEXT,
+        contratista TEXT,
+        valor_contrato REAL,
+        valor_pagado REAL,
+        total_facturas REAL,
+        archivo_path TEXT,
+        fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        -- Nuevos campos para el estado
+        estado TEXT DEFAULT 'Activo', -- 'Activo', 'Revertido', 'Cancelado'
+        comentario_estado TEXT,
+        FOREIGN KEY (obra_id) REFERENCES obras (id),
+        UNIQUE(obra_id, numero_certificado)
+    )''')
+    
+    # Crear tabla para facturas
+    c.execute('''CREATE TABLE IF NOT EXISTS facturas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        certificado_id INTEGER,
+        proveedor TEXT NOT NULL,
+        numero_factura TEXT NOT NULL,
+        importe REAL NOT NULL,
+        codigo TEXT,
+        FOREIGN KEY (certificado_id) REFERENCES certificados (id)
+    )''')
+    
+    # Crear tabla para el registro de años fiscales archivados
+    c.execute('''CREATE TABLE IF NOT EXISTS archivos_anuales (
+        anio INTEGER PRIMARY KEY,
+        db_path TEXT NOT NULL,
+        zip_path TEXT NOT NULL,
+        total_certificados INTEGER NOT NULL,
+        fecha_archivo TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Contador global de cambios: cualquier escritura en obras, certificados o facturas lo incrementa.
+    # Permite saber si una copia derivada (snapshot analítico, cachés) está desactualizada.
+    c.execute('''CREATE TABLE IF NOT EXISTS version_datos (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )''')
+    c.execute("INSERT OR IGNORE INTO version_datos (id, version) VALUES (1, 0)")
+    for tabla in ('obras', 'certificados', 'facturas'):
+        for evento in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+                         AFTER {evento} ON {tabla}
+                         BEGIN
+                             UPDATE version_datos SET version = version + 1 WHERE id = 1;
+                         END''')
+    
+    # Índices para los filtros por fecha y la búsqueda de facturas por certificado
+    c.execute("CREATE INDEX IF NOT EXISTS idx_certificados_fecha ON certificados (fecha)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_facturas_certificado ON facturas (certificado_id)")
+    
+    # Insertar obras iniciales si no existen
+    obras_iniciales = [
+        ('Mejoras Cayo Saetía', 759, 'A 37-018-15'),
+        ('Marina Cayo Saetía', 677, 'A 37-024-19'),
+        ('Viviendas Mayarí', 699, 'A 37-037-20'),
+        ('Delfinario Cayo Saetía', 605, 'A 37-025-19'),
+        ('Canal Dumois', 872, 'A 37-038-21')
+    ]
+    
+    for nombre, codigo, aprobacion in obras_iniciales:
+        try:
+            c.execute("INSERT INTO obras (nombre, codigo, aprobacion) VALUES (?, ?, ?)",
+                     (nombre, codigo, aprobacion))
+        except sqlite3.IntegrityError:
+            pass  # La obra ya existe
+    
+    conn.commit()
+    conn.close()
+    
+    # Índice de claves normalizadas para la detección de facturas duplicadas
+    # y columna de versión para la edición concurrente
+    conn = _conectar_con_clave_factura()
+    _migrar_clave_factura(conn)
+    _migrar_version_certificado(conn)
+    _migrar_plantilla_obra(conn)
+    _migrar_periodo_aprobacion_obra(conn)
+    conn.commit()
+    for anio, db_path, _, _, _ in get_anios_archivados():
+        conn.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        _migrar_clave_factura(conn, 'archivo')
+        _migrar_version_certificado(conn, 'archivo')
+        conn.commit()
+        conn.execute("DETACH DATABASE archivo")
+    
+    # Historial de cambios (después de las migraciones, porque los triggers copian todas las columnas)
+    _crear_historial(conn)
+    _crear_registro_cambios(conn)
+    conn.commit()
+    conn.close()
+
+# ==================== HISTORIAL DE CAMBIOS (SOLO ANEXAR) ====================
+
+# Columnas copiadas en el historial de cada tabla
+COLUMNAS_HISTORIAL = {
+    'certificados': ['id', 'numero_certificado', 'obra_id', 'fecha', 'contrato', 'contratista', 'valor_contrato',
+                     'valor_pagado', 'total_facturas', 'archivo_path', 'fecha_generacion', 'estado',
+                     'comentario_estado', 'version'],
+    'facturas': ['id', 'certificado_id', 'proveedor', 'numero_factura', 'importe', 'codigo'],
+}
+
+# Función para crear las tablas de historial y los triggers que las llenan.
+# Cada fila del historial es la imagen completa de la fila tras el cambio (o antes, si se eliminó),
+# de modo que el estado a una fecha es simplemente la última imagen anterior a esa fecha.
+def _crear_historial(conn):
+    # Contexto opcional del cambio en curso (por ejemplo 'ARCHIVADO'): se fija dentro de la misma
+    # transacción que hace los cambios, y los triggers lo usan en lugar del evento SQL
+    conn.execute('''CREATE TABLE IF NOT EXISTS contexto_historial (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        operacion TEXT
+    )''')
+    conn.execute("INSERT OR IGNORE INTO contexto_historial (id, operacion) VALUES (1, NULL)")
+
+    for tabla, columnas in COLUMNAS_HISTORIAL.items():
+        historial = f"historial_{tabla}"
+        existia = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (historial,)).fetchone()
+        definicion_columnas = ', '.join(columnas)
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {historial} (
+            hist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            operacion TEXT NOT NULL, -- 'INICIAL', 'INSERT', 'UPDATE', 'DELETE', 'ARCHIVADO'
+            fecha_cambio TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            {definicion_columnas}
+        )''')
+        # Índice para reconstruir "a fecha X" un certificado (o sus facturas) sin recorrer el historial
+        columna_certificado = 'id' if tabla == 'certificados' else 'certificado_id'
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{historial}_certificado ON {historial} ({columna_certificado}, hist_id)")
+
+        # Las filas existentes al activar el historial quedan como estado inicial,
+        # fechado en la generación del certificado al que pertenecen
+        if not existia:
+            if tabla == 'certificados':
+                origen = "certificados t"
+                fecha_inicial = "t.fecha_generacion"
+            else:
+                origen = "facturas t LEFT JOIN certificados cert ON t.certificado_id = cert.id"
+                fecha_inicial = "cert.fecha_generacion"
+            conn.execute(f"""INSERT INTO {historial} (operacion, fecha_cambio, {definicion_columnas})
+                             SELECT 'INICIAL', COALESCE({fecha_inicial}, strftime('%Y-%m-%d %H:%M:%f', 'now')),
+                                    {', '.join('t.' + columna for columna in columnas)}
+                             FROM {origen}""")
+
+        for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            valores = ', '.join(f"{fila}.{columna}" for columna in columnas)
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{historial}_{evento.lower()}
+                             AFTER {evento} ON {tabla}
+                             BEGIN
+                                 INSERT INTO {historial} (operacion, {definicion_columnas})
+                                 VALUES (COALESCE((SELECT operacion FROM contexto_historial WHERE id = 1), '{evento}'),
+                                         {valores});
+                             END''')
+
+        # El historial es de solo anexar: no se puede modificar ni borrar
+        for evento in ('UPDATE', 'DELETE'):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{historial}_solo_anexar_{evento.lower()}
+                             BEFORE {evento} ON {historial}
+                             BEGIN
+                                 SELECT RAISE(ABORT, 'El historial de cambios es de solo lectura');
+                             END''')
+
+# Función para crear el registro de cambios para la sincronización entre sedes: una secuencia creciente
+# con el certificado afectado por cada escritura (en el certificado o en sus facturas). Exportar los
+# cambios desde la última sincronización es leer las entradas con secuencia mayor que la enviada.
+def _crear_registro_cambios(conn):
+    existia = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'registro_cambios'").fetchone()
+    conn.execute('''CREATE TABLE IF NOT EXISTS registro_cambios (
+        secuencia INTEGER PRIMARY KEY AUTOINCREMENT,
+        certificado_id INTEGER NOT NULL,
+        operacion TEXT NOT NULL -- 'INICIAL', 'INSERT', 'UPDATE', 'DELETE', 'ARCHIVADO', 'SINCRONIZACION'
+    )''')
+    # Los certificados existentes al activar el registro se envían completos en la primera sincronización
+    if not existia:
+        conn.execute("INSERT INTO registro_cambios (certificado_id, operacion) SELECT id, 'INICIAL' FROM certificados ORDER BY id")
+
+    for tabla, columna in (('certificados', 'id'), ('facturas', 'certificado_id')):
+        for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_registro_cambios_{tabla}_{evento.lower()}
+                             AFTER {evento} ON {tabla}
+                             WHEN {fila}.{columna} IS NOT NULL
+                             BEGIN
+                                 INSERT INTO registro_cambios (certificado_id, operacion)
+                                 VALUES ({fila}.{columna},
+                                         COALESCE((SELECT operacion FROM contexto_historial WHERE id = 1), '{evento}'));
+                             END''')
+
+# Función para fijar (o limpiar, con None) el contexto de los cambios de la transacción en curso
+def _fijar_contexto_historial(c, operacion):
+    c.execute("UPDATE contexto_historial SET operacion = ? WHERE id = 1", (operacion,))
+
+# Función para convertir una fecha (o fecha y hora) al formato de fecha_cambio del historial.
+# Una fecha sin hora se interpreta como el final de ese día.
+def _momento_historial(momento):
+    if isinstance(momento, datetime):
+        return momento.strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+    return f"{momento:%Y-%m-%d} 23:59:59.999"
+
+# Función para obtener todos los cambios registrados de un certificado (del más antiguo al más reciente)
+def get_historial_certificado(certificado_id):
+    conn = conectar()
+    c = conn.cursor()
+    c.execute(f"""SELECT hist_id, operacion, fecha_cambio, {', '.join(COLUMNAS_HISTORIAL['certificados'][1:])}
+                  FROM historial_certificados WHERE id = ? ORDER BY hist_id""", (certificado_id,))
+    historial = c.fetchall()
+    conn.close()
+    return historial
+
+# Función para reconstruir un certificado y sus facturas tal como estaban en un momento dado.
+# Devuelve (certificado, facturas) como diccionarios, o (None, []) si el certificado no existía.
+def get_certificado_a_fecha(certificado_id, momento):
+    momento = _momento_historial(momento)
+    columnas_cert = COLUMNAS_HISTORIAL['certificados']
+    columnas_fact = COLUMNAS_HISTORIAL['facturas']
+    conn = conectar()
+    c = conn.cursor()
+    c.execute(f"""SELECT operacion, fecha_cambio, {', '.join(columnas_cert)} FROM historial_certificados
+                  WHERE id = ? AND fecha_cambio <= ? ORDER BY hist_id DESC LIMIT 1""", (certificado_id, momento))
+    fila = c.fetchone()
+    if fila is None or fila[0] == 'DELETE':
+        conn.close()
+        return None, []
+    certificado = dict(zip(['operacion', 'fecha_cambio'] + columnas_cert, fila))
+
+    # Última imagen de cada factura del certificado anterior al momento, descartando las eliminadas
+    c.execute(f"""SELECT {', '.join('h.' + columna for columna in columnas_fact)}
+                  FROM historial_facturas h
+                  JOIN (SELECT id, MAX(hist_id) AS hist_id FROM historial_facturas
+                        WHERE certificado_id = ? AND fecha_cambio <= ?
+                        GROUP BY id) u ON u.hist_id = h.hist_id
+                  WHERE h.operacion != 'DELETE'
+                  ORDER BY h.id""", (certificado_id, momento))
+    facturas = [dict(zip(columnas_fact, factura)) for factura in c.fetchall()]
+    conn.close()
+    return certificado, facturas
+
+# Función para listar los certificados eliminados, con la última imagen que tuvieron
+def get_certificados_eliminados(limite=100):
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("""SELECT h.id, h.numero_certificado, o.nombre, h.fecha, h.estado, h.fecha_cambio
+                 FROM historial_certificados h
+                 LEFT JOIN obras o ON h.obra_id = o.id
+                 WHERE h.operacion = 'DELETE'
+                 ORDER BY h.hist_id DESC LIMIT ?""", (limite,))
+    eliminados = c.fetchall()
+    conn.close()
+    return eliminados
+
+# Función para obtener el siguiente número de certificado PARA UNA OBRA ESPECÍFICA
+def get_next_certificado_number_por_obra(obra_id):
+    conn = conectar()
+    c = conn.cursor()
+    # Obtiene el máximo número de certificado para la obra dada
+    c.execute("SELECT MAX(numero_certificado) FROM certificados WHERE obra_id = ?", (obra_id,))
+    result = c.fetchone()[0]
+    # Si la obra no tiene certificados vivos, la numeración continúa desde el año archivado más reciente
+    if result is None:
+        for anio, db_path, _, _, _ in get_anios_archivados():
+            c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+            c.execute("SELECT MAX(numero_certificado) FROM archivo.certificados WHERE obra_id = ?", (obra_id,))
+            result = c.fetchone()[0]
+            c.execute("DETACH DATABASE archivo")
+            if result is not None:
+                break
+    conn.close()
+    # Si no hay certificados para esta obra, el siguiente es 1
+    return (result or 0) + 1
+
+# Función para obtener todas las obras
+def get_all_obras():
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("""SELECT id, nombre, codigo, aprobacion, plantilla, aprobacion_desde, aprobacion_hasta
+                 FROM obras ORDER BY nombre""")
+    obras = c.fetchall()
+    conn.close()
+    return obras
+
+# Catálogo de obras cacheado: se lee la tabla una sola vez y se construyen índices
+# por id, nombre y código para resolver cualquier selección en O(1).
+# Se llama con get_version_datos(), así que un cambio en las obras hecho desde cualquier instancia
+# (o por una importación) lo invalida; además se invalida explícitamente al modificarlas desde aquí.
+@st.cache_data(show_spinner=False, max_entries=1)
+def get_catalogo_obras(version):
+    obras = get_all_obras()
+    return {
+        'obras': obras,
+        'por_id': {obra[0]: obra for obra in obras},
+        'por_nombre': {obra[1]: obra for obra in obras},
+        'por_codigo': {obra[2]: obra for obra in obras},
+    }
+
+# Función para invalidar el catálogo de obras tras cualquier cambio
+def invalidar_catalogo_obras():
+    get_catalogo_obras.clear()
+
+# Función para verificar que el código de obra no esté en uso por otra obra
+def _validar_codigo_obra_unico(c, codigo, obra_id=None):
+    c.execute("SELECT id FROM obras WHERE codigo = ? AND id IS NOT ?", (codigo, obra_id))
+    if c.fetchone():
+        raise ValueError(f"Ya existe una obra con el código {codigo}")
+
+# Función para crear una nueva obra
+@con_reintentos
+def crear_obra(nombre, codigo, aprobacion, plantilla=None, aprobacion_desde=None, aprobacion_hasta=None):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        _validar_codigo_obra_unico(c, codigo)
+        c.execute("""INSERT INTO obras (nombre, codigo, aprobacion, plantilla, aprobacion_desde, aprobacion_hasta)
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  (nombre, codigo, aprobacion, plantilla, aprobacion_desde, aprobacion_hasta))
+        obra_id = c.lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidar_catalogo_obras()
+    return obra_id
+
+# Función para actualizar los datos de una obra
+@con_reintentos
+def actualizar_obra(obra_id, nombre, codigo, aprobacion, plantilla=None, aprobacion_desde=None, aprobacion_hasta=None):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        _validar_codigo_obra_unico(c, codigo, obra_id)
+        c.execute("""UPDATE obras SET nombre = ?, codigo = ?, aprobacion = ?, plantilla = ?,
+                            aprobacion_desde = ?, aprobacion_hasta = ?
+                     WHERE id = ?""",
+                  (nombre, codigo, aprobacion, plantilla, aprobacion_desde, aprobacion_hasta, obra_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidar_catalogo_obras()
+
+# Función para contar los certificados de una obra en las bases de los años archivados
+def _contar_certificados_archivados(c, obra_id):
+    total = 0
+    for _, db_path, _, _, _ in get_anios_archivados():
+        c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        c.execute("SELECT COUNT(*) FROM archivo.certificados WHERE obra_id = ?", (obra_id,))
+        total += c.fetchone()[0]
+        c.execute("DETACH DATABASE archivo")
+    return total
+
+# Función para eliminar una obra (solo si no tiene certificados asociados, tampoco en años archivados,
+# que se leen uniéndolos con la tabla de obras de la base viva)
+@con_reintentos
+def eliminar_obra(obra_id):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        # Las bases anuales no pueden adjuntarse dentro de la transacción: se cuentan antes y luego se
+        # comprueba que no se haya archivado ningún año entretanto
+        archivos = c.execute("SELECT anio, total_certificados FROM archivos_anuales ORDER BY anio").fetchall()
+        total_certificados = _contar_certificados_archivados(c, obra_id)
+        c.execute("BEGIN IMMEDIATE")
+        if c.execute("SELECT anio, total_certificados FROM archivos_anuales ORDER BY anio").fetchall() != archivos:
+            raise ValueError("Se archivó un año mientras se eliminaba la obra; vuelva a intentarlo")
+        c.execute("SELECT COUNT(*) FROM certificados WHERE obra_id = ?", (obra_id,))
+        total_certificados += c.fetchone()[0]
+        if total_certificados:
+            raise ValueError(f"La obra tiene {total_certificados} certificado(s) asociado(s) y no puede eliminarse")
+        c.execute("DELETE FROM obras WHERE id = ?", (obra_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidar_catalogo_obras()
+
+# Función para obtener un certificado por ID (incluyendo estado y, al final, su versión)
+def get_certificado_by_id(certificado_id):
+    conn = conectar()
+    c = conn.cursor()
+    c.execute(f"""SELECT {COLUMNAS_CERTIFICADO}, o.nombre as obra_nombre, o.codigo as obra_codigo, o.aprobacion, c.version,
+                        o.plantilla
+                 FROM certificados c 
+                 JOIN obras o ON c.obra_id = o.id 
+                 WHERE c.id = ?""", (certificado_id,))
+    certificado = c.fetchone()
+    conn.close()
+    return certificado
+
+# Función para obtener facturas de un certificado
+def get_facturas_by_certificado_id(certificado_id):
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("SELECT proveedor, numero_factura, importe, codigo FROM facturas WHERE certificado_id = ? ORDER BY id", 
+              (certificado_id,))
+    facturas = c.fetchall()
+    conn.close()
+    return facturas
+
+# Función para obtener las facturas de un certificado con su id (para editarlas fila a fila)
+def get_facturas_editables(certificado_id):
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("SELECT id, proveedor, numero_factura, importe, codigo FROM facturas WHERE certificado_id = ? ORDER BY id",
+              (certificado_id,))
+    facturas = c.fetchall()
+    conn.close()
+    return facturas
+
+# Función para actualizar un certificado (incluyendo estado).
+# Si se indica version_esperada, la actualización solo se aplica si nadie modificó el certificado
+# desde que se leyó esa versión; en caso contrario se lanza ConflictoEdicion.
+# Si se indican facturas_data, se reemplazan las facturas en la misma transacción; si se indican
+# cambios_facturas (ver _aplicar_cambios_facturas), solo se escriben las facturas que cambiaron.
+@con_reintentos
+def update_certificado(certificado_id, fecha, contrato, contratista, valor_contrato, valor_pagado, total_facturas, estado, comentario_estado,
+                       version_esperada=None, facturas_data=None, cambios_facturas=None):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""UPDATE certificados 
+                     SET fecha = ?, contrato = ?, contratista = ?, valor_contrato = ?, valor_pagado = ?, total_facturas = ?,
+                         estado = ?, comentario_estado = ?, version = version + 1
+                     WHERE id = ? AND (? IS NULL OR version = ?)""",
+                  (fecha, contrato, contratista, valor_contrato, valor_pagado, total_facturas, estado, comentario_estado,
+                   certificado_id, version_esperada, version_esperada))
+        if c.rowcount == 0:
+            c.execute("SELECT version FROM certificados WHERE id = ?", (certificado_id,))
+            fila = c.fetchone()
+            if fila is None:
+                raise ConflictoEdicion("El certificado fue eliminado por otro usuario mientras se editaba.")
+            raise ConflictoEdicion(f"El certificado fue modificado por otro usuario (versión {fila[0]}, "
+                                   f"se editaba la versión {version_esperada}). Recargue los datos y repita los cambios.")
+        if facturas_data is not None:
+            _reemplazar_facturas(c, certificado_id, facturas_data)
+        if cambios_facturas is not None:
+            _aplicar_cambios_facturas(c, certificado_id, cambios_facturas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Función para reemplazar las facturas de un certificado dentro de una transacción abierta
+def _reemplazar_facturas(c, certificado_id, facturas_data):
+    # Eliminar facturas existentes
+    c.execute("DELETE FROM facturas WHERE certificado_id = ?", (certificado_id,))
+    
+    # Insertar nuevas facturas
+    c.executemany("""INSERT INTO facturas (certificado_id, proveedor, numero_factura, importe, codigo, clave_factura) 
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  [(certificado_id, factura['proveedor'], factura['factura'], factura['importe'], factura['codigo'],
+                    clave_factura(factura['proveedor'], factura['factura'])) for factura in facturas_data])
+
+# Función para aplicar, dentro de una transacción abierta, solo las diferencias de facturas de un certificado:
+# {'nuevas': [factura], 'modificadas': [(id, factura)], 'eliminadas': [id]}
+def _aplicar_cambios_facturas(c, certificado_id, cambios):
+    c.executemany("DELETE FROM facturas WHERE id = ? AND certificado_id = ?",
+                  [(factura_id, certificado_id) for factura_id in cambios['eliminadas']])
+    c.executemany("""UPDATE facturas SET proveedor = ?, numero_factura = ?, importe = ?, codigo = ?, clave_factura = ?
+                     WHERE id = ? AND certificado_id = ?""",
+                  [(factura['proveedor'], factura['factura'], factura['importe'], factura['codigo'],
+                    clave_factura(factura['proveedor'], factura['factura']), factura_id, certificado_id)
+                   for factura_id, factura in cambios['modificadas']])
+    c.executemany("""INSERT INTO facturas (certificado_id, proveedor, numero_factura, importe, codigo, clave_factura)
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+                  [(certificado_id, factura['proveedor'], factura['factura'], factura['importe'], factura['codigo'],
+                    clave_factura(factura['proveedor'], factura['factura'])) for factura in cambios['nuevas']])
+
+# Función para actualizar facturas de un certificado
+@con_reintentos
+def update_facturas(certificado_id, facturas_data):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        _reemplazar_facturas(c, certificado_id, facturas_data)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Función para eliminar un certificado
+@con_reintentos
+def delete_certificado(certificado_id):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        
+        # Eliminar primero las facturas asociadas
+        c.execute("DELETE FROM facturas WHERE certificado_id = ?", (certificado_id,))
+        
+        # Luego eliminar el certificado
+        c.execute("DELETE FROM certificados WHERE id = ?", (certificado_id,))
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Función para obtener certificados por obra (incluyendo estado)
+def get_certificados_by_obra(obra_id=None):
+    conn = conectar()
+    c = conn.cursor()
+    
+    if obra_id:
+        c.execute(f"""SELECT {COLUMNAS_CERTIFICADO}, o.nombre as obra_nombre, o.codigo as obra_codigo
+                     FROM certificados c 
+                     JOIN obras o ON c.obra_id = o.id 
+                     WHERE c.obra_id = ? 
+                     ORDER BY c.numero_certificado DESC""", (obra_id,))
+    else:
+        c.execute(f"""SELECT {COLUMNAS_CERTIFICADO}, o.nombre as obra_nombre, o.codigo as obra_codigo
+                     FROM certificados c 
+                     JOIN obras o ON c.obra_id = o.id 
+                     ORDER BY o.nombre, c.numero_certificado DESC""")
+    
+    certificados = c.fetchall()
+    conn.close()
+    return certificados
+
+# --- FUNCIÓN DE BÚSQUEDA AVANZADA ---
+def buscar_certificados_con_filtros(obras_ids=None, estados=None, fecha_inicio=None, fecha_fin=None, contratista_texto=None):
+    conn = conectar()
+    c = conn.cursor()
+    
+    # Consulta base con JOIN para obtener el nombre de la obra
+    query = f"""
+        SELECT {COLUMNAS_CERTIFICADO}, o.nombre as obra_nombre, o.codigo as obra_codigo
+        FROM certificados c 
+        JOIN obras o ON c.obra_id = o.id 
+        WHERE 1=1
+    """
+    params = []
+    
+    # Añadir filtros dinámicamente si se proporcionan
+    if obras_ids:
+        placeholders = ','.join(['?'] * len(obras_ids))
+        query += f" AND c.obra_id IN ({placeholders})"
+        params.extend(obras_ids)
+        
+    if estados:
+        placeholders = ','.join(['?'] * len(estados))
+        query += f" AND c.estado IN ({placeholders})"
+        params.extend(estados)
+        
+    if fecha_inicio:
+        query += " AND c.fecha >= ?"
+        params.append(fecha_inicio)
+        
+    if fecha_fin:
+        query += " AND c.fecha <= ?"
+        params.append(fecha_fin)
+        
+    if contratista_texto:
+        query += " AND c.contratista LIKE ?"
+        params.append(f'%{contratista_texto}%')
+        
+    query += " ORDER BY o.nombre, c.numero_certificado DESC"
+    
+    c.execute(query, params)
+    certificados = c.fetchall()
+    
+    # Los años archivados solo se consultan cuando el rango de fechas los incluye
+    anios_requeridos = anios_archivados_en_rango(fecha_inicio, fecha_fin)
+    if anios_requeridos:
+        # Misma consulta sobre cada base anual adjunta
+        query_archivo = query.replace("FROM certificados c", "FROM archivo.certificados c", 1).replace(
+            "JOIN obras o", "JOIN main.obras o", 1)
+        for anio, db_path in anios_requeridos:
+            c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+            c.execute(query_archivo, params)
+            certificados.extend(c.fetchall())
+            c.execute("DETACH DATABASE archivo")
+        certificados.sort(key=lambda cert: (cert[13], -cert[1]))
+    
+    conn.close()
+    return certificados
+
+# Función para obtener la versión actual de los datos
+def get_version_datos():
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("SELECT version FROM version_datos WHERE id = 1")
+    version = c.fetchone()[0]
+    conn.close()
+    return version
+
+# ==================== ÍNDICE DE ETIQUETAS DE CERTIFICADOS ====================
+
+# Consulta con los datos que forman la etiqueta de un certificado en los selectores
+CONSULTA_ETIQUETAS = """
+    SELECT c.id, c.numero_certificado, o.nombre, o.codigo, c.fecha, c.estado
+    FROM {esquema}.certificados c
+    JOIN main.obras o ON c.obra_id = o.id
+"""
+
+# Índice id → etiqueta de todos los certificados (vivos y archivados), construido una sola vez por
+# versión de los datos y compartido entre sesiones. Incluye el texto normalizado para buscar y el
+# conjunto de ids archivados. Se llama con get_version_datos(), así que cualquier cambio lo invalida.
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_indice_certificados(version):
+    conn = conectar()
+    c = conn.cursor()
+    filas = c.execute(CONSULTA_ETIQUETAS.format(esquema='main')).fetchall()
+    archivados = set()
+    for anio, db_path, _, _, _ in get_anios_archivados():
+        c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        filas_archivo = c.execute(CONSULTA_ETIQUETAS.format(esquema='archivo')).fetchall()
+        archivados.update(fila[0] for fila in filas_archivo)
+        filas.extend(filas_archivo)
+        c.execute("DETACH DATABASE archivo")
+    conn.close()
+
+    # Mismo orden que los listados: obra y número de certificado descendente
+    filas.sort(key=lambda fila: (fila[2], -fila[1]))
+    etiquetas = {certificado_id: f"#{numero} - {obra} ({codigo}) - {fecha} - [{estado or 'N/A'}]"
+                 for certificado_id, numero, obra, codigo, fecha, estado in filas}
+    return {
+        'etiquetas': etiquetas,
+        'busqueda': [(certificado_id, ' '.join(_palabras_normalizadas(etiqueta)))
+                     for certificado_id, etiqueta in etiquetas.items()],
+        'archivados': frozenset(archivados),
+    }
+
+# Función para buscar en el índice los certificados cuya etiqueta contiene todas las palabras del texto.
+# Devuelve como mucho `limite` ids (en el orden del listado) y el total de coincidencias.
+def filtrar_indice_certificados(indice, texto="", ids_permitidos=None, incluir_archivados=True, limite=50):
+    palabras = _palabras_normalizadas(texto)
+    archivados = indice['archivados']
+    ids = []
+    total = 0
+    for certificado_id, texto_busqueda in indice['busqueda']:
+        if ids_permitidos is not None and certificado_id not in ids_permitidos:
+            continue
+        if not incluir_archivados and certificado_id in archivados:
+            continue
+        if all(palabra in texto_busqueda for palabra in palabras):
+            total += 1
+            if len(ids) < limite:
+                ids.append(certificado_id)
+    return ids, total
+
+# ==================== ARCHIVO HISTÓRICO POR AÑO FISCAL ====================
+
+# Función para obtener los años fiscales archivados (del más reciente al más antiguo). Si la base anual
+# no está en la ruta registrada (por ejemplo, en otra instancia con otro archivo_dir), se busca en ARCHIVO_DIR.
+def get_anios_archivados():
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("""SELECT anio, db_path, zip_path, total_certificados, fecha_archivo
+                 FROM archivos_anuales ORDER BY anio DESC""")
+    anios = [(anio, db_path if os.path.exists(db_path) else os.path.join(ARCHIVO_DIR, os.path.basename(db_path)),
+              zip_path, total, fecha_archivo)
+             for anio, db_path, zip_path, total, fecha_archivo in c.fetchall()]
+    conn.close()
+    return anios
+
+# Función para determinar qué bases anuales hay que consultar según el filtro de fechas.
+# Sin filtro de fechas solo se consulta la base viva, para que la vista por defecto siga siendo rápida.
+def anios_archivados_en_rango(fecha_inicio=None, fecha_fin=None):
+    if not fecha_inicio and not fecha_fin:
+        return []
+    anio_inicio = fecha_inicio.year if fecha_inicio else None
+    anio_fin = fecha_fin.year if fecha_fin else None
+    return [(anio, db_path) for anio, db_path, _, _, _ in get_anios_archivados()
+            if (anio_inicio is None or anio >= anio_inicio) and (anio_fin is None or anio <= anio_fin)]
+
+# Función para buscar un certificado y sus facturas en las bases de los años archivados.
+# Devuelve las mismas tuplas que get_certificado_by_id y get_facturas_by_certificado_id, o (None, []).
+def get_certificado_archivado(certificado_id):
+    conn = conectar()
+    c = conn.cursor()
+    certificado, facturas = None, []
+    for anio, db_path, _, _, _ in get_anios_archivados():
+        c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        c.execute(f"""SELECT {COLUMNAS_CERTIFICADO}, o.nombre as obra_nombre, o.codigo as obra_codigo, o.aprobacion,
+                            c.version, o.plantilla
+                     FROM archivo.certificados c
+                     JOIN main.obras o ON c.obra_id = o.id
+                     WHERE c.id = ?""", (certificado_id,))
+        certificado = c.fetchone()
+        if certificado is not None:
+            c.execute("""SELECT proveedor, numero_factura, importe, codigo FROM archivo.facturas
+                         WHERE certificado_id = ? ORDER BY id""", (certificado_id,))
+            facturas = c.fetchall()
+        c.execute("DETACH DATABASE archivo")
+        if certificado is not None:
+            break
+    conn.close()
+    return certificado, facturas
+
+# Función para saber si un certificado pertenece a un año archivado (solo lectura)
+def es_certificado_archivado(certificado):
+    return bool(certificado[9]) and ZIP_SEPARADOR in certificado[9]
+
+# Función para obtener los años cerrados que todavía tienen certificados en la base viva
+def get_anios_archivables():
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("""SELECT CAST(strftime('%Y', fecha) AS INTEGER) AS anio, COUNT(*)
+                 FROM certificados
+                 WHERE fecha < ?
+                 GROUP BY anio ORDER BY anio""", (f"{datetime.now().year}-01-01",))
+    anios = c.fetchall()
+    conn.close()
+    return anios
+
+# Función para normalizar rutas guardadas desde otros sistemas operativos
+def ruta_local(archivo_path):
+    return archivo_path.replace("\\", "/").replace("/", os.sep)
+
+# Función para archivar un año fiscal cerrado: mueve certificados y facturas a una base
+# SQLite anual y comprime sus .xlsx en un zip anual
+@con_reintentos
+def archivar_anio(anio):
+    if anio >= datetime.now().year:
+        raise ValueError(f"El año {anio} no está cerrado y no puede archivarse")
+
+    db_path = os.path.join(ARCHIVO_DIR, f"certificados_{anio}.db")
+    zip_path = f"{ARCHIVO_ZIP_DIR}/certificados_{anio}.zip"
+    desde, hasta = f"{anio}-01-01", f"{anio}-12-31"
+    almacenamiento = get_almacenamiento()
+
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT id, archivo_path FROM certificados WHERE fecha >= ? AND fecha <= ?", (desde, hasta))
+        certificados = c.fetchall()
+        if not certificados:
+            return 0
+
+        # 1. Comprimir los informes del año en el zip anual (los informes se descargan en paralelo y el
+        # zip se arma en memoria, a partir del existente si el año ya se había archivado en parte)
+        rutas_archivadas = {}
+        versiones = []
+        for certificado_id, archivo_path in certificados:
+            if not archivo_path:
+                continue
+            clave = normalizar_clave(archivo_path)
+            nombre_interno = clave.removeprefix(f"{CERTIFICADOS_DIR}/")
+            # Junto al Excel se archivan las demás versiones del informe (PDF) con el mismo nombre
+            base_clave, base_interno = os.path.splitext(clave)[0], os.path.splitext(nombre_interno)[0]
+            versiones += [(clave, nombre_interno)] + [(base_clave + extension, base_interno + extension)
+                                                     for extension in EXTENSIONES_INFORME_ADICIONALES]
+            rutas_archivadas[certificado_id] = f"{zip_path}{ZIP_SEPARADOR}{nombre_interno}"
+        contenidos = almacenamiento.leer_varios(clave for clave, _ in versiones)
+        archivos_comprimidos = [clave for clave, _ in versiones if contenidos[clave] is not None]
+        if archivos_comprimidos:
+            zip_buffer = BytesIO(almacenamiento.leer(zip_path) or b"")
+            with zipfile.ZipFile(zip_buffer, "a", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+                nombres_existentes = set(zf.namelist())
+                for clave, nombre_version in versiones:
+                    if contenidos[clave] is not None and nombre_version not in nombres_existentes:
+                        zf.writestr(nombre_version, contenidos[clave])
+                        nombres_existentes.add(nombre_version)
+            almacenamiento.guardar(zip_path, zip_buffer.getvalue())
+
+    # 2. Mover las filas a la base anual en una sola transacción
+        c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("CREATE TABLE IF NOT EXISTS archivo.certificados AS SELECT * FROM main.certificados WHERE 0")
+        c.execute("CREATE TABLE IF NOT EXISTS archivo.facturas AS SELECT * FROM main.facturas WHERE 0")
+        c.execute("CREATE INDEX IF NOT EXISTS archivo.idx_certificados_fecha ON certificados (fecha)")
+        c.execute("CREATE INDEX IF NOT EXISTS archivo.idx_facturas_certificado ON facturas (certificado_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS archivo.idx_facturas_clave ON facturas (clave_factura)")
+        c.execute("""INSERT INTO archivo.certificados SELECT * FROM main.certificados
+                     WHERE fecha >= ? AND fecha <= ?""", (desde, hasta))
+        c.execute("""INSERT INTO archivo.facturas SELECT f.* FROM main.facturas f
+                     JOIN main.certificados c ON f.certificado_id = c.id
+                     WHERE c.fecha >= ? AND c.fecha <= ?""", (desde, hasta))
+        c.executemany("UPDATE archivo.certificados SET archivo_path = ? WHERE id = ?",
+                      [(ruta, certificado_id) for certificado_id, ruta in rutas_archivadas.items()])
+        # En el historial estas filas quedan como 'ARCHIVADO', no como eliminadas
+        _fijar_contexto_historial(c, 'ARCHIVADO')
+        c.execute("""DELETE FROM main.facturas WHERE certificado_id IN
+                     (SELECT id FROM main.certificados WHERE fecha >= ? AND fecha <= ?)""", (desde, hasta))
+        c.execute("DELETE FROM main.certificados WHERE fecha >= ? AND fecha <= ?", (desde, hasta))
+        _fijar_contexto_historial(c, None)
+        c.execute("SELECT COUNT(*) FROM archivo.certificados")
+        total_archivados = c.fetchone()[0]
+        c.execute("""INSERT OR REPLACE INTO archivos_anuales (anio, db_path, zip_path, total_certificados)
+                     VALUES (?, ?, ?, ?)""", (anio, db_path, zip_path, total_archivados))
+        conn.commit()
+        c.execute("DETACH DATABASE archivo")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    # 3. Eliminar los informes sueltos una vez confirmada la transacción
+    almacenamiento.eliminar_varios(archivos_comprimidos)
+
+    return len(certificados)
+
+# Caché LRU de contenidos de informes, compartida por todas las sesiones del proceso (y por la API), con
+# un límite de memoria. Cada entrada guarda la firma del archivo del que salió en el almacenamiento: si el
+# archivo cambia (también desde otra instancia), la entrada deja de servirse. Los contenidos son bytes inmutables que se
+# entregan por referencia, sin copiarlos para cada sesión que los descarga.
+class CacheArchivos:
+    def __init__(self, capacidad_bytes):
+        self.capacidad = capacidad_bytes
+        self.ocupado = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, firma):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] != firma:
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[1]
+
+    def guardar(self, clave, firma, contenido):
+        # Un archivo más grande que toda la caché se sirve sin guardarlo
+        if len(contenido) > self.capacidad:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self.ocupado -= len(anterior[1])
+            self._entradas[clave] = (firma, contenido)
+            self.ocupado += len(contenido)
+            while self.ocupado > self.capacidad:
+                _, (_, expulsado) = self._entradas.popitem(last=False)
+                self.ocupado -= len(expulsado)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.ocupado = 0
+
+cache_archivos = CacheArchivos(int(CACHE_ARCHIVOS_MB * 1024 * 1024))
+
+# Función para separar la ruta de un informe en (clave en el almacenamiento, nombre dentro del zip o None)
+def _ubicar_archivo_certificado(archivo_path):
+    if ZIP_SEPARADOR in archivo_path:
+        zip_path, nombre_interno = archivo_path.split(ZIP_SEPARADOR, 1)
+        return normalizar_clave(zip_path), nombre_interno
+    return normalizar_clave(archivo_path), None
+
+# Nombres de los archivos de un zip anual (el índice del zip se lee una vez por versión del archivo)
+@lru_cache(maxsize=32)
+def _nombres_zip(clave, firma):
+    with zipfile.ZipFile(get_almacenamiento().copia_local(clave)) as zf:
+        return frozenset(zf.namelist())
+
+# Función para saber si existe el informe de un certificado sin leer su contenido
+def existe_archivo_certificado(archivo_path):
+    if not archivo_path:
+        return False
+    clave, nombre_interno = _ubicar_archivo_certificado(archivo_path)
+    firma = get_almacenamiento().firma(clave)
+    if firma is None:
+        return False
+    return nombre_interno is None or nombre_interno in _nombres_zip(clave, firma)
+
+# Función para leer el contenido de un certificado, ya sea un .xlsx suelto o uno archivado en un zip anual
+# (a través de la caché compartida: un informe descargado varias veces se lee del almacenamiento una sola vez)
+def leer_archivo_certificado(archivo_path):
+    if not archivo_path:
+        return None
+    almacenamiento = get_almacenamiento()
+    clave, nombre_interno = _ubicar_archivo_certificado(archivo_path)
+    firma = almacenamiento.firma(clave)
+    if firma is None:
+        return None
+    contenido = cache_archivos.obtener(archivo_path, firma)
+    if contenido is not None:
+        return contenido
+    if nombre_interno is not None:
+        if nombre_interno not in _nombres_zip(clave, firma):
+            return None
+        # Del zip anual solo se descomprime el informe pedido, sobre la copia local del almacenamiento
+        with zipfile.ZipFile(almacenamiento.copia_local(clave)) as zf:
+            contenido = zf.read(nombre_interno)
+    else:
+        contenido = almacenamiento.leer(clave)
+        if contenido is None:
+            return None
+    cache_archivos.guardar(archivo_path, firma, contenido)
+    return contenido
+
+# Función para escribir un informe recién generado y dejarlo en la caché compartida, de modo que su
+# primera descarga no vuelva a leerlo del almacenamiento
+def guardar_archivo_certificado(archivo_path, contenido):
+    guardar_archivos_certificado({archivo_path: contenido})
+
+# Función para escribir a la vez varios informes {archivo_path: contenido} (por ejemplo, los formatos de
+# un certificado): se suben en paralelo y quedan en la caché compartida
+def guardar_archivos_certificado(archivos):
+    almacenamiento = get_almacenamiento()
+    archivos = {archivo_path: bytes(contenido) for archivo_path, contenido in archivos.items()}
+    almacenamiento.guardar_varios({normalizar_clave(archivo_path): contenido
+                                   for archivo_path, contenido in archivos.items()})
+    for archivo_path, contenido in archivos.items():
+        cache_archivos.guardar(archivo_path, almacenamiento.firma(normalizar_clave(archivo_path)), contenido)
+
+
+# Consulta de facturas ya certificadas (en certificados activos) para un lote de claves
+CONSULTA_FACTURAS_CERTIFICADAS = """
+    SELECT f.clave_factura, f.proveedor, f.numero_factura, c.id, c.numero_certificado, o.nombre
+    FROM {esquema}.facturas f
+    JOIN {esquema}.certificados c ON f.certificado_id = c.id
+    JOIN main.obras o ON c.obra_id = o.id
+    WHERE f.clave_factura IN ({placeholders}) AND c.estado = 'Activo' AND c.id IS NOT ?
+"""
+
+# Función para detectar facturas duplicadas, dentro del propio lote y contra todas las
+# facturas ya certificadas (base viva y años archivados), usando el índice de claves normalizadas
+def buscar_facturas_duplicadas(facturas_data, excluir_certificado_id=None):
+    duplicadas = []
+    claves = {}
+    for i, factura in enumerate(facturas_data):
+        if not str(factura['proveedor']).strip() or not str(factura['factura']).strip():
+            continue
+        clave = clave_factura(factura['proveedor'], factura['factura'])
+        if clave in claves:
+            duplicadas.append((i, f"repite la factura No {claves[clave] + 1} de este mismo certificado"))
+        else:
+            claves[clave] = i
+    if not claves:
+        return duplicadas
+
+    placeholders = ','.join(['?'] * len(claves))
+    params = list(claves) + [excluir_certificado_id]
+    conn = conectar()
+    c = conn.cursor()
+    c.execute(CONSULTA_FACTURAS_CERTIFICADAS.format(esquema="main", placeholders=placeholders), params)
+    existentes = c.fetchall()
+    for anio, db_path, _, _, _ in get_anios_archivados():
+        c.execute("ATTACH DATABASE ? AS archivo", (db_path,))
+        c.execute(CONSULTA_FACTURAS_CERTIFICADAS.format(esquema="archivo", placeholders=placeholders), params)
+        existentes.extend(c.fetchall())
+        c.execute("DETACH DATABASE archivo")
+    conn.close()
+
+    for clave, proveedor, numero_factura, certificado_id, numero_certificado, obra_nombre in existentes:
+        duplicadas.append((claves[clave], f"ya fue certificada ({proveedor} - {numero_factura}) en el "
+                                          f"certificado #{numero_certificado} de la obra {obra_nombre} (ID {certificado_id})"))
+    return sorted(duplicadas)
+
+# Función para obtener los mensajes de error por facturas duplicadas
+def validar_facturas_duplicadas(facturas_data, excluir_certificado_id=None):
+    return [f"❌ Factura No {i + 1}: {motivo}"
+            for i, motivo in buscar_facturas_duplicadas(facturas_data, excluir_certificado_id)]
+
+# Reporte de todas las facturas certificadas más de una vez en certificados activos de la base viva
+def reporte_facturas_duplicadas():
+    conn = conectar()
+    reporte = pd.read_sql_query("""
+        SELECT f.clave_factura AS clave, f.proveedor, f.numero_factura, f.importe,
+               c.id AS certificado_id, c.numero_certificado, o.nombre AS obra, c.fecha
+        FROM facturas f
+        JOIN certificados c ON f.certificado_id = c.id
+        JOIN obras o ON c.obra_id = o.id
+        WHERE c.estado = 'Activo' AND f.clave_factura IN (
+            SELECT f2.clave_factura FROM facturas f2
+            JOIN certificados c2 ON f2.certificado_id = c2.id
+            WHERE c2.estado = 'Activo'
+            GROUP BY f2.clave_factura HAVING COUNT(*) > 1)
+        ORDER BY f.clave_factura, c.fecha""", conn)
+    conn.close()
+    return reporte
+
+# Función para guardar certificado en la base de datos (incluyendo estado por defecto)
+@con_reintentos
+def guardar_certificado_db(numero_certificado, obra_id, fecha, contrato, contratista, 
+                          valor_contrato, valor_pagado, total_facturas, facturas_data, archivo_path):
+    conn = conectar()
+    c = conn.cursor()
+    
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        
+        # Insertar certificado con el número específico por obra y estado por defecto 'Activo'
+        c.execute("""INSERT INTO certificados 
+                     (numero_certificado, obra_id, fecha, contrato, contratista, valor_contrato, 
+                      valor_pagado, total_facturas, archivo_path, estado, comentario_estado) 
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                  (numero_certificado, obra_id, fecha, contrato, contratista, 
+                   valor_contrato, valor_pagado, total_facturas, archivo_path, 'Activo', None))
+        
+        certificado_id = c.lastrowid
+        
+        # Insertar facturas
+        _reemplazar_facturas(c, certificado_id, facturas_data)
+        
+        conn.commit()
+        return certificado_id
+    except Exception:
+        conn.rollback()
+        # Relanzar la excepción para que se maneje en el lugar de llamada
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,112 @@
+"""Mide el rendimiento de la API de certificados.
+
+Levanta el servidor en un puerto libre sobre una base temporal con datos de
+prueba y lanza clientes concurrentes con conexiones keep-alive que recorren el
+listado paginado, consultan certificados sueltos y repiten consultas con
+If-None-Match (que deben responderse con 304).
+
+Uso:
+    python benchmarks/api.py --certificados 2000 --clientes 50 --peticiones 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_datos  # noqa: E402
+import api  # noqa: E402
+
+
+def _preparar_base(directorio, certificados):
+    base_datos.DB_NAME = os.path.join(directorio, "api.db")
+    base_datos.init_db()
+    obras = [obra[0] for obra in base_datos.get_all_obras()]
+    for numero in range(1, certificados + 1):
+        facturas = [{'proveedor': f"Proveedor {i}", 'factura': f"{numero}-{i}", 'importe': 100.0, 'codigo': ''}
+                    for i in range(5)]
+        base_datos.guardar_certificado_db(numero, obras[numero % len(obras)], date(2026, 1 + numero % 12, 1),
+                                          "C-1", f"Contratista {numero % 7}", 1000.0, 100.0, 500.0, facturas, None)
+
+
+async def _pedir(lector, escritor, ruta, etag=None):
+    cabeceras = f"If-None-Match: {etag}\r\n" if etag else ""
+    escritor.write(f"GET {ruta} HTTP/1.1\r\nHost: localhost\r\n{cabeceras}\r\n".encode())
+    await escritor.drain()
+    estado = int((await lector.readline()).split()[1])
+    respuesta = {}
+    while True:
+        linea = await lector.readline()
+        if linea == b"\r\n":
+            break
+        nombre, _, valor = linea.decode().partition(":")
+        respuesta[nombre.lower()] = valor.strip()
+    cuerpo = await lector.readexactly(int(respuesta.get('content-length', 0)))
+    return estado, respuesta.get('etag'), cuerpo
+
+
+async def _cliente(puerto, peticiones, certificados, tiempos, estados):
+    lector, escritor = await asyncio.open_connection("127.0.0.1", puerto)
+    cursor, etag_listado = None, None
+    for indice in range(peticiones):
+        tipo = indice % 3
+        if tipo == 0:
+            ruta = "/api/certificados?limite=50" + (f"&cursor={cursor}" if cursor else "")
+            etag = None
+        elif tipo == 1:
+            ruta, etag = f"/api/certificados/{random.randint(1, certificados)}", None
+        else:
+            ruta, etag = "/api/certificados?limite=50&estado=Activo", etag_listado
+        inicio = time.perf_counter()
+        estado, etag_respuesta, cuerpo = await _pedir(lector, escritor, ruta, etag)
+        tiempos.append(time.perf_counter() - inicio)
+        estados[estado] = estados.get(estado, 0) + 1
+        if tipo == 0:
+            cursor = json.loads(cuerpo)['siguiente']
+        elif tipo == 2:
+            etag_listado = etag_respuesta
+    escritor.close()
+
+
+async def _carga(args):
+    servidor = await api.iniciar_servidor("127.0.0.1", 0)
+    puerto = servidor.sockets[0].getsockname()[1]
+    tiempos, estados = [], {}
+    inicio = time.perf_counter()
+    await asyncio.gather(*(_cliente(puerto, args.peticiones, args.certificados, tiempos, estados)
+                           for _ in range(args.clientes)))
+    duracion = time.perf_counter() - inicio
+    servidor.close()
+    await servidor.wait_closed()
+    return tiempos, estados, duracion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--certificados", type=int, default=2000)
+    parser.add_argument("--clientes", type=int, default=50)
+    parser.add_argument("--peticiones", type=int, default=100, help="peticiones por cliente")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        _preparar_base(directorio, args.certificados)
+        tiempos, estados, duracion = asyncio.run(_carga(args))
+        base_datos.cerrar_pool_conexiones()
+
+    tiempos.sort()
+    print(f"{len(tiempos)} peticiones de {args.clientes} clientes en {duracion:.2f} s: "
+          f"{len(tiempos) / duracion:.0f} peticiones/s")
+    print(f"  latencia media {statistics.mean(tiempos) * 1000:.1f} ms · "
+          f"p95 {tiempos[int(len(tiempos) * 0.95)] * 1000:.1f} ms")
+    print(f"  respuestas por código: {dict(sorted(estados.items()))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Prueba de carga de escritura concurrente sobre la base de certificados.
+
+Simula varios oficinistas que, a la vez, crean certificados y editan los mismos
+certificados compartidos usando concurrencia optimista. Al final verifica que no
+se perdió ninguna actualización y que la numeración por obra no tiene huecos ni
+duplicados.
+
+Uso:
+    python benchmarks/concurrencia.py --oficinistas 20 --operaciones 50
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_datos  # noqa: E402
+
+CERTIFICADOS_COMPARTIDOS = 5
+
+
+def _preparar_base(db_path):
+    base_datos.DB_NAME = db_path
+    base_datos.init_db()
+    obra_id = base_datos.get_all_obras()[0][0]
+    compartidos = [base_datos.guardar_certificado_db(numero, obra_id, date.today(), "C-1", "Contratista",
+                                                     1000.0, 0.0, 0.0, [], None)
+                   for numero in range(1, CERTIFICADOS_COMPARTIDOS + 1)]
+    return compartidos
+
+
+def _oficinista(args):
+    db_path, indice, operaciones, compartidos = args
+    base_datos.DB_NAME = db_path
+    obras = [obra[0] for obra in base_datos.get_all_obras()]
+    resultado = {'ediciones': 0, 'conflictos': 0, 'creaciones': 0, 'colisiones_numero': 0}
+
+    for operacion in range(operaciones):
+        if operacion % 2 == 0:
+            # Edición de un certificado compartido: leer, modificar y guardar con la versión leída
+            certificado_id = compartidos[(indice + operacion) % len(compartidos)]
+            while True:
+                cert = base_datos.get_certificado_by_id(certificado_id)
+                try:
+                    base_datos.update_certificado(certificado_id, cert[3], cert[4], cert[5], cert[6], cert[7] + 1,
+                                                  cert[8], cert[11], f"oficinista {indice}", version_esperada=cert[16])
+                    resultado['ediciones'] += 1
+                    break
+                except base_datos.ConflictoEdicion:
+                    resultado['conflictos'] += 1
+        else:
+            # Creación de un certificado nuevo con una factura propia
+            obra_destino = obras[(indice + operacion) % len(obras)]
+            factura = {'proveedor': f"Proveedor {indice}", 'factura': f"{indice}-{operacion}", 'importe': 10.0, 'codigo': ''}
+            while True:
+                numero = base_datos.get_next_certificado_number_por_obra(obra_destino)
+                try:
+                    base_datos.guardar_certificado_db(numero, obra_destino, date.today(), "C-2", f"Oficinista {indice}",
+                                                      500.0, 10.0, 10.0, [factura], None)
+                    resultado['creaciones'] += 1
+                    break
+                except sqlite3.IntegrityError:
+                    resultado['colisiones_numero'] += 1
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--oficinistas", type=int, default=20)
+    parser.add_argument("--operaciones", type=int, default=50, help="operaciones por oficinista")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = os.path.join(directorio, "carga.db")
+        compartidos = _preparar_base(db_path)
+
+        inicio = time.perf_counter()
+        with multiprocessing.Pool(args.oficinistas) as pool:
+            resultados = pool.map(_oficinista, [(db_path, i, args.operaciones, compartidos) for i in range(args.oficinistas)])
+        duracion = time.perf_counter() - inicio
+
+        totales = {clave: sum(r[clave] for r in resultados) for clave in resultados[0]}
+        conn = sqlite3.connect(db_path)
+        marcadores = ", ".join("?" * len(compartidos))
+        pagado, version = conn.execute(f"""SELECT SUM(valor_pagado), SUM(version - 1) FROM certificados
+                                           WHERE id IN ({marcadores})""", compartidos).fetchone()
+        creados = conn.execute("SELECT COUNT(*) FROM certificados").fetchone()[0] - CERTIFICADOS_COMPARTIDOS
+        huecos = conn.execute("""SELECT COUNT(*) FROM (SELECT obra_id, MAX(numero_certificado) - COUNT(*) AS hueco
+                                 FROM certificados GROUP BY obra_id) WHERE hueco != 0""").fetchone()[0]
+        conn.close()
+
+    operaciones = totales['ediciones'] + totales['creaciones']
+    print(f"Oficinistas: {args.oficinistas} · operaciones: {operaciones} en {duracion:.2f} s "
+          f"({operaciones / duracion:.1f} op/s)")
+    print(f"Ediciones: {totales['ediciones']} (conflictos resueltos: {totales['conflictos']}) · "
+          f"creaciones: {totales['creaciones']} (colisiones de número: {totales['colisiones_numero']})")
+
+    errores = []
+    if pagado != totales['ediciones'] or version != totales['ediciones']:
+        errores.append(f"actualizaciones perdidas: {totales['ediciones']} ediciones, valor acumulado {pagado}, versiones {version}")
+    if creados != totales['creaciones']:
+        errores.append(f"se confirmaron {totales['creaciones']} creaciones pero hay {creados} certificados nuevos")
+    if huecos:
+        errores.append(f"{huecos} obra(s) con huecos o duplicados en la numeración")
+    for error in errores:
+        print(f"ERROR: {error}")
+    print("Resultado: OK" if not errores else "Resultado: FALLÓ")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Mide el tiempo de cálculo de los estimados de producción.
+
+Construye un snapshot sintético con el mismo esquema que el analítico (varias
+obras con certificados mensuales durante varios años) y calcula los estimados
+de todas las obras: series mensuales, media móvil, tendencia lineal y fechas
+de terminación.
+
+Uso:
+    python benchmarks/estimados.py --obras 200 --meses 120 --repeticiones 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analitica  # noqa: E402
+
+
+def _snapshot_prueba(obras, meses):
+    rng = np.random.default_rng(0)
+    obra = np.repeat(np.arange(obras), meses)
+    mes = np.tile(np.arange(meses), obras)
+    # Cada obra certifica en la mayoría de los meses, con un ritmo distinto y algo de ruido
+    certifica = rng.random(obras * meses) < 0.8
+    obra, mes = obra[certifica], mes[certifica]
+    pagado = np.clip(1000.0 + 20.0 * obra + rng.normal(0, 150, len(obra)), 0, None)
+    return pd.DataFrame({
+        'id': np.arange(len(obra)),
+        'obra_nombre': pd.Categorical([f"Obra {numero:04d}" for numero in obra]),
+        'contrato': [f"C-{numero}" for numero in obra],
+        'fecha': pd.Timestamp("2015-01-01") + pd.to_timedelta(mes * 30.5, unit="D"),
+        'valor_contrato': 2000.0 * meses,
+        'valor_pagado': pagado,
+        'total_facturas': pagado * 1.1,
+        'estado': pd.Categorical(np.where(rng.random(len(obra)) < 0.95, 'Activo', 'Revertido')),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--obras", type=int, default=200)
+    parser.add_argument("--meses", type=int, default=120)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    df = _snapshot_prueba(args.obras, args.meses)
+    tiempos = []
+    for _ in range(args.repeticiones):
+        inicio = time.perf_counter()
+        estimados = analitica.estimar_produccion(df)
+        tiempos.append(time.perf_counter() - inicio)
+
+    resumen = estimados['resumen']
+    print(f"{len(df)} certificados de {args.obras} obras en {args.meses} meses ({args.repeticiones} repeticiones)")
+    print(f"  estimados de todas las obras: media {statistics.mean(tiempos) * 1000:.1f} ms · "
+          f"máximo {max(tiempos) * 1000:.1f} ms")
+    print(f"  obras con fecha de terminación: {resumen['fin_media_movil'].notna().sum()} por media móvil, "
+          f"{resumen['fin_tendencia'].notna().sum()} por tendencia")
+
+
+if __name__ == "__main__":
+    main()
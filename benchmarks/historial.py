@@ -0,0 +1,88 @@
+"""Mide el costo del historial de cambios en el camino de escritura.
+
+Ejecuta la misma carga (crear certificados con facturas y editarlos) sobre dos
+bases temporales: una con los triggers de historial y otra sin ellos, y compara
+el tiempo medio por operación. También mide la reconstrucción "a fecha X".
+
+Uso:
+    python benchmarks/historial.py --certificados 500 --facturas 10
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_datos  # noqa: E402
+
+
+def _quitar_triggers_historial(db_path):
+    conn = sqlite3.connect(db_path)
+    triggers = [fila[0] for fila in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_historial_%'")]
+    for trigger in triggers:
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.commit()
+    conn.close()
+
+
+def _carga(db_path, certificados, facturas_por_certificado):
+    base_datos.DB_NAME = db_path
+    obra_id = base_datos.get_all_obras()[0][0]
+    tiempos_alta, tiempos_edicion = [], []
+    for numero in range(1, certificados + 1):
+        facturas = [{'proveedor': f"Proveedor {i}", 'factura': f"{numero}-{i}", 'importe': 100.0, 'codigo': ''}
+                    for i in range(facturas_por_certificado)]
+        inicio = time.perf_counter()
+        certificado_id = base_datos.guardar_certificado_db(numero, obra_id, date.today(), "C-1", "Contratista",
+                                                           1000.0, 100.0, 100.0 * len(facturas), facturas, None)
+        tiempos_alta.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        base_datos.update_certificado(certificado_id, date.today(), "C-1", "Contratista", 1000.0, 200.0,
+                                      100.0 * len(facturas), 'Revertido', "revisión", version_esperada=1,
+                                      facturas_data=facturas)
+        tiempos_edicion.append(time.perf_counter() - inicio)
+    return tiempos_alta, tiempos_edicion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--certificados", type=int, default=500)
+    parser.add_argument("--facturas", type=int, default=10, help="facturas por certificado")
+    args = parser.parse_args()
+
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        for modo in ("sin historial", "con historial"):
+            db_path = os.path.join(directorio, f"{modo.replace(' ', '_')}.db")
+            base_datos.DB_NAME = db_path
+            base_datos.init_db()
+            if modo == "sin historial":
+                _quitar_triggers_historial(db_path)
+            resultados[modo] = _carga(db_path, args.certificados, args.facturas)
+
+        # Reconstrucción a fecha sobre la base con historial
+        momento = datetime.now()
+        tiempos_lectura = []
+        for certificado_id in range(1, args.certificados + 1):
+            inicio = time.perf_counter()
+            base_datos.get_certificado_a_fecha(certificado_id, momento)
+            tiempos_lectura.append(time.perf_counter() - inicio)
+
+    print(f"{args.certificados} certificados con {args.facturas} facturas cada uno")
+    for indice, operacion in enumerate(("alta", "edición")):
+        sin = statistics.mean(resultados["sin historial"][indice]) * 1000
+        con = statistics.mean(resultados["con historial"][indice]) * 1000
+        print(f"  {operacion:8s}: sin historial {sin:.3f} ms · con historial {con:.3f} ms · sobrecosto {100 * (con - sin) / sin:+.1f}%")
+    print(f"  reconstrucción a fecha: {statistics.mean(tiempos_lectura) * 1000:.3f} ms de media, "
+          f"p95 {sorted(tiempos_lectura)[int(len(tiempos_lectura) * 0.95)] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
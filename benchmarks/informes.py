@@ -0,0 +1,90 @@
+"""Mide el tiempo de generación de informes en Excel y en PDF.
+
+Renderiza el mismo certificado en cada formato (la primera vez con los recursos
+compartidos sin cargar y luego ya en caché), y regenera un lote de certificados
+guardados en una base temporal, primero en un solo proceso y después repartido
+en varios procesos.
+
+Uso:
+    python benchmarks/informes.py --certificados 200 --facturas 10 --procesos 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_datos  # noqa: E402
+import informes  # noqa: E402
+
+
+def _datos_prueba(facturas_por_certificado):
+    facturas = [{'proveedor': f"Proveedor {i}", 'factura': f"F-{i}", 'importe': 100.0, 'codigo': ''}
+                for i in range(facturas_por_certificado)]
+    return {
+        'fecha': date.today(), 'contrato': "C-1", 'contratista': "Contratista", 'obra': "0001 Obra de prueba",
+        'codigo_obra': "000102", 'nombre_obra': "Obra de prueba", 'aprobacion': "A-1",
+        'valor_contrato': 1000.0, 'valor_pagado': 100.0, 'facturas': facturas,
+        'total_facturas': 100.0 * len(facturas), 'estado': 'Activo', 'comentario_estado': None,
+    }
+
+
+def _medir_formatos(datos, repeticiones):
+    resultados = {}
+    for formato, renderizador in informes.RENDERIZADORES.items():
+        informes._compilar_plantilla.cache_clear()
+        informes._recursos_pdf.cache_clear()
+        inicio = time.perf_counter()
+        renderizador['funcion'](datos, 1)
+        primera = time.perf_counter() - inicio
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            renderizador['funcion'](datos, 1)
+            tiempos.append(time.perf_counter() - inicio)
+        resultados[formato] = (primera, statistics.mean(tiempos))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--certificados", type=int, default=200)
+    parser.add_argument("--facturas", type=int, default=10, help="facturas por certificado")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count())
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    datos = _datos_prueba(args.facturas)
+    por_formato = _medir_formatos(datos, args.repeticiones)
+
+    tiempos_lote = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        base_datos.DB_NAME = os.path.join(directorio, "informes.db")
+        base_datos.init_db()
+        obra_id = base_datos.get_all_obras()[0][0]
+        ids = []
+        for numero in range(1, args.certificados + 1):
+            ruta = os.path.join(directorio, f"certificado_{numero:04d}.xlsx")
+            ids.append(base_datos.guardar_certificado_db(numero, obra_id, date.today(), "C-1", "Contratista",
+                                                         1000.0, 100.0, datos['total_facturas'], datos['facturas'],
+                                                         ruta))
+        for modo, procesos in (("1 proceso", 1), (f"{args.procesos} procesos", args.procesos)):
+            inicio = time.perf_counter()
+            informes.generar_lote(ids, informes.FORMATOS_POR_DEFECTO, procesos)
+            tiempos_lote[modo] = time.perf_counter() - inicio
+
+    print(f"Certificado con {args.facturas} facturas ({args.repeticiones} repeticiones)")
+    for formato, (primera, media) in por_formato.items():
+        print(f"  {informes.RENDERIZADORES[formato]['nombre']:5s}: primera {primera * 1000:.1f} ms · "
+              f"con recursos en caché {media * 1000:.1f} ms")
+    print(f"Lote de {args.certificados} certificados en Excel y PDF")
+    for modo, segundos in tiempos_lote.items():
+        print(f"  {modo:12s}: {segundos:.2f} s ({args.certificados / segundos:.1f} certificados/s)")
+
+
+if __name__ == "__main__":
+    main()
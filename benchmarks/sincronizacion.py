@@ -0,0 +1,148 @@
+"""Prueba de sincronización entre dos sedes con dos bases locales.
+
+Crea una base de sede y una base central en un directorio temporal. En la sede
+da de alta una obra nueva y certificados con facturas, exporta el paquete y lo
+importa en la central. Luego edita y elimina algunos en la sede y sincroniza
+solo esos cambios, reimporta el mismo paquete (no debe cambiar nada) y provoca
+un conflicto editando el mismo certificado en las dos bases. En cada paso
+compara el contenido de ambas bases y mide el tamaño de los paquetes y el
+tiempo de importarlos.
+
+Uso:
+    python benchmarks/sincronizacion.py --certificados 500 --facturas 5 --cambios 50
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import base_datos  # noqa: E402
+import sincronizacion  # noqa: E402
+
+OBRA_SEDE = ("Obra creada en la sede", 901, "A 37-901-24")
+
+
+def _usar_base(db_path):
+    base_datos.DB_NAME = db_path
+    base_datos.init_db()
+
+
+# Contenido comparable de una base: {(código de obra, número): (datos del certificado, facturas)}
+def _contenido(db_path):
+    conn = sqlite3.connect(db_path)
+    certificados = {}
+    for codigo, numero, *datos in conn.execute(
+            """SELECT o.codigo, c.numero_certificado, c.fecha, c.contrato, c.contratista, c.valor_contrato,
+                      c.valor_pagado, c.total_facturas, c.estado, c.id
+               FROM certificados c JOIN obras o ON o.id = c.obra_id"""):
+        facturas = conn.execute("""SELECT proveedor, numero_factura, importe, codigo FROM facturas
+                                   WHERE certificado_id = ? ORDER BY id""", (datos[-1],)).fetchall()
+        certificados[(codigo, numero)] = (tuple(datos[:-1]), facturas)
+    conn.close()
+    return certificados
+
+
+def _sincronizar(sede, central):
+    _usar_base(sede)
+    contenido, resumen_paquete = sincronizacion.generar_paquete()
+    sincronizacion.confirmar_envio(sincronizacion.DESTINO_POR_DEFECTO, resumen_paquete['hasta'])
+    _usar_base(central)
+    inicio = time.perf_counter()
+    resumen = sincronizacion.importar_paquete(contenido)
+    return contenido, resumen_paquete, resumen, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--certificados", type=int, default=500)
+    parser.add_argument("--facturas", type=int, default=5, help="facturas por certificado")
+    parser.add_argument("--cambios", type=int, default=50, help="certificados editados y eliminados en la sede")
+    args = parser.parse_args()
+    # Cada base genera y guarda su propio identificador de sede
+    sincronizacion.SITIO = None
+
+    errores = []
+    with tempfile.TemporaryDirectory() as directorio:
+        sede, central = os.path.join(directorio, "sede.db"), os.path.join(directorio, "central.db")
+        _usar_base(central)
+        _usar_base(sede)
+        obras = [base_datos.get_all_obras()[0][0], base_datos.crear_obra(*OBRA_SEDE)]
+        ids = []
+        for indice in range(args.certificados):
+            obra_id = obras[indice % len(obras)]
+            facturas = [{'proveedor': f"Proveedor {i}", 'factura': f"{indice}-{i}", 'importe': 100.0, 'codigo': ''}
+                        for i in range(args.facturas)]
+            ids.append(base_datos.guardar_certificado_db(
+                base_datos.get_next_certificado_number_por_obra(obra_id), obra_id, date.today(), "C-1",
+                f"Contratista {indice % 7}", 1e6, 100.0, 100.0 * args.facturas, facturas, None))
+
+        # 1. Envío inicial: la central recibe todo y crea la obra nueva
+        _, paquete, resumen, duracion = _sincronizar(sede, central)
+        print(f"Envío inicial: {paquete['certificados']} certificado(s), {paquete['bytes']:,} bytes, "
+              f"importado en {duracion * 1000:.1f} ms")
+        if resumen['obras_creadas'] != [OBRA_SEDE[1]]:
+            errores.append(f"obras creadas en la central: {resumen['obras_creadas']}")
+        catalogo = base_datos.get_catalogo_obras(base_datos.get_version_datos())
+        if OBRA_SEDE[1] not in catalogo['por_codigo']:
+            errores.append("la obra nueva no aparece en el catálogo de la central")
+        if _contenido(sede) != _contenido(central):
+            errores.append("la central no coincide con la sede tras el envío inicial")
+
+        # 2. Envío incremental: solo viajan los certificados editados o eliminados
+        _usar_base(sede)
+        editados, eliminados = ids[:args.cambios], ids[args.cambios:2 * args.cambios]
+        for certificado_id in editados:
+            cert = base_datos.get_certificado_by_id(certificado_id)
+            base_datos.update_certificado(certificado_id, cert[3], cert[4], cert[5], cert[6], cert[7] + 50, cert[8],
+                                          'Revertido', "editado en la sede", version_esperada=cert[16])
+        for certificado_id in eliminados:
+            base_datos.delete_certificado(certificado_id)
+        contenido, paquete, resumen, duracion = _sincronizar(sede, central)
+        print(f"Envío incremental: {paquete['certificados']} certificado(s) y {paquete['eliminados']} eliminación(es), "
+              f"{paquete['bytes']:,} bytes, importado en {duracion * 1000:.1f} ms")
+        if (len(resumen['actualizados']), resumen['eliminados']) != (len(editados), len(eliminados)):
+            errores.append(f"el envío incremental aplicó {len(resumen['actualizados'])} edición(es) y "
+                           f"{resumen['eliminados']} eliminación(es)")
+        if _contenido(sede) != _contenido(central):
+            errores.append("la central no coincide con la sede tras el envío incremental")
+
+        # 3. Reimportar el mismo paquete no cambia nada
+        resumen = sincronizacion.importar_paquete(contenido)
+        if resumen['insertados'] or resumen['actualizados'] or resumen['eliminados'] or resumen['conflictos']:
+            errores.append("reimportar el mismo paquete aplicó cambios")
+
+        # 4. Conflicto: el mismo certificado se edita en la central y en la sede
+        restante = ids[2 * args.cambios]
+        _usar_base(sede)
+        cert = base_datos.get_certificado_by_id(restante)
+        clave = (cert[14], cert[1])
+        base_datos.update_certificado(restante, cert[3], cert[4], cert[5], cert[6], cert[7] + 1, cert[8], cert[11],
+                                      "editado en la sede", version_esperada=cert[16])
+        _usar_base(central)
+        conn = sqlite3.connect(central)
+        local_id = conn.execute("""SELECT c.id FROM certificados c JOIN obras o ON o.id = c.obra_id
+                                   WHERE o.codigo = ? AND c.numero_certificado = ?""", clave).fetchone()[0]
+        conn.close()
+        cert = base_datos.get_certificado_by_id(local_id)
+        base_datos.update_certificado(local_id, cert[3], cert[4], cert[5], cert[6], cert[7] + 2, cert[8], cert[11],
+                                      "editado en la central", version_esperada=cert[16])
+        _, _, resumen, _ = _sincronizar(sede, central)
+        if resumen['conflictos'] != 1 or len(sincronizacion.get_conflictos_sincronizacion()) != 1:
+            errores.append(f"se esperaba 1 conflicto y hubo {resumen['conflictos']}")
+        if _contenido(central)[clave][0][4] != cert[7] + 2:
+            errores.append("el conflicto sobrescribió la versión de la central")
+        print(f"Conflicto detectado: {resumen['conflictos']}")
+
+    for error in errores:
+        print(f"ERROR: {error}")
+    print("Resultado: OK" if not errores else "Resultado: FALLÓ")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Mide el tiempo de validar la consistencia de todos los certificados en una pasada.
+
+Construye tablas sintéticas de certificados y facturas con el mismo esquema que
+lee validacion.cargar_certificados (varias obras con períodos de aprobación,
+contratos y algunas inconsistencias sembradas) y ejecuta todas las reglas.
+
+Uso:
+    python benchmarks/validacion.py --certificados 50000 --facturas 8 --repeticiones 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import validacion  # noqa: E402
+
+
+def _tablas_prueba(total_certificados, facturas_por_certificado, obras=200):
+    rng = np.random.default_rng(0)
+    obra_id = rng.integers(0, obras, total_certificados)
+    fecha = pd.Timestamp("2018-01-01") + pd.to_timedelta(rng.integers(0, 6 * 365, total_certificados), unit="D")
+    inicio_obra = pd.Timestamp("2018-01-01") + pd.to_timedelta(rng.integers(0, 365, obras), unit="D")
+    certificado_id = np.repeat(np.arange(total_certificados), facturas_por_certificado)
+    importe = rng.uniform(10, 1000, len(certificado_id)).round(2)
+    total = np.bincount(certificado_id, weights=importe, minlength=total_certificados)
+    # Un 1 % de los totales no coincide con sus facturas
+    total[rng.random(total_certificados) < 0.01] += 5.0
+    certificados = pd.DataFrame({
+        'id': np.arange(total_certificados),
+        'obra_id': obra_id,
+        'obra': [f"Obra {numero:04d}" for numero in obra_id],
+        'numero_certificado': pd.Series(obra_id).groupby(obra_id).cumcount().to_numpy() + 1,
+        'fecha': fecha.strftime("%Y-%m-%d"),
+        'contrato': [f"C-{numero % 3}" for numero in rng.integers(0, 1000, total_certificados)],
+        'valor_contrato': 1e6,
+        'valor_pagado': rng.uniform(0, 4000, total_certificados).round(2),
+        'total_facturas': total,
+        'estado': np.where(rng.random(total_certificados) < 0.95, 'Activo', 'Revertido'),
+        'aprobacion_desde': inicio_obra[obra_id].strftime("%Y-%m-%d"),
+        'aprobacion_hasta': None,
+    })
+    # Un 0,1 % de las facturas repite el número de otra del mismo proveedor
+    numero = np.arange(len(certificado_id))
+    repetidas = rng.random(len(numero)) < 0.001
+    numero[repetidas] = rng.integers(0, len(numero), repetidas.sum())
+    facturas = pd.DataFrame({
+        'certificado_id': certificado_id,
+        'proveedor': "Proveedor " + (numero % 500).astype(str),
+        'numero_factura': "F-" + numero.astype(str),
+        'importe': importe,
+    })
+    facturas['clave_factura'] = facturas['proveedor'].str.lower() + "|" + facturas['numero_factura']
+    return certificados, facturas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--certificados", type=int, default=50000)
+    parser.add_argument("--facturas", type=int, default=8, help="Facturas por certificado")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    certificados, facturas = _tablas_prueba(args.certificados, args.facturas)
+    tiempos = []
+    for _ in range(args.repeticiones):
+        inicio = time.perf_counter()
+        reporte = validacion.validar_certificados(certificados, facturas)
+        tiempos.append(time.perf_counter() - inicio)
+
+    print(f"{len(certificados)} certificados con {len(facturas)} facturas ({args.repeticiones} repeticiones)")
+    print(f"  todas las reglas: media {statistics.mean(tiempos) * 1000:.1f} ms · máximo {max(tiempos) * 1000:.1f} ms")
+    for codigo, total in reporte.groupby('regla')['certificado_id'].nunique().items():
+        print(f"  {codigo}: {total} certificado(s) con problemas")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,41 @@
 import streamlit as st
 import pandas as pd
-from openpyxl import load_workbook
-from io import BytesIO
 import sqlite3
 import os
 from datetime import datetime
+from functools import partial
+
+from base_datos import (
+    CERTIFICADOS_DIR, ZIP_SEPARADOR, ConflictoEdicion, init_db,
+    get_next_certificado_number_por_obra, get_catalogo_obras, crear_obra, actualizar_obra, eliminar_obra,
+    get_certificado_by_id, get_facturas_editables, update_certificado, delete_certificado,
+    get_certificados_by_obra, buscar_certificados_con_filtros, guardar_certificado_db,
+    get_anios_archivados, get_anios_archivables, es_certificado_archivado, archivar_anio,
+    get_certificado_archivado, get_version_datos, get_indice_certificados, filtrar_indice_certificados,
+    leer_archivo_certificado, existe_archivo_certificado, guardar_archivos_certificado, ruta_local, validar_facturas_duplicadas, reporte_facturas_duplicadas,
+    get_historial_certificado, get_certificado_a_fecha, get_certificados_eliminados,
+)
+from analitica import (
+    get_snapshot_analitico, get_version_snapshot, totales_por_contratista, progreso_pagos_por_obra,
+    tendencia_estados, get_estimados_produccion, proyeccion_obra, MESES_MEDIA_MOVIL, MESES_TENDENCIA,
+)
+from facturas import (
+    CONFIG_COLUMNAS_FACTURAS, facturas_a_df, preparar_facturas, facturas_a_lista, diferencias_facturas,
+)
+from informes import (
+    PLANTILLA_POR_DEFECTO, RENDERIZADORES, FORMATOS_POR_DEFECTO, generar_informes, generar_lote, listar_plantillas,
+    ruta_informe,
+)
+from validacion import REGLAS, reporte_consistencia, validar_cambio_certificado, validar_certificados_guardados
+from sincronizacion import (
+    DESTINO_POR_DEFECTO, generar_paquete, confirmar_envio, importar_paquete, get_conflictos_sincronizacion,
+    resolver_conflicto, get_estado_sincronizacion,
+)
+from mantenimiento import (
+    MANTENIMIENTO_INTERVALO_HORAS, RESPALDOS_CONSERVAR, comparar_latencia, ejecutar_mantenimiento, estado_base_datos,
+    get_error_programado, get_mantenimientos, iniciar_mantenimiento_programado, listar_respaldos,
+)
 
-# Inicializar session state 
-if 'facturas_rows' not in st.session_state:
-    st.session_state.facturas_rows = 1
-    
 # --- NUEVO: Inicializar estado para los filtros de búsqueda avanzada ---
 if 'filtros_aplicados' not in st.session_state:
     st.session_state.filtros_aplicados = False
@@ -31,239 +57,9 @@ def go_to_page(page_name):
     st.rerun()
 # --- FIN NUEVO ---
 
-# Configuración de la base de datos y directorios
-DB_NAME = "certificados.db"
-EXCEL_TEMPLATES_DIR = "data"
-CERTIFICADOS_DIR = "certificados_generados"
-
-# Crear directorios necesarios
-os.makedirs(EXCEL_TEMPLATES_DIR, exist_ok=True)
-os.makedirs(CERTIFICADOS_DIR, exist_ok=True)
-
-# Inicializar la base de datos
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Crear tabla para obras
-    c.execute('''CREATE TABLE IF NOT EXISTS obras (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT UNIQUE NOT NULL,
-        codigo INTEGER NOT NULL,
-        aprobacion TEXT NOT NULL
-    )''')
-    
-    # Crear tabla para certificados (con UNIQUE constraint correcta y nuevos campos para estado)
-    c.execute('''CREATE TABLE IF NOT EXISTS certificados (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        numero_certificado INTEGER NOT NULL,
-        obra_id INTEGER,
-        fecha DATE NOT NULL,
-        contrato TEXT,
-        contratista TEXT,
-        valor_contrato REAL,
-        valor_pagado REAL,
-        total_facturas REAL,
-        archivo_path TEXT,
-        fecha_generacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        -- Nuevos campos para el estado
-        estado TEXT DEFAULT 'Activo', -- 'Activo', 'Revertido', 'Cancelado'
-        comentario_estado TEXT,
-        FOREIGN KEY (obra_id) REFERENCES obras (id),
-        UNIQUE(obra_id, numero_certificado)
-    )''')
-    
-    # Crear tabla para facturas
-    c.execute('''CREATE TABLE IF NOT EXISTS facturas (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        certificado_id INTEGER,
-        proveedor TEXT NOT NULL,
-        numero_factura TEXT NOT NULL,
-        importe REAL NOT NULL,
-        codigo TEXT,
-        FOREIGN KEY (certificado_id) REFERENCES certificados (id)
-    )''')
-    
-    # Insertar obras iniciales si no existen
-    obras_iniciales = [
-        ('Mejoras Cayo Saetía', 759, 'A 37-018-15'),
-        ('Marina Cayo Saetía', 677, 'A 37-024-19'),
-        ('Viviendas Mayarí', 699, 'A 37-037-20'),
-        ('Delfinario Cayo Saetía', 605, 'A 37-025-19'),
-        ('Canal Dumois', 872, 'A 37-038-21')
-    ]
-    
-    for nombre, codigo, aprobacion in obras_iniciales:
-        try:
-            c.execute("INSERT INTO obras (nombre, codigo, aprobacion) VALUES (?, ?, ?)",
-                     (nombre, codigo, aprobacion))
-        except sqlite3.IntegrityError:
-            pass  # La obra ya existe
-    
-    conn.commit()
-    conn.close()
-
-# Función para obtener el siguiente número de certificado PARA UNA OBRA ESPECÍFICA
-def get_next_certificado_number_por_obra(obra_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Obtiene el máximo número de certificado para la obra dada
-    c.execute("SELECT MAX(numero_certificado) FROM certificados WHERE obra_id = ?", (obra_id,))
-    result = c.fetchone()[0]
-    conn.close()
-    # Si no hay certificados para esta obra, el siguiente es 1
-    return (result or 0) + 1
-
-# Función para obtener todas las obras
-def get_all_obras():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT id, nombre, codigo, aprobacion FROM obras ORDER BY nombre")
-    obras = c.fetchall()
-    conn.close()
-    return obras
-
-# Función para obtener un certificado por ID (incluyendo estado)
-def get_certificado_by_id(certificado_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""SELECT c.*, o.nombre as obra_nombre, o.codigo as obra_codigo, o.aprobacion 
-                 FROM certificados c 
-                 JOIN obras o ON c.obra_id = o.id 
-                 WHERE c.id = ?""", (certificado_id,))
-    certificado = c.fetchone()
-    conn.close()
-    return certificado
-
-# Función para obtener facturas de un certificado
-def get_facturas_by_certificado_id(certificado_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT proveedor, numero_factura, importe, codigo FROM facturas WHERE certificado_id = ? ORDER BY id", 
-              (certificado_id,))
-    facturas = c.fetchall()
-    conn.close()
-    return facturas
-
-# Función para actualizar un certificado (incluyendo estado)
-def update_certificado(certificado_id, fecha, contrato, contratista, valor_contrato, valor_pagado, total_facturas, estado, comentario_estado):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""UPDATE certificados 
-                 SET fecha = ?, contrato = ?, contratista = ?, valor_contrato = ?, valor_pagado = ?, total_facturas = ?,
-                     estado = ?, comentario_estado = ?
-                 WHERE id = ?""",
-              (fecha, contrato, contratista, valor_contrato, valor_pagado, total_facturas, estado, comentario_estado, certificado_id))
-    conn.commit()
-    conn.close()
-
-# Función para actualizar facturas de un certificado
-def update_facturas(certificado_id, facturas_data):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Eliminar facturas existentes
-    c.execute("DELETE FROM facturas WHERE certificado_id = ?", (certificado_id,))
-    
-    # Insertar nuevas facturas
-    for factura in facturas_data:
-        c.execute("""INSERT INTO facturas (certificado_id, proveedor, numero_factura, importe, codigo) 
-                     VALUES (?, ?, ?, ?, ?)""",
-                  (certificado_id, factura['proveedor'], factura['factura'], factura['importe'], factura['codigo']))
-    
-    conn.commit()
-    conn.close()
-
-# Función para eliminar un certificado
-def delete_certificado(certificado_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Eliminar primero las facturas asociadas
-    c.execute("DELETE FROM facturas WHERE certificado_id = ?", (certificado_id,))
-    
-    # Luego eliminar el certificado
-    c.execute("DELETE FROM certificados WHERE id = ?", (certificado_id,))
-    
-    conn.commit()
-    conn.close()
-
-# Función para obtener certificados por obra (incluyendo estado)
-def get_certificados_by_obra(obra_id=None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    if obra_id:
-        c.execute("""SELECT c.*, o.nombre as obra_nombre, o.codigo as obra_codigo
-                     FROM certificados c 
-                     JOIN obras o ON c.obra_id = o.id 
-                     WHERE c.obra_id = ? 
-                     ORDER BY c.numero_certificado DESC""", (obra_id,))
-    else:
-        c.execute("""SELECT c.*, o.nombre as obra_nombre, o.codigo as obra_codigo
-                     FROM certificados c 
-                     JOIN obras o ON c.obra_id = o.id 
-                     ORDER BY o.nombre, c.numero_certificado DESC""")
-    
-    certificados = c.fetchall()
-    conn.close()
-    return certificados
-
-# --- FUNCIÓN DE BÚSQUEDA AVANZADA ---
-def buscar_certificados_con_filtros(obras_ids=None, estados=None, fecha_inicio=None, fecha_fin=None, contratista_texto=None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # Consulta base con JOIN para obtener el nombre de la obra
-    query = """
-        SELECT c.*, o.nombre as obra_nombre, o.codigo as obra_codigo
-        FROM certificados c 
-        JOIN obras o ON c.obra_id = o.id 
-        WHERE 1=1
-    """
-    params = []
-    
-    # Añadir filtros dinámicamente si se proporcionan
-    if obras_ids:
-        placeholders = ','.join(['?'] * len(obras_ids))
-        query += f" AND c.obra_id IN ({placeholders})"
-        params.extend(obras_ids)
-        
-    if estados:
-        placeholders = ','.join(['?'] * len(estados))
-        query += f" AND c.estado IN ({placeholders})"
-        params.extend(estados)
-        
-    if fecha_inicio:
-        query += " AND c.fecha >= ?"
-        params.append(fecha_inicio)
-        
-    if fecha_fin:
-        query += " AND c.fecha <= ?"
-        params.append(fecha_fin)
-        
-    if contratista_texto:
-        query += " AND c.contratista LIKE ?"
-        params.append(f'%{contratista_texto}%')
-        
-    query += " ORDER BY o.nombre, c.numero_certificado DESC"
-    
-    c.execute(query, params)
-    certificados = c.fetchall()
-    conn.close()
-    return certificados
-
-# Función para agregar una nueva fila
-def agregar_fila():
-    st.session_state.facturas_rows += 1
-
-# Función para eliminar la última fila
-def eliminar_fila():
-    if st.session_state.facturas_rows > 1:
-        st.session_state.facturas_rows -= 1
-
 # Función para validar campos obligatorios
-def validar_campos_obligatorios(fecha, obra_seleccionada, facturas_data):
+# (errores_facturas son los de cada fila, ya calculados por preparar_facturas)
+def validar_campos_obligatorios(fecha, obra_seleccionada, facturas_data, errores_facturas, certificado_id=None):
     errores = []
     
     # Validar fecha
@@ -278,148 +74,43 @@ def validar_campos_obligatorios(fecha, obra_seleccionada, facturas_data):
     if len(facturas_data) == 0:
         errores.append("❌ Debe agregar al menos una factura")
     else:
-        for i, factura in enumerate(facturas_data):
-            factura_num = i + 1
-            if not factura['proveedor'].strip():
-                errores.append(f"❌ Factura No {factura_num}: Debe ingresar el proveedor")
-            if not factura['factura'].strip():
-                errores.append(f"❌ Factura No {factura_num}: Debe ingresar el número de factura")
-            if factura['importe'] <= 0:
-                errores.append(f"❌ Factura No {factura_num}: El importe debe ser mayor que 0")
+        errores.extend(errores_facturas)
+        
+        # Validar que ninguna factura haya sido certificada antes
+        errores.extend(validar_facturas_duplicadas(facturas_data, certificado_id))
     
     return errores
 
-# Función para crear el informe en Excel (actualizada para mostrar estado)
-def generar_informe_excel(datos, numero_certificado):
-    try:
-        # Cargar la plantilla 
-        wb = load_workbook('data/ejemplo.xlsx')
-        ws = wb.active
-        
-        # Llenar los datos en las celdas correspondientes
-        
-        # Colocar el número de certificado consecutivo 
-        ws['E11'] = numero_certificado
-        
-        # Fecha 
-        if datos['fecha']:
-            ws['E6'] = datos['fecha']
-            
-        # Contrato 
-        if datos['contrato']:
-            ws['B13'] = datos['contrato']
-            
-        # Contratista 
-        if datos['contratista']:
-            ws['B16'] = datos['contratista']
-            
-        # Obra 
-        if datos['obra']:
-            ws['B16'] = datos['obra']
-        
-        if datos['codigo_obra'] is not None: # Verificar que el código de obra exista
-            ws['E18'] = f"{datos['codigo_obra']}"
-            
-        # Aprobación (celda A19 en la imagen)
-        if datos['aprobacion']:
-            ws['B18'] = datos['aprobacion']
-            ws['C32'] = datos['aprobacion']
-            
-        # Valor total contrato (celda A23 en la imagen)
-        if datos['valor_contrato']:
-            ws['C20'] = f"{datos['valor_contrato']:,.2f}"
-            
-        # Valor pagado (celda A25 en la imagen)
-        if datos['valor_pagado']:
-            ws['C22'] = f"{datos['valor_pagado']:,.2f}"
-            
-        # Insertar las facturas comenzando desde la fila 28 (ajusta según tu plantilla)
-        fila_inicio_facturas = 26
-        for i, factura in enumerate(datos['facturas']):
-            fila = fila_inicio_facturas + i
-            if fila <= ws.max_row:
-                ws[f'A{fila}'] = factura['proveedor']
-                ws[f'C{fila}'] = factura['factura']
-                ws[f'E{fila}'] = factura['importe']
-                ws[f'F{fila}'] = factura['codigo']
-            else:
-                # Si hay más filas, agregarlas
-                ws.append([factura['proveedor'], factura['factura'], factura['importe'], factura['codigo']])
-        
-        # Total de facturas (celda E35 en la imagen, aproximadamente)
-        ws['E32'] = f"{datos['total_facturas']:,.2f} CUP"
-        
-        # --- NUEVO: Mostrar estado y comentario en el informe ---
-        if 'estado' in datos and datos['estado'] != 'Activo':
-            from openpyxl.styles import Font, Alignment, Border, Side
-            
-            # Para asegurar que se vea bien, fusionamos celdas
-            celda_inicio = 'B40'
-            celda_fin = 'F42'
-            ws.merge_cells(f'{celda_inicio}:{celda_fin}')
-            cell = ws[celda_inicio]
-            cell.value = f"⚠️ ESTADO DEL CERTIFICADO: {datos['estado']}\n\n📝 Comentario: {datos.get('comentario_estado', 'Ninguno')}"
-            cell.font = Font(bold=True, color="FF0000", size=12)
-            cell.alignment = Alignment(wrap_text=True, vertical='top')
-            
-            # Agregar un borde rojo para hacerlo más visible
-            thin_border = Border(
-                left=Side(style='thin', color='FF0000'),
-                right=Side(style='thin', color='FF0000'),
-                top=Side(style='thin', color='FF0000'),
-                bottom=Side(style='thin', color='FF0000')
-            )
-            for row in ws[f'{celda_inicio}:{celda_fin}']:
-                for c in row:
-                    c.border = thin_border
-                    
-        # --- FIN NUEVO ---
-        
-        # Guardar el archivo en memoria
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        return output
-    except Exception as e:
-        st.error(f"Error al generar el informe: {str(e)}")
-        return None
-
-# Función para guardar certificado en la base de datos (incluyendo estado por defecto)
-def guardar_certificado_db(numero_certificado, obra_id, fecha, contrato, contratista, 
-                          valor_contrato, valor_pagado, total_facturas, facturas_data, archivo_path):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    try:
-        # Insertar certificado con el número específico por obra y estado por defecto 'Activo'
-        c.execute("""INSERT INTO certificados 
-                     (numero_certificado, obra_id, fecha, contrato, contratista, valor_contrato, 
-                      valor_pagado, total_facturas, archivo_path, estado, comentario_estado) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                  (numero_certificado, obra_id, fecha, contrato, contratista, 
-                   valor_contrato, valor_pagado, total_facturas, archivo_path, 'Activo', None))
-        
-        certificado_id = c.lastrowid
-        
-        # Insertar facturas
-        for factura in facturas_data:
-            c.execute("""INSERT INTO facturas (certificado_id, proveedor, numero_factura, importe, codigo) 
-                         VALUES (?, ?, ?, ?, ?)""",
-                      (certificado_id, factura['proveedor'], factura['factura'], 
-                       factura['importe'], factura['codigo']))
-        
-        conn.commit()
-        conn.close()
-        return certificado_id
-    except sqlite3.IntegrityError as e:
-        conn.rollback()
-        conn.close()
-        # Relanzar la excepción para que se maneje en el lugar de llamada
-        raise e
-
-# Inicializar la base de datos
-init_db()
+# Máximo de certificados que se envían al navegador en un selector (el resto se alcanza escribiendo)
+LIMITE_OPCIONES_SELECTOR = 50
+
+# Selector de certificados con búsqueda: las opciones se filtran aquí con el índice de etiquetas
+# y solo las coincidencias llegan al navegador. Devuelve el id del certificado elegido (o None).
+def selector_certificados(etiqueta, clave, ids_permitidos=None, incluir_archivados=True):
+    indice = get_indice_certificados(get_version_datos())
+    texto = st.text_input("🔎 Buscar certificado", key=f"{clave}_busqueda",
+                          placeholder="Número, obra, código, fecha o estado")
+    ids, total = filtrar_indice_certificados(indice, texto, ids_permitidos, incluir_archivados,
+                                             LIMITE_OPCIONES_SELECTOR)
+    if total > len(ids):
+        st.caption(f"Mostrando {len(ids)} de {total} certificados; escriba para acotar la búsqueda.")
+    elif texto and not ids:
+        st.caption("Ningún certificado coincide con la búsqueda.")
+    return st.selectbox(etiqueta, ids, format_func=indice['etiquetas'].__getitem__, key=clave)
+
+# Función para obtener un certificado por id, en la base viva o en los años archivados
+def buscar_certificado(certificado_id):
+    return get_certificado_by_id(certificado_id) or get_certificado_archivado(certificado_id)[0]
+
+# Inicializar la base de datos una sola vez por proceso (no en cada rerun de cada sesión),
+# para no competir por el bloqueo de escritura con los demás usuarios
+@st.cache_resource(show_spinner=False)
+def inicializar_base_datos():
+    init_db()
+    # El mantenimiento programado corre en un hilo del proceso, sin bloquear a los usuarios
+    iniciar_mantenimiento_programado()
+
+inicializar_base_datos()
 
 # ==================== INTERFAZ DE USUARIO ====================
 
@@ -442,7 +133,13 @@ with st.sidebar:
     pages = {
         "🏠 Crear Nuevo Certificado": "crear",
         "📋 Ver Certificados": "ver",
-        "✏️ Editar Certificado": "editar"
+        "✏️ Editar Certificado": "editar",
+        "🏢 Administrar Obras": "obras",
+        "🗄️ Archivo Histórico": "archivo",
+        "📈 Análisis": "analisis",
+        "🕓 Historial": "historial",
+        "🔄 Sincronización": "sincronizacion",
+        "🧰 Mantenimiento": "mantenimiento"
     }
     
     # Obtener la página actual de los query params, por defecto es "crear"
@@ -474,6 +171,11 @@ with st.sidebar:
     st.markdown("---")
     st.info("Sistema de gestión de certificados para obras de construcción")
 
+# Al salir de la página de edición se descarta el certificado en edición y su versión
+if menu_opcion != "✏️ Editar Certificado":
+    for key in ['edit_cert_id', 'edit_version', 'edit_facturas_originales', 'conflicto_edicion']:
+        st.session_state.pop(key, None)
+
 if menu_opcion == "🏠 Crear Nuevo Certificado":
     st.title("📄 Crear Nuevo Certificado")
     
@@ -506,45 +208,31 @@ if menu_opcion == "🏠 Crear Nuevo Certificado":
     # Sección de información de la obra
     st.subheader("🏗️ Información de la Obra")
     with st.container():
-        # Obtener obras de la base de datos
-        data_obras = pd.DataFrame(
-            {
-            "Obras": ['Mejoras Cayo Saetía', 'Marina Cayo Saetía', 'Viviendas Mayarí', 'Delfinario Cayo Saetía', 'Canal Dumois'], 
-            "Código de Obra": [759, 677, 699, 605, 872],
-            "Aprobación": ['A 37-018-15', 'A 37-024-19', 'A 37-037-20', 'A 37-025-19', 'A 37-038-21'],   
-            })
+        # Obtener obras del catálogo cacheado de la base de datos
+        catalogo_obras = get_catalogo_obras(get_version_datos())
 
-        obras = st.selectbox('Obra',data_obras["Obras"], index=None, placeholder="Despliegue y seleccione una Obra")
+        obras = st.selectbox('Obra', list(catalogo_obras['por_nombre']), index=None, placeholder="Despliegue y seleccione una Obra")
 
         # Variables para almacenar datos de la obra seleccionada
         codigo_obra = None
         nombre_obra = None
         aprobacion = None
         obra_id = None
+        plantilla_obra = None
 
         # Cuando se selecciona una obra
         if obras:
-            # Filtrar el DataFrame por la obra seleccionada
-            obra_seleccionada = data_obras[data_obras["Obras"] == obras]
-            
+            # Buscar la obra seleccionada en el índice por nombre
+            obra_seleccionada = catalogo_obras['por_nombre'].get(obras)
+
             # Verificar que se encontró la obra
-            if not obra_seleccionada.empty:
-                # Obtener el código de obra seleccionada
-                codigo_obra = obra_seleccionada["Código de Obra"].iloc[0]
-                nombre_obra = obra_seleccionada["Obras"].iloc[0]
-                
-                # Obtener ID de la obra de la base de datos
-                obras_db = get_all_obras()
-                for obra_db in obras_db:
-                    if obra_db[1] == nombre_obra and obra_db[2] == codigo_obra:
-                        obra_id = obra_db[0]
-                        break
-                
+            if obra_seleccionada:
+                obra_id, nombre_obra, codigo_obra, aprobacion, plantilla_obra, _, _ = obra_seleccionada
+
                 # Mostrar información de la obra seleccionada
                 st.info(f"**Obra seleccionada:** {codigo_obra} - {nombre_obra}")
-                
-                # Obtener la Aprobación de la obra en cuestión
-                aprobacion = obra_seleccionada["Aprobación"].iloc[0]  
+
+                # Mostrar la Aprobación de la obra en cuestión
                 st.info(f"**Aprobación:** {aprobacion}")
                 st.info(f"**Código de Obra:** {codigo_obra}02")
             else:
@@ -578,55 +266,21 @@ if menu_opcion == "🏠 Crear Nuevo Certificado":
     # Sección de facturas
     st.subheader("📋 Facturas")
     with st.container():
-        # Botones para agregar/eliminar filas
-        col_btn1, col_btn2, col_btn3 = st.columns([1, 1, 3])
-        with col_btn1:
-            st.button("➕ Agregar Factura", on_click=agregar_fila, type="primary")
-        with col_btn2:
-            st.button("➖ Eliminar Factura", on_click=eliminar_fila, type="secondary")
-        with col_btn3:
-            st.write("")
-
-        st.divider()
-
-        # Listas para almacenar datos de facturas
-        facturas_data = []
-
-        # Crear las filas de facturas
-        for i in range(st.session_state.facturas_rows):
-            st.markdown(f"**Factura No {i+1}**")
-            proovedores, facturas, importe, codigo = st.columns([2, 2, 1.5, 1])
-            
-            with proovedores:
-                proveedor_val = st.text_input(f"Proveedor", key=f"proveedor_{i}")
-                
-            with facturas:
-                factura_val = st.text_input(f"Factura", key=f"factura_{i}")
-                
-            with importe:
-                importe_factura = st.number_input(f"Importe", 
-                                                format="%.2f", 
-                                                step=1000.0,
-                                                key=f"importe_{i}")
-                # Mostrar importe formateado
-                if importe_factura > 0:
-                    st.caption(f"{importe_factura:,.2f} CUP")
-            
-            with codigo:
-                codigo_val = st.text_input(f"Código", key=f"codigo_{i}")
-            
-            # Almacenar datos de la factura
-            facturas_data.append({
-                'proveedor': proveedor_val,
-                'factura': factura_val,
-                'importe': importe_factura,
-                'codigo': codigo_val
-            })
-            
-            st.divider()
+        # Tabla editable de facturas: se pueden agregar filas al final o pegar un bloque copiado de Excel
+        st.caption("Agregue filas al final de la tabla o pegue (Ctrl+V) un rango copiado de Excel con las columnas "
+                   "Proveedor, Factura, Importe y Código.")
+        facturas_grid = st.data_editor(
+            facturas_a_df(),
+            key="facturas_grid",
+            num_rows="dynamic",
+            column_config=CONFIG_COLUMNAS_FACTURAS,
+            use_container_width=True,
+            hide_index=True,
+        )
 
-        # Calcular y mostrar el total de todas las facturas
-        total_facturas = sum(f['importe'] for f in facturas_data)
+        # Validar todas las filas y calcular el total en una sola pasada
+        facturas_df, errores_facturas, total_facturas = preparar_facturas(facturas_grid)
+        facturas_data = facturas_a_lista(facturas_df)
 
         # Mostrar el total formateado
         st.markdown("---")
@@ -660,9 +314,13 @@ if menu_opcion == "🏠 Crear Nuevo Certificado":
     with st.container():
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            if st.button("📄 Generar Informe en Excel", type="primary", use_container_width=True):
+            if st.button("📄 Generar Informe (Excel y PDF)", type="primary", use_container_width=True):
                 # Validar campos obligatorios
-                errores = validar_campos_obligatorios(fecha, obras, facturas_data)
+                errores = validar_campos_obligatorios(fecha, obras, facturas_data, errores_facturas)
+                # Reglas de consistencia frente a los demás certificados de la obra (contrato, aprobación)
+                if not errores and obra_id:
+                    errores = validar_cambio_certificado(obra_id, fecha, contrato, valor_contrato, valor_pagado,
+                                                         total_facturas, facturas_data)
                 
                 if errores:
                     # Mostrar errores
@@ -686,6 +344,7 @@ if menu_opcion == "🏠 Crear Nuevo Certificado":
                             'codigo_obra': f"{codigo_obra}02" if codigo_obra else "",
                             'nombre_obra': nombre_obra,
                             'aprobacion': aprobacion,
+                            'plantilla': plantilla_obra,
                             'valor_contrato': valor_contrato,
                             'valor_pagado': valor_pagado,
                             'facturas': facturas_data,
@@ -695,35 +354,49 @@ if menu_opcion == "🏠 Crear Nuevo Certificado":
                             'comentario_estado': None
                         }
                         
-                        # Generar el informe
-                        excel_data = generar_informe_excel(datos_informe, numero_certificado)
+                        # Generar el informe en todos los formatos a la vez
+                        try:
+                            informes = generar_informes(datos_informe, numero_certificado, FORMATOS_POR_DEFECTO)
+                        except Exception as e:
+                            st.error(f"Error al generar el informe: {e}")
+                            informes = None
                         
-                        if excel_data:
-                            # Crear directorio para la obra si no existe
-                            obra_dir = os.path.join(CERTIFICADOS_DIR, nombre_obra.replace("/", "_").replace("\\", "_"))
-                            os.makedirs(obra_dir, exist_ok=True)
-                            
-                            # Guardar archivo físico con el nombre que incluye el número de certificado
+                        if informes:
+                            # Ruta del archivo en el almacenamiento, con el nombre que incluye el número de certificado
+                            # (en la base de datos se guarda la ruta del Excel; el PDF va al lado con el mismo nombre)
+                            carpeta_obra = nombre_obra.replace("/", "_").replace("\\", "_")
+                            obra_dir = f"{CERTIFICADOS_DIR}/{carpeta_obra}"
                             filename = f"certificado_{numero_certificado:04d}.xlsx"
-                            file_path = os.path.join(obra_dir, filename)
+                            file_path = f"{obra_dir}/{filename}"
                             
-                            with open(file_path, "wb") as f:
-                                f.write(excel_data.getvalue())
+                            # Guardar primero en base de datos: si otro usuario tomó el mismo número
+                            # a la vez, la restricción UNIQUE lo detecta antes de sobrescribir su archivo
+                            try:
+                                certificado_id = guardar_certificado_db(
+                                    numero_certificado, obra_id, fecha, contrato, contratista,
+                                    valor_contrato, valor_pagado, total_facturas, facturas_data, file_path
+                                )
+                            except sqlite3.IntegrityError:
+                                st.error(f"❌ Otro usuario acaba de generar el certificado #{numero_certificado} para esta obra. "
+                                         "Por favor genere el informe nuevamente.")
+                                st.stop()
                             
-                            # Guardar en base de datos
-                            certificado_id = guardar_certificado_db(
-                                numero_certificado, obra_id, fecha, contrato, contratista,
-                                valor_contrato, valor_pagado, total_facturas, facturas_data, file_path
-                            )
+                            # Los formatos se suben a la vez al almacenamiento
+                            guardar_archivos_certificado({ruta_informe(file_path, formato): contenido.getvalue()
+                                                          for formato, contenido in informes.items()})
                             
-                            # Ofrecer el archivo para descargar
-                            st.download_button(
-                                label="📥 Descargar Informe",
-                                data=excel_data,
-                                file_name=filename,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                use_container_width=True
-                            )
+                            # Ofrecer los archivos para descargar: se leen (de la caché compartida) solo al pulsar
+                            columnas_descarga = st.columns(len(informes))
+                            for columna, formato in zip(columnas_descarga, informes):
+                                with columna:
+                                    st.download_button(
+                                        label=f"📥 Descargar {RENDERIZADORES[formato]['nombre']}",
+                                        data=partial(leer_archivo_certificado, ruta_informe(file_path, formato)),
+                                        file_name=os.path.basename(ruta_informe(file_path, formato)),
+                                        mime=RENDERIZADORES[formato]['mime'],
+                                        on_click="ignore",
+                                        use_container_width=True
+                                    )
                             st.success(f"✅ Certificado #{numero_certificado} para la obra '{nombre_obra}' generado correctamente!")
                         else:
                             st.error("❌ Error al generar el informe. Por favor intente nuevamente.")
@@ -736,7 +409,7 @@ elif menu_opcion == "📋 Ver Certificados":
         st.markdown("Usa los siguientes filtros para refinar tu búsqueda.")
         
         # Obtener todas las obras para el multiselect
-        obras_db = get_all_obras()
+        obras_db = get_catalogo_obras(get_version_datos())['obras']
         opciones_obras = {f"{obra[1]} ({obra[2]})": obra[0] for obra in obras_db} # nombre (codigo): id
 
         col1, col2 = st.columns(2)
@@ -869,11 +542,7 @@ elif menu_opcion == "📋 Ver Certificados":
         
         selected_cert = None
         if 'selected_cert_id' in st.session_state:
-            cert_id = st.session_state.selected_cert_id
-            for cert in certificados:
-                if cert[0] == cert_id:
-                    selected_cert = cert
-                    break
+            selected_cert = buscar_certificado(st.session_state.selected_cert_id)
             
             if selected_cert:
                 st.success(f"Certificado seleccionado: #{selected_cert[1]} - {selected_cert[13]} ({selected_cert[14]}) - {selected_cert[3]}")
@@ -881,7 +550,9 @@ elif menu_opcion == "📋 Ver Certificados":
                 st.error("Certificado no encontrado. Por favor, verifique el ID.")
                 del st.session_state.selected_cert_id
         
-        if selected_cert:
+        if selected_cert and es_certificado_archivado(selected_cert):
+            st.info("🗄️ Este certificado pertenece a un año fiscal archivado y es de solo lectura.")
+        elif selected_cert:
             cert_id = selected_cert[0]
             cert_numero = selected_cert[1]
             cert_obra = selected_cert[13]
@@ -924,25 +595,31 @@ elif menu_opcion == "📋 Ver Certificados":
         
         st.markdown("---")
         st.subheader("📥 Descargar Certificado")
-        certificado_id_seleccion = st.selectbox(
-            "Seleccione un certificado para descargar:",
-            options=certificados,
-            format_func=lambda x: f"#{x[1]} - {x[13]} ({x[14]}) - {x[3]} - [{x[11] if len(x) > 11 else 'N/A'}]"
-        )
+        # Solo se ofrecen los certificados del resultado de la búsqueda actual
+        certificado_id = selector_certificados("Seleccione un certificado para descargar:", "descarga_certificado",
+                                               ids_permitidos={cert[0] for cert in certificados})
+        certificado_descarga = buscar_certificado(certificado_id) if certificado_id else None
         
-        if certificado_id_seleccion:
-            certificado_id = certificado_id_seleccion[0]
-            archivo_path = certificado_id_seleccion[9]
+        if certificado_descarga:
+            archivo_path = certificado_descarga[9]
             
-            if os.path.exists(archivo_path):
-                with open(archivo_path, "rb") as file:
-                    st.download_button(
-                        label="📥 Descargar Certificado Seleccionado",
-                        data=file,
-                        file_name=os.path.basename(archivo_path),
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True
-                    )
+            # Descargar cada formato disponible del certificado (los anteriores al PDF solo tienen Excel).
+            # El archivo no se lee en cada rerun: solo cuando se pulsa el botón.
+            formatos_disponibles = [(formato, ruta_informe(archivo_path, formato)) for formato in FORMATOS_POR_DEFECTO
+                                    if existe_archivo_certificado(ruta_informe(archivo_path, formato))]
+            
+            if formatos_disponibles:
+                columnas_descarga = st.columns(len(formatos_disponibles))
+                for columna, (formato, ruta_formato) in zip(columnas_descarga, formatos_disponibles):
+                    with columna:
+                        st.download_button(
+                            label=f"📥 Descargar {RENDERIZADORES[formato]['nombre']}",
+                            data=partial(leer_archivo_certificado, ruta_formato),
+                            file_name=os.path.basename(ruta_local(ruta_formato.split(ZIP_SEPARADOR)[-1])),
+                            mime=RENDERIZADORES[formato]['mime'],
+                            on_click="ignore",
+                            use_container_width=True
+                        )
             else:
                 st.warning("Archivo no encontrado. Puede que haya sido movido o eliminado.")
     else:
@@ -956,26 +633,24 @@ elif menu_opcion == "✏️ Editar Certificado":
     certificado_id = None
 
     # Ruta A: Viniendo desde "Ver Certificados" a través del estado de la sesión
+    # (se conserva mientras se permanece en la página, para que los reruns sigan editando el mismo certificado)
     if 'edit_cert_id' in st.session_state:
         certificado_id = st.session_state.edit_cert_id
-        # Limpiamos el estado inmediatamente después de usarlo para evitar conflictos
-        del st.session_state.edit_cert_id
+        if st.button("↩️ Elegir otro certificado"):
+            for key in ['edit_cert_id', 'edit_version', 'edit_facturas_originales', 'conflicto_edicion']:
+                st.session_state.pop(key, None)
+            st.rerun()
 
     # Ruta B: Viniendo directamente desde el menú lateral
     else:
         st.subheader("Seleccionar un certificado para editar")
-        todos_los_certificados = get_certificados_by_obra()
+        # Los certificados de años archivados son de solo lectura y no se ofrecen
+        certificado_id = selector_certificados("Seleccione un certificado:", "editar_certificado_seleccion",
+                                               incluir_archivados=False)
         
-        if not todos_los_certificados:
+        if not certificado_id:
             st.info("📭 No hay certificados disponibles para editar.")
             st.stop()
-        
-        certificado_seleccionado_tuple = st.selectbox(
-            "Seleccione un certificado:",
-            options=todos_los_certificados,
-            format_func=lambda x: f"#{x[1]} - {x[13]} ({x[14]}) - {x[3]} - [{x[11] if len(x) > 11 else 'N/A'}]"
-        )
-        certificado_id = certificado_seleccionado_tuple[0]
 
     # --- OBTENER LOS DATOS Y PREPARAR VARIABLES ---
     # Ahora, sin importar la ruta, tenemos un certificado_id. Obtenemos los datos UNA SOLA VEZ.
@@ -993,8 +668,16 @@ elif menu_opcion == "✏️ Editar Certificado":
         estado_actual = certificado_data[11] if len(certificado_data) > 11 else 'Activo'
         comentario_actual = certificado_data[12] if len(certificado_data) > 12 else ''
         
-        # Obtener las facturas asociadas
-        facturas_data = get_facturas_by_certificado_id(certificado_id)
+        # Versión con la que se empezó a editar: se conserva entre reruns para detectar
+        # si otro usuario guarda cambios sobre el mismo certificado mientras tanto
+        if st.session_state.get('edit_version', (None, None))[0] != certificado_id:
+            st.session_state.edit_version = (certificado_id, certificado_data[16])
+            # Facturas tal como estaban en esa versión: la tabla se edita sobre ellas y al guardar
+            # solo se envían las filas que cambiaron
+            st.session_state.edit_facturas_originales = facturas_a_df(get_facturas_editables(certificado_id))
+            st.session_state.pop('conflicto_edicion', None)
+        version_edicion = st.session_state.edit_version[1]
+        facturas_originales = st.session_state.edit_facturas_originales
 
         # --- AHORA CONSTRUIMOS LA INTERFAZ ---
         st.markdown(f"### 📝 Editando Certificado #{numero_certificado} - Obra: {obra_nombre} ({obra_codigo})")
@@ -1021,52 +704,533 @@ elif menu_opcion == "✏️ Editar Certificado":
         with col2:
             contratista_edit = st.text_input("Contratista:", value=certificado_data[5] or "")
             valor_pagado_edit = st.number_input("Valor Pagado:", value=float(certificado_data[7] or 0.0), format="%.2f")
-            total_facturas_edit = st.number_input("Total Facturas:", value=float(certificado_data[8] or 0.0), format="%.2f")
         
         st.markdown("---")
         st.subheader("📋 Facturas")
         
-        # Editor de facturas
-        facturas_edit_data = []
-        for i, factura in enumerate(facturas_data):
-            st.markdown(f"**Factura {i+1}**")
-            col_prov, col_fact, col_imp, col_cod = st.columns(4)
-            
-            with col_prov:
-                proveedor = st.text_input(f"Proveedor {i+1}", value=factura[0], key=f"edit_prov_{i}")
-            with col_fact:
-                numero_fact = st.text_input(f"Factura {i+1}", value=factura[1], key=f"edit_fact_{i}")
-            with col_imp:
-                importe = st.number_input(f"Importe {i+1}", value=float(factura[2]), format="%.2f", key=f"edit_imp_{i}")
-            with col_cod:
-                codigo = st.text_input(f"Código {i+1}", value=factura[3] or "", key=f"edit_cod_{i}")
-            
-            facturas_edit_data.append({
-                'proveedor': proveedor,
-                'factura': numero_fact,
-                'importe': importe,
-                'codigo': codigo
-            })
+        # Editor de facturas (admite pegar un rango copiado de Excel)
+        facturas_grid = st.data_editor(
+            facturas_originales,
+            key=f"edit_{certificado_id}_facturas",
+            num_rows="dynamic",
+            column_config=CONFIG_COLUMNAS_FACTURAS,
+            use_container_width=True,
+            hide_index=True,
+        )
+        
+        # Validar todas las filas y calcular el total en una sola pasada
+        facturas_edit_df, errores_facturas, total_facturas_edit = preparar_facturas(facturas_grid)
+        facturas_edit_data = facturas_a_lista(facturas_edit_df)
+        st.markdown(f"**TOTAL DE FACTURAS: {total_facturas_edit:,.2f} CUP**")
         
         # Botón para guardar cambios
         st.markdown("---")
         if st.button("💾 Guardar Cambios", type="primary", use_container_width=True):
             # Validar datos
-            if total_facturas_edit <= 0:
+            errores_duplicadas = validar_facturas_duplicadas(facturas_edit_data, certificado_id) if estado_edit == 'Activo' else []
+            errores_consistencia = validar_cambio_certificado(
+                certificado_data[2], fecha_edit, contrato_edit, valor_contrato_edit, valor_pagado_edit,
+                total_facturas_edit, facturas_edit_data, estado=estado_edit, certificado_id=certificado_id)
+            if errores_facturas:
+                st.error("🚨 Por favor corrija los siguientes errores en las facturas:")
+                for error in errores_facturas:
+                    st.write(error)
+            elif total_facturas_edit <= 0:
                 st.error("El total de facturas debe ser mayor que 0")
+            elif errores_duplicadas:
+                st.error("🚨 Hay facturas que ya fueron certificadas:")
+                for error in errores_duplicadas:
+                    st.write(error)
+            elif errores_consistencia:
+                st.error("🚨 El certificado no es consistente con su obra:")
+                for error in errores_consistencia:
+                    st.write(error)
             else:
-                # Actualizar certificado (incluyendo estado y comentario)
-                update_certificado(certificado_id, fecha_edit, contrato_edit, contratista_edit,
-                                     valor_contrato_edit, valor_pagado_edit, total_facturas_edit,
-                                     estado_edit, comentario_estado_edit)
-                
-                # Actualizar facturas
-                update_facturas(certificado_id, facturas_edit_data)
-                
-                st.success("✅ Certificado actualizado correctamente!")
-                
-                # --- NUEVO: Navegamos de vuelta a la lista de certificados ---
-                st.info("Redirigiendo a la lista de certificados...")
-                go_to_page("ver")
+                try:
+                    # Actualizar certificado (incluyendo estado, comentario y facturas) si nadie lo modificó
+                    update_certificado(certificado_id, fecha_edit, contrato_edit, contratista_edit,
+                                         valor_contrato_edit, valor_pagado_edit, total_facturas_edit,
+                                         estado_edit, comentario_estado_edit,
+                                         version_esperada=version_edicion,
+                                         cambios_facturas=diferencias_facturas(facturas_originales, facturas_edit_df))
+                except ConflictoEdicion as e:
+                    st.session_state.conflicto_edicion = str(e)
+                else:
+                    st.success("✅ Certificado actualizado correctamente!")
+                    
+                    # --- NUEVO: Navegamos de vuelta a la lista de certificados ---
+                    st.info("Redirigiendo a la lista de certificados...")
+                    go_to_page("ver")
+        
+        # Conflicto de edición concurrente: ofrecer recargar la versión actual
+        if st.session_state.get('conflicto_edicion'):
+            st.error(f"⚠️ {st.session_state.conflicto_edicion}")
+            if st.button("🔄 Recargar datos actuales"):
+                # Descartar la versión y las facturas editadas para mostrar el estado actual
+                for key in [k for k in st.session_state if str(k).startswith(f"edit_{certificado_id}_")]:
+                    del st.session_state[key]
+                for key in ['edit_version', 'edit_facturas_originales', 'conflicto_edicion']:
+                    st.session_state.pop(key, None)
+                st.rerun()
+    else:
+        st.error("No se pudo determinar el certificado a editar.")
+
+elif menu_opcion == "🏢 Administrar Obras":
+    st.title("🏢 Administrar Obras")
+
+    catalogo_obras = get_catalogo_obras(get_version_datos())
+
+    # Listado de obras registradas
+    if catalogo_obras['obras']:
+        df_obras = pd.DataFrame(catalogo_obras['obras'], columns=['ID', 'Obra', 'Código de Obra', 'Aprobación', 'Plantilla',
+                                                                  'Aprobada desde', 'Aprobada hasta'])
+        df_obras['Plantilla'] = df_obras['Plantilla'].fillna(PLANTILLA_POR_DEFECTO)
+        st.dataframe(df_obras, use_container_width=True, hide_index=True)
+    else:
+        st.info("📭 No hay obras registradas.")
+
+    # Plantillas de Excel disponibles en data/ (cada una con su mapa de celdas .json)
+    plantillas = listar_plantillas()
+    opciones_plantilla = list(plantillas)
+
+    # Formulario para agregar una nueva obra
+    st.markdown("---")
+    st.subheader("➕ Agregar Obra")
+    with st.form("form_nueva_obra", clear_on_submit=True):
+        col1, col2, col3 = st.columns([2, 1, 1])
+        with col1:
+            nuevo_nombre = st.text_input("Nombre de la obra")
+        with col2:
+            nuevo_codigo = st.number_input("Código de Obra", min_value=0, step=1, format="%d")
+        with col3:
+            nueva_aprobacion = st.text_input("Aprobación")
+        nueva_plantilla = st.selectbox("Plantilla del certificado", opciones_plantilla,
+                                       index=opciones_plantilla.index(PLANTILLA_POR_DEFECTO),
+                                       format_func=lambda x: f"{x} — {plantillas[x]}")
+        # Período de la aprobación: las fechas de los certificados deben caer dentro (vacío = sin límite)
+        col_desde, col_hasta = st.columns(2)
+        with col_desde:
+            nueva_aprobacion_desde = st.date_input("Aprobada desde (opcional)", value=None, format="DD/MM/YYYY")
+        with col_hasta:
+            nueva_aprobacion_hasta = st.date_input("Aprobada hasta (opcional)", value=None, format="DD/MM/YYYY")
+
+        if st.form_submit_button("💾 Guardar Obra", type="primary"):
+            if not nuevo_nombre.strip() or not nueva_aprobacion.strip() or nuevo_codigo <= 0:
+                st.error("❌ Debe completar el nombre, un código válido y la aprobación")
+            elif nueva_aprobacion_desde and nueva_aprobacion_hasta and nueva_aprobacion_desde > nueva_aprobacion_hasta:
+                st.error("❌ El período de aprobación termina antes de empezar")
+            else:
+                try:
+                    crear_obra(nuevo_nombre.strip(), int(nuevo_codigo), nueva_aprobacion.strip(), nueva_plantilla,
+                               nueva_aprobacion_desde, nueva_aprobacion_hasta)
+                    st.success(f"✅ Obra '{nuevo_nombre.strip()}' agregada correctamente!")
+                    st.rerun()
+                except sqlite3.IntegrityError:
+                    st.error(f"❌ Ya existe una obra con el nombre '{nuevo_nombre.strip()}'")
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+
+    # Edición y eliminación de una obra existente
+    if catalogo_obras['obras']:
+        st.markdown("---")
+        st.subheader("✏️ Editar o Eliminar Obra")
+        obra_id_edit = st.selectbox(
+            "Seleccione una obra:",
+            options=list(catalogo_obras['por_id']),
+            format_func=lambda x: f"{catalogo_obras['por_id'][x][1]} ({catalogo_obras['por_id'][x][2]})"
+        )
+        (_, nombre_actual, codigo_actual, aprobacion_actual, plantilla_actual,
+         aprobacion_desde_actual, aprobacion_hasta_actual) = catalogo_obras['por_id'][obra_id_edit]
+        plantilla_actual = plantilla_actual if plantilla_actual in plantillas else PLANTILLA_POR_DEFECTO
+
+        with st.form(f"form_editar_obra_{obra_id_edit}"):
+            col1, col2, col3 = st.columns([2, 1, 1])
+            with col1:
+                nombre_edit = st.text_input("Nombre de la obra", value=nombre_actual)
+            with col2:
+                codigo_edit = st.number_input("Código de Obra", min_value=0, step=1, format="%d", value=int(codigo_actual))
+            with col3:
+                aprobacion_edit = st.text_input("Aprobación", value=aprobacion_actual)
+            plantilla_edit = st.selectbox("Plantilla del certificado", opciones_plantilla,
+                                          index=opciones_plantilla.index(plantilla_actual),
+                                          format_func=lambda x: f"{x} — {plantillas[x]}")
+            col_desde, col_hasta = st.columns(2)
+            with col_desde:
+                aprobacion_desde_edit = st.date_input(
+                    "Aprobada desde (opcional)", format="DD/MM/YYYY",
+                    value=datetime.strptime(aprobacion_desde_actual, "%Y-%m-%d").date() if aprobacion_desde_actual else None)
+            with col_hasta:
+                aprobacion_hasta_edit = st.date_input(
+                    "Aprobada hasta (opcional)", format="DD/MM/YYYY",
+                    value=datetime.strptime(aprobacion_hasta_actual, "%Y-%m-%d").date() if aprobacion_hasta_actual else None)
+
+            col_guardar, col_eliminar = st.columns(2)
+            with col_guardar:
+                guardar_obra = st.form_submit_button("💾 Guardar Cambios", type="primary", use_container_width=True)
+            with col_eliminar:
+                eliminar_obra_btn = st.form_submit_button("🗑️ Eliminar Obra", use_container_width=True)
+
+        if guardar_obra:
+            if not nombre_edit.strip() or not aprobacion_edit.strip() or codigo_edit <= 0:
+                st.error("❌ Debe completar el nombre, un código válido y la aprobación")
+            elif aprobacion_desde_edit and aprobacion_hasta_edit and aprobacion_desde_edit > aprobacion_hasta_edit:
+                st.error("❌ El período de aprobación termina antes de empezar")
+            else:
+                try:
+                    actualizar_obra(obra_id_edit, nombre_edit.strip(), int(codigo_edit), aprobacion_edit.strip(), plantilla_edit,
+                                    aprobacion_desde_edit, aprobacion_hasta_edit)
+                    st.success("✅ Obra actualizada correctamente!")
+                    st.rerun()
+                except sqlite3.IntegrityError:
+                    st.error(f"❌ Ya existe una obra con el nombre '{nombre_edit.strip()}'")
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+
+        if eliminar_obra_btn:
+            try:
+                eliminar_obra(obra_id_edit)
+                st.success(f"✅ Obra '{nombre_actual}' eliminada correctamente!")
+                st.rerun()
+            except ValueError as e:
+                st.error(f"❌ {e}")
+
+elif menu_opcion == "🗄️ Archivo Histórico":
+    st.title("🗄️ Archivo Histórico")
+    st.write("Los certificados de años fiscales cerrados se trasladan a una base de datos por año y sus "
+             "archivos Excel se comprimen en un zip anual. Las búsquedas los incluyen automáticamente "
+             "cuando el filtro de fechas abarca un año archivado.")
+
+    # Años ya archivados
+    st.subheader("📚 Años archivados")
+    anios_archivados = get_anios_archivados()
+    if anios_archivados:
+        df_archivados = pd.DataFrame(
+            [(anio, total, fecha_archivo, db_path, zip_path) for anio, db_path, zip_path, total, fecha_archivo in anios_archivados],
+            columns=['Año', 'Certificados', 'Fecha de Archivo', 'Base de Datos', 'Zip de Archivos']
+        )
+        st.dataframe(df_archivados, use_container_width=True, hide_index=True)
+    else:
+        st.info("📭 Todavía no se ha archivado ningún año.")
+
+    # Años cerrados pendientes de archivar
+    st.markdown("---")
+    st.subheader("📦 Archivar un año cerrado")
+    anios_archivables = get_anios_archivables()
+    if anios_archivables:
+        opciones_anios = {anio: total for anio, total in anios_archivables}
+        anio_seleccionado = st.selectbox(
+            "Seleccione el año a archivar:",
+            options=list(opciones_anios),
+            format_func=lambda anio: f"{anio} ({opciones_anios[anio]} certificado(s))"
+        )
+        st.warning("Los certificados archivados quedan en modo de solo lectura.")
+        if st.button("🗄️ Archivar Año", type="primary"):
+            try:
+                total = archivar_anio(anio_seleccionado)
+                st.success(f"✅ {total} certificado(s) del año {anio_seleccionado} archivados correctamente!")
+                st.rerun()
+            except ValueError as e:
+                st.error(f"❌ {e}")
+    else:
+        st.info("No hay años cerrados con certificados pendientes de archivar.")
+
+elif menu_opcion == "📈 Análisis":
+    st.title("📈 Análisis de Certificados")
+
+    snapshot = get_snapshot_analitico()
+    st.caption(f"Snapshot columnar con {len(snapshot)} certificado(s) · versión de datos {get_version_snapshot()}")
+
+    if snapshot.empty:
+        st.info("📭 No hay certificados para analizar.")
+        st.stop()
+
+    incluir_archivados = st.checkbox("Incluir años archivados", value=True)
+    datos_analisis = snapshot if incluir_archivados else snapshot[~snapshot['archivado']]
+
+    # Totales por contratista
+    st.subheader("👷 Totales por Contratista")
+    df_contratistas = totales_por_contratista(datos_analisis)
+    st.dataframe(df_contratistas, use_container_width=True, hide_index=True,
+                 column_config={'valor_pagado': st.column_config.NumberColumn(format="%.2f"),
+                                'total_facturas': st.column_config.NumberColumn(format="%.2f")})
+    st.download_button("📥 Exportar CSV", df_contratistas.to_csv(index=False).encode('utf-8'),
+                       file_name="totales_por_contratista.csv", mime="text/csv")
+
+    # Progreso de pagos por obra
+    st.subheader("🏗️ Progreso de Pagos por Obra")
+    df_progreso = progreso_pagos_por_obra(datos_analisis)
+    st.dataframe(df_progreso, use_container_width=True, hide_index=True,
+                 column_config={'valor_contrato': st.column_config.NumberColumn(format="%.2f"),
+                                'valor_pagado': st.column_config.NumberColumn(format="%.2f"),
+                                'progreso': st.column_config.ProgressColumn(min_value=0.0, max_value=1.0, format="%.2f")})
+    st.download_button("📥 Exportar CSV", df_progreso.to_csv(index=False).encode('utf-8'),
+                       file_name="progreso_por_obra.csv", mime="text/csv")
+
+    # Tendencia de estados
+    st.subheader("📊 Tendencia de Estados por Mes")
+    df_tendencia = tendencia_estados(datos_analisis)
+    if not df_tendencia.empty:
+        st.bar_chart(df_tendencia)
+        st.download_button("📥 Exportar CSV", df_tendencia.to_csv().encode('utf-8'),
+                           file_name="tendencia_estados.csv", mime="text/csv")
+
+    # Estimados de producción (siempre con todo el historial, incluidos los años archivados)
+    st.subheader("🔮 Estimados de Producción")
+    st.caption(f"Ritmo mensual de pago según la media móvil de {MESES_MEDIA_MOVIL} meses y la tendencia lineal de los "
+               f"últimos {MESES_TENDENCIA} meses; la fecha de terminación es el mes en que lo proyectado cubre el saldo.")
+    estimados = get_estimados_produccion()
+    if estimados['resumen'].empty:
+        st.info("📭 No hay certificados activos para estimar.")
+    else:
+        df_estimados = estimados['resumen']
+        st.dataframe(df_estimados, use_container_width=True, hide_index=True,
+                     column_config={
+                         'obra_nombre': "Obra",
+                         'valor_contrato': st.column_config.NumberColumn("Valor Contrato", format="%.2f"),
+                         'pagado_acumulado': st.column_config.NumberColumn("Pagado", format="%.2f"),
+                         'facturado_acumulado': st.column_config.NumberColumn("Facturado", format="%.2f"),
+                         'saldo': st.column_config.NumberColumn("Saldo", format="%.2f"),
+                         'media_movil': st.column_config.NumberColumn("Media Móvil Mensual", format="%.2f"),
+                         'tendencia_mensual': st.column_config.NumberColumn("Variación Mensual", format="%.2f"),
+                         'proximo_mes': st.column_config.NumberColumn("Próximo Mes (Tendencia)", format="%.2f"),
+                         'fin_media_movil': st.column_config.DateColumn("Fin (Media Móvil)", format="MM/YYYY"),
+                         'fin_tendencia': st.column_config.DateColumn("Fin (Tendencia)", format="MM/YYYY"),
+                         'progreso': st.column_config.ProgressColumn("Progreso", min_value=0.0, max_value=1.0, format="%.2f"),
+                     })
+        st.download_button("📥 Exportar CSV", df_estimados.to_csv(index=False).encode('utf-8'),
+                           file_name="estimados_produccion.csv", mime="text/csv")
+        obra_estimado = st.selectbox("Proyección mensual de la obra:", df_estimados['obra_nombre'].tolist())
+        st.line_chart(proyeccion_obra(estimados, obra_estimado))
+
+    # Control de facturas certificadas más de una vez
+    st.subheader("🔁 Facturas Duplicadas")
+    df_duplicadas = reporte_facturas_duplicadas()
+    if df_duplicadas.empty:
+        st.success("✅ No hay facturas certificadas más de una vez en certificados activos.")
+    else:
+        st.warning(f"⚠️ {df_duplicadas['clave'].nunique()} factura(s) aparecen en más de un certificado activo.")
+        st.dataframe(df_duplicadas, use_container_width=True, hide_index=True)
+        st.download_button("📥 Exportar CSV", df_duplicadas.to_csv(index=False).encode('utf-8'),
+                           file_name="facturas_duplicadas.csv", mime="text/csv")
+
+    # Reglas de consistencia evaluadas sobre todos los certificados de la base viva
+    st.subheader("🧪 Consistencia de Certificados")
+    df_consistencia = reporte_consistencia()
+    st.dataframe(pd.DataFrame([{'Regla': regla['descripcion'],
+                                'Certificados con problemas': df_consistencia.loc[df_consistencia['regla'] == codigo, 'certificado_id'].nunique()}
+                               for codigo, regla in REGLAS.items()]),
+                 use_container_width=True, hide_index=True)
+    if df_consistencia.empty:
+        st.success("✅ Todos los certificados cumplen las reglas de consistencia.")
+    else:
+        st.warning(f"⚠️ {df_consistencia['certificado_id'].nunique()} certificado(s) incumplen alguna regla.")
+        st.dataframe(df_consistencia, use_container_width=True, hide_index=True,
+                     column_config={
+                         'certificado_id': st.column_config.NumberColumn("ID"),
+                         'obra': "Obra",
+                         'numero_certificado': st.column_config.NumberColumn("Certificado", format="%d"),
+                         'fecha': st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+                         'regla': "Regla",
+                         'mensaje': "Problema",
+                     })
+        st.download_button("📥 Exportar CSV", df_consistencia.to_csv(index=False).encode('utf-8'),
+                           file_name="consistencia_certificados.csv", mime="text/csv")
+
+elif menu_opcion == "🕓 Historial":
+    st.title("🕓 Historial de Cambios")
+    st.write("Cada alta, modificación o eliminación de certificados y facturas queda registrada. "
+             "Consulte la evolución de un certificado o reconstruya cómo estaba en una fecha determinada.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        hist_cert_id = st.number_input("ID del certificado:", min_value=1, step=1, format="%d",
+                                       value=st.session_state.get('selected_cert_id', 1))
+    with col2:
+        hist_fecha = st.date_input("Ver el estado al día:", value=datetime.now().date(), format="DD/MM/YYYY")
+
+    historial = get_historial_certificado(int(hist_cert_id))
+    if not historial:
+        st.info("📭 No hay cambios registrados para ese certificado.")
+    else:
+        # Estado reconstruido a la fecha indicada
+        certificado_hist, facturas_hist = get_certificado_a_fecha(int(hist_cert_id), hist_fecha)
+        st.subheader(f"📄 Estado al {hist_fecha:%d/%m/%Y}")
+        if certificado_hist is None:
+            st.warning("El certificado no existía (o ya había sido eliminado) en esa fecha.")
+        else:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Certificado", f"#{certificado_hist['numero_certificado']}")
+            col2.metric("Estado", certificado_hist['estado'] or 'Activo')
+            col3.metric("Total Facturas", f"{certificado_hist['total_facturas'] or 0:,.2f}")
+            st.write(f"**Contrato:** {certificado_hist['contrato'] or '-'} · **Contratista:** {certificado_hist['contratista'] or '-'} · "
+                     f"**Valor Pagado:** {certificado_hist['valor_pagado'] or 0:,.2f} · **Fecha:** {certificado_hist['fecha']}")
+            if certificado_hist['comentario_estado']:
+                st.write(f"**Comentario:** {certificado_hist['comentario_estado']}")
+            if facturas_hist:
+                st.dataframe(pd.DataFrame(facturas_hist)[['proveedor', 'numero_factura', 'importe', 'codigo']],
+                             use_container_width=True, hide_index=True)
+
+        # Todos los cambios registrados
+        st.subheader("📜 Cambios registrados")
+        df_historial = pd.DataFrame(historial, columns=[
+            'Cambio', 'Operación', 'Fecha del Cambio (UTC)', 'N° Certificado', 'Obra ID', 'Fecha', 'Contrato',
+            'Contratista', 'Valor Contrato', 'Valor Pagado', 'Total Facturas', 'Archivo', 'Fecha Generación',
+            'Estado', 'Comentario', 'Versión'])
+        st.dataframe(df_historial.drop(columns=['Archivo', 'Obra ID']), use_container_width=True, hide_index=True)
+
+    # Certificados eliminados
+    st.markdown("---")
+    st.subheader("🗑️ Certificados eliminados")
+    eliminados = get_certificados_eliminados()
+    if eliminados:
+        st.dataframe(pd.DataFrame(eliminados, columns=['ID', 'N° Certificado', 'Obra', 'Fecha', 'Estado', 'Eliminado (UTC)']),
+                     use_container_width=True, hide_index=True)
+    else:
+        st.info("No se ha eliminado ningún certificado.")
+
+elif menu_opcion == "🔄 Sincronización":
+    st.title("🔄 Sincronización entre Sedes")
+    estado_sincronizacion = get_estado_sincronizacion()
+    st.write("Cada sede envía a la central un paquete con los certificados que cambiaron desde el último envío; "
+             "el archivo puede llevarse en una memoria USB o por correo cuando no hay conexión.")
+    st.caption(f"Identificador de esta sede: {estado_sincronizacion['sitio']}")
+
+    # Enviar los cambios de esta sede
+    st.subheader("📤 Enviar cambios")
+    destino = st.text_input("Destino:", value=DESTINO_POR_DEFECTO)
+    if st.button("📦 Preparar paquete", type="primary"):
+        st.session_state.paquete_sincronizacion = (destino,) + generar_paquete(destino)
+    if st.session_state.get('paquete_sincronizacion'):
+        destino_paquete, contenido_paquete, resumen_paquete = st.session_state.paquete_sincronizacion
+        st.info(f"{resumen_paquete['certificados']} certificado(s) y {resumen_paquete['eliminados']} eliminación(es) "
+                f"para {destino_paquete} ({resumen_paquete['bytes']:,} bytes).")
+        # El envío se confirma al descargar el paquete: el siguiente incluirá solo los cambios posteriores
+        st.download_button("📥 Descargar paquete", contenido_paquete, type="primary",
+                           file_name=f"cambios_{estado_sincronizacion['sitio']}_{resumen_paquete['hasta']}.json.gz",
+                           mime="application/gzip", on_click=confirmar_envio,
+                           args=(destino_paquete, resumen_paquete['hasta']))
+    if estado_sincronizacion['envios']:
+        st.dataframe(pd.DataFrame(estado_sincronizacion['envios'],
+                                  columns=['Destino', 'Último Cambio Enviado', 'Fecha de Envío', 'Certificados Pendientes']),
+                     use_container_width=True, hide_index=True)
+
+    # Recibir paquetes de las sedes
+    st.markdown("---")
+    st.subheader("📥 Recibir cambios de una sede")
+    archivos_paquete = st.file_uploader("Paquetes de cambios:", type=["gz"], accept_multiple_files=True)
+    if archivos_paquete and st.button("🔄 Importar"):
+        for archivo_paquete in archivos_paquete:
+            try:
+                resumen = importar_paquete(archivo_paquete.getvalue())
+            except (ValueError, OSError) as e:
+                st.error(f"❌ {archivo_paquete.name}: {e}")
+                continue
+            st.success(f"✅ {archivo_paquete.name} (sede {resumen['origen']}): {len(resumen['insertados'])} nuevo(s), "
+                       f"{len(resumen['actualizados'])} actualizado(s), {resumen['eliminados']} eliminado(s), "
+                       f"{resumen['omitidos']} ya aplicado(s).")
+            if resumen['obras_creadas']:
+                st.info(f"🏢 Obra(s) creada(s) desde el paquete: {', '.join(map(str, resumen['obras_creadas']))}")
+            if resumen['conflictos']:
+                st.warning(f"⚠️ {resumen['conflictos']} conflicto(s) sin aplicar; revíselos abajo.")
+            # Los informes no viajan en el paquete: se regeneran aquí
+            recibidos = resumen['insertados'] + resumen['actualizados']
+            if recibidos:
+                with st.spinner("Generando informes de los certificados recibidos..."):
+                    generar_lote(recibidos, FORMATOS_POR_DEFECTO, procesos=1)
+                # El lote recibido se valida de una vez con las reglas de consistencia
+                inconsistencias = validar_certificados_guardados(recibidos)
+                if not inconsistencias.empty:
+                    st.warning(f"⚠️ {inconsistencias['certificado_id'].nunique()} certificado(s) recibidos incumplen "
+                               "alguna regla de consistencia:")
+                    st.dataframe(inconsistencias, use_container_width=True, hide_index=True)
+    if estado_sincronizacion['origenes']:
+        st.dataframe(pd.DataFrame(estado_sincronizacion['origenes'],
+                                  columns=['Sede', 'Último Cambio Recibido', 'Fecha de Importación']),
+                     use_container_width=True, hide_index=True)
+
+    # Conflictos pendientes
+    st.markdown("---")
+    st.subheader("⚠️ Conflictos pendientes")
+    conflictos = get_conflictos_sincronizacion()
+    if not conflictos:
+        st.success("✅ No hay conflictos pendientes.")
+    for conflicto_id, fecha_registro, origen, origen_id, obra_codigo, numero, motivo, datos, _ in conflictos:
+        with st.expander(f"Sede {origen} · obra {obra_codigo} · certificado #{numero} · {fecha_registro}"):
+            st.write(motivo)
+            st.json(datos, expanded=False)
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🏢 Conservar la versión de la central", key=f"conflicto_central_{conflicto_id}"):
+                    resolver_conflicto(conflicto_id)
+                    st.rerun()
+            with col2:
+                if st.button("📍 Aplicar la versión de la sede", key=f"conflicto_sede_{conflicto_id}"):
+                    try:
+                        resolver_conflicto(conflicto_id, aceptar_sede=True)
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+
+elif menu_opcion == "🧰 Mantenimiento":
+    st.title("🧰 Mantenimiento de la Base de Datos")
+    if MANTENIMIENTO_INTERVALO_HORAS > 0:
+        st.write(f"El mantenimiento se ejecuta automáticamente cada {MANTENIMIENTO_INTERVALO_HORAS:g} horas: actualiza "
+                 "las estadísticas de las consultas, libera el espacio de lo eliminado, vuelca el WAL y guarda un "
+                 f"respaldo (se conservan los últimos {RESPALDOS_CONSERVAR}).")
+    else:
+        st.write("El mantenimiento automático está desactivado; puede ejecutarse aquí o con `python mantenimiento.py ejecutar`.")
+
+    error_programado = get_error_programado()
+    if error_programado:
+        st.error(f"❌ El mantenimiento programado falló el {error_programado[0]:%d/%m/%Y %H:%M}: {error_programado[1]}")
+
+    # Estado actual del archivo de la base
+    estado = estado_base_datos()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Tamaño de la base", f"{estado['bytes'] / 1024 / 1024:,.1f} MB")
+    col2.metric("Páginas libres", f"{estado['paginas_libres']:,}")
+    col3.metric("WAL", f"{estado['wal_bytes'] / 1024 / 1024:,.1f} MB")
+    if not estado['vacuum_incremental']:
+        st.info("ℹ️ La base todavía no está en modo de vacuum incremental, así que el mantenimiento programado no "
+                "libera el espacio de lo eliminado. El próximo mantenimiento ejecutado desde aquí la convierte con "
+                "un VACUUM completo: durante unos segundos no se podrá guardar.")
+
+    if st.button("🧰 Ejecutar mantenimiento ahora", type="primary"):
+        with st.spinner("Ejecutando mantenimiento..."):
+            resultado = ejecutar_mantenimiento()
+        if resultado is None:
+            st.warning("⚠️ Ya hay un mantenimiento en curso.")
+        else:
+            st.success(f"✅ Mantenimiento completado. Respaldo: {resultado['respaldo']['ruta']}")
+            st.rerun()
+
+    # Historial de mantenimientos con la latencia de las consultas de referencia antes y después
+    st.markdown("---")
+    st.subheader("🕓 Últimos mantenimientos")
+    mantenimientos = get_mantenimientos()
+    if not mantenimientos:
+        st.info("Todavía no se ha ejecutado ningún mantenimiento.")
+    for _, inicio, fin, estado_mantenimiento, tareas, resultado, error in mantenimientos:
+        icono = {"COMPLETADO": "✅", "ERROR": "❌"}.get(estado_mantenimiento, "⏳")
+        with st.expander(f"{icono} {inicio} · {tareas}"):
+            if error:
+                st.error(error)
+            if resultado and 'estado_despues' in resultado:
+                antes, despues = resultado['estado_antes'], resultado['estado_despues']
+                st.write(f"Tamaño: {antes['bytes']:,} → {despues['bytes']:,} bytes · páginas libres: "
+                         f"{antes['paginas_libres']:,} → {despues['paginas_libres']:,} · WAL: "
+                         f"{antes['wal_bytes']:,} → {despues['wal_bytes']:,} bytes")
+                st.dataframe(pd.DataFrame(comparar_latencia(resultado),
+                                          columns=['Consulta', 'Antes (ms)', 'Después (ms)', 'Variación (%)']),
+                             use_container_width=True, hide_index=True)
+
+    # Respaldos disponibles
+    st.markdown("---")
+    st.subheader("💾 Respaldos")
+    respaldos = listar_respaldos()
+    if respaldos:
+        st.dataframe(pd.DataFrame([(fecha, tamano, ruta) for ruta, tamano, fecha in respaldos],
+                                  columns=['Fecha', 'Bytes', 'Archivo']),
+                     use_container_width=True, hide_index=True)
     else:
-        st.error("No se pudo determinar el certificado a editar.")
\ No newline at end of file
+        st.info("No hay respaldos.")
@@ -0,0 +1,34 @@
+import json
+import os
+
+# Archivo de configuración opcional (JSON con claves como "db_name" o "almacenamiento_raiz").
+# Cada clave puede sobrescribirse con la variable de entorno CERTIFICOS_<CLAVE EN MAYÚSCULAS>,
+# de modo que varias instancias pueden compartir el archivo y ajustar solo lo que cambia entre ellas.
+ARCHIVO_CONFIGURACION = os.environ.get("CERTIFICOS_CONFIG", "configuracion.json")
+
+# Función para leer el archivo de configuración (vacío si no existe)
+def _leer_archivo_configuracion(ruta):
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        configuracion = json.load(f)
+    if not isinstance(configuracion, dict):
+        raise ValueError(f"El archivo de configuración {ruta} debe contener un objeto JSON")
+    return configuracion
+
+_configuracion = _leer_archivo_configuracion(ARCHIVO_CONFIGURACION)
+
+# Textos aceptados como verdadero en las opciones de sí o no (las variables de entorno siempre son texto)
+VALORES_VERDADEROS = {"1", "true", "si", "sí", "yes", "on"}
+
+# Función para obtener un valor de configuración: primero la variable de entorno, luego el archivo y por
+# último el valor por defecto, convertido al tipo del valor por defecto (texto, entero, decimal o sí/no)
+def valor_configuracion(clave, por_defecto=None):
+    valor = os.environ.get(f"CERTIFICOS_{clave.upper()}")
+    if valor is None:
+        valor = _configuracion.get(clave, por_defecto)
+    if valor is None or por_defecto is None:
+        return valor
+    if isinstance(por_defecto, bool) and isinstance(valor, str):
+        return valor.strip().lower() in VALORES_VERDADEROS
+    return type(por_defecto)(valor)
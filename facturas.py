@@ -0,0 +1,80 @@
+import pandas as pd
+import streamlit as st
+
+# Columnas de la tabla de facturas (las mismas claves que usa el resto de la aplicación)
+COLUMNAS_FACTURA = ['proveedor', 'factura', 'importe', 'codigo']
+COLUMNAS_TEXTO = ['proveedor', 'factura', 'codigo']
+
+# Configuración de columnas del editor: el id de la factura guardada se conserva oculto
+CONFIG_COLUMNAS_FACTURAS = {
+    'id': None,
+    'proveedor': st.column_config.TextColumn("Proveedor", width="large"),
+    'factura': st.column_config.TextColumn("Factura", width="medium"),
+    'importe': st.column_config.NumberColumn("Importe (CUP)", min_value=0.0, format="%.2f"),
+    'codigo': st.column_config.TextColumn("Código", width="small"),
+}
+
+# Función para construir la tabla editable a partir de las facturas de la base de datos
+# (tuplas id, proveedor, numero_factura, importe, codigo) o vacía para un certificado nuevo
+def facturas_a_df(facturas=()):
+    df = pd.DataFrame(list(facturas), columns=['id'] + COLUMNAS_FACTURA)
+    df['id'] = df['id'].astype('Int64')
+    df['importe'] = df['importe'].astype('float64')
+    for columna in COLUMNAS_TEXTO:
+        df[columna] = df[columna].astype('object')
+    return df
+
+# Función para limpiar y validar de una vez todas las filas del editor.
+# Devuelve las facturas (sin las filas totalmente vacías), la lista de errores y el total.
+def preparar_facturas(df):
+    facturas = df.copy()
+    for columna in COLUMNAS_TEXTO:
+        facturas[columna] = facturas[columna].fillna("").astype(str).str.strip()
+    facturas['importe'] = pd.to_numeric(facturas['importe'], errors='coerce')
+
+    # Las filas en blanco (por ejemplo, la última fila del editor o líneas vacías pegadas) se ignoran
+    vacias = (facturas[COLUMNAS_TEXTO] == "").all(axis=1) & facturas['importe'].isna()
+    facturas = facturas[~vacias].reset_index(drop=True)
+
+    numeros = pd.Series(range(1, len(facturas) + 1))
+    reglas = [
+        (facturas['proveedor'] == "", "Debe ingresar el proveedor"),
+        (facturas['factura'] == "", "Debe ingresar el número de factura"),
+        (~(facturas['importe'] > 0), "El importe debe ser mayor que 0"),
+    ]
+    errores = sorted(
+        (numero, orden, f"❌ Factura No {numero}: {mensaje}")
+        for orden, (mascara, mensaje) in enumerate(reglas)
+        for numero in numeros[mascara.to_numpy()]
+    )
+
+    facturas['importe'] = facturas['importe'].fillna(0.0)
+    total = float(facturas['importe'].sum())
+    return facturas, [error for _, _, error in errores], total
+
+# Función para obtener la lista de facturas (diccionarios) a partir de la tabla preparada
+def facturas_a_lista(facturas):
+    return facturas[COLUMNAS_FACTURA].to_dict('records')
+
+# Función para comparar la tabla editada con las facturas originales y obtener solo lo que cambió:
+# facturas nuevas, facturas modificadas (id, datos) e ids de facturas eliminadas
+def diferencias_facturas(originales, editadas):
+    nuevas = editadas[editadas['id'].isna()]
+    conservadas = editadas[editadas['id'].notna()]
+
+    comparacion = conservadas.merge(originales, on='id', how='left', suffixes=('', '_original'))
+    distintas = pd.Series(False, index=comparacion.index)
+    for columna in COLUMNAS_FACTURA:
+        original = comparacion[f"{columna}_original"]
+        if columna in COLUMNAS_TEXTO:
+            # La misma limpieza que preparar_facturas aplica a las editadas: un espacio guardado no es un cambio
+            original = original.fillna("").astype(str).str.strip()
+        distintas |= comparacion[columna] != original
+    modificadas = comparacion[distintas]
+
+    eliminadas = originales.loc[~originales['id'].isin(conservadas['id']), 'id']
+    return {
+        'nuevas': facturas_a_lista(nuevas),
+        'modificadas': list(zip(modificadas['id'].astype(int), facturas_a_lista(modificadas))),
+        'eliminadas': eliminadas.astype(int).tolist(),
+    }
@@ -0,0 +1,395 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import copy
+from datetime import date, datetime
+from functools import lru_cache
+from io import BytesIO
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+from openpyxl import load_workbook
+from openpyxl.styles import Font, Alignment, Border, Side
+from openpyxl.utils import column_index_from_string, get_column_letter, range_boundaries
+from openpyxl.utils.cell import coordinate_to_tuple
+from PIL import Image
+
+import base_datos
+from almacenamiento import get_almacenamiento, normalizar_clave
+from base_datos import EXCEL_TEMPLATES_DIR, ZIP_SEPARADOR, get_certificado_by_id, get_facturas_by_certificado_id
+
+PLANTILLA_POR_DEFECTO = "ejemplo"
+LOGO_PATH = "logo.png"
+
+# Hilos compartidos para generar los distintos formatos de un mismo certificado a la vez
+_EJECUTOR_FORMATOS = ThreadPoolExecutor(max_workers=4, thread_name_prefix="informes")
+
+# ==================== PLANTILLAS DE EXCEL ====================
+
+# Cada plantilla de data/ es un par <nombre>.xlsx + <nombre>.json. El .json declara en qué celdas va cada
+# campo, el rango de filas reservado a las facturas y dónde se muestra el estado del certificado.
+def _rutas_plantilla(nombre):
+    base = os.path.join(EXCEL_TEMPLATES_DIR, nombre)
+    return f"{base}.xlsx", f"{base}.json"
+
+# Función para listar las plantillas disponibles: {nombre: descripción}
+def listar_plantillas():
+    plantillas = {}
+    for archivo in sorted(os.listdir(EXCEL_TEMPLATES_DIR)):
+        nombre, extension = os.path.splitext(archivo)
+        if extension == ".json" and os.path.exists(_rutas_plantilla(nombre)[0]):
+            plantillas[nombre] = get_plantilla(nombre)['descripcion']
+    return plantillas
+
+# Función para obtener el plan de escritura de una plantilla (la de por defecto si no se indica).
+# El plan se compila una sola vez y se vuelve a compilar solo si cambia el .xlsx o el .json.
+def get_plantilla(nombre=None):
+    nombre = nombre or PLANTILLA_POR_DEFECTO
+    ruta_excel, ruta_mapa = _rutas_plantilla(nombre)
+    if not os.path.exists(ruta_excel) or not os.path.exists(ruta_mapa):
+        raise ValueError(f"La plantilla '{nombre}' no existe en {EXCEL_TEMPLATES_DIR}")
+    return _compilar_plantilla(nombre, os.path.getmtime(ruta_excel), os.path.getmtime(ruta_mapa))
+
+# Función para compilar el mapa de celdas en un plan de escritura: las coordenadas se resuelven a
+# (fila, columna) y los formatos a funciones, de modo que escribir un informe no interpreta texto
+@lru_cache(maxsize=16)
+def _compilar_plantilla(nombre, mtime_excel, mtime_mapa):
+    ruta_excel, ruta_mapa = _rutas_plantilla(nombre)
+    with open(ruta_mapa, encoding="utf-8") as f:
+        mapa = json.load(f)
+    with open(ruta_excel, "rb") as f:
+        contenido_excel = f.read()
+
+    try:
+        campos = []
+        for campo, definicion in mapa['campos'].items():
+            convertir = definicion['formato'].format if definicion.get('formato') else None
+            for celda in definicion['celdas']:
+                fila, columna = coordinate_to_tuple(celda)
+                campos.append((campo, fila, columna, convertir))
+        facturas = mapa['facturas']
+        columnas_facturas = tuple((clave, column_index_from_string(letra))
+                                  for clave, letra in facturas['columnas'].items())
+        estado = range_boundaries(mapa['estado']['rango']) if mapa.get('estado') else None
+    except (KeyError, ValueError, TypeError) as e:
+        raise ValueError(f"Mapa de celdas inválido en {ruta_mapa}: {e!r}") from e
+
+    return {
+        'nombre': nombre,
+        'descripcion': mapa.get('descripcion', nombre),
+        'excel': contenido_excel,
+        'campos': tuple(campos),
+        'fila_inicio_facturas': facturas['fila_inicio'],
+        'fila_fin_facturas': facturas['fila_fin'],
+        'columnas_facturas': columnas_facturas,
+        # (columna_min, fila_min, columna_max, fila_max)
+        'estado': estado,
+    }
+
+# Función para abrir espacio a las facturas que no caben en las filas reservadas de la plantilla.
+# insert_rows desplaza valores y estilos, pero no las celdas combinadas, las alturas de fila ni el área
+# de impresión, así que se ajustan aquí; las filas nuevas copian el formato de la última fila de facturas.
+def _insertar_filas_facturas(ws, fila_fin, cantidad):
+    ws.insert_rows(fila_fin + 1, cantidad)
+
+    for rango in ws.merged_cells.ranges:
+        if rango.min_row > fila_fin:
+            rango.shift(row_shift=cantidad)
+
+    altura_modelo = ws.row_dimensions[fila_fin].height
+    alturas = {fila: dimension.height for fila, dimension in ws.row_dimensions.items() if fila > fila_fin}
+    for fila in alturas:
+        ws.row_dimensions[fila].height = None
+    for fila, altura in alturas.items():
+        ws.row_dimensions[fila + cantidad].height = altura
+    for fila in range(fila_fin + 1, fila_fin + cantidad + 1):
+        ws.row_dimensions[fila].height = altura_modelo
+        for columna in range(1, ws.max_column + 1):
+            ws.cell(row=fila, column=columna)._style = copy(ws.cell(row=fila_fin, column=columna)._style)
+
+    if ws.print_area:
+        areas = []
+        for area in ws.print_area.split(","):
+            min_col, min_row, max_col, max_row = range_boundaries(area.split("!")[-1].replace("$", ""))
+            if max_row >= fila_fin:
+                max_row += cantidad
+            areas.append(f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}")
+        ws.print_area = areas
+
+# Función para crear el informe en Excel según la plantilla de la obra (datos['plantilla'])
+def generar_informe_excel(datos, numero_certificado):
+    plan = get_plantilla(datos.get('plantilla'))
+    wb = load_workbook(BytesIO(plan['excel']))
+    ws = wb.active
+
+    # Filas adicionales si las facturas no caben en las reservadas; todo lo que está debajo se desplaza
+    fila_inicio, fila_fin = plan['fila_inicio_facturas'], plan['fila_fin_facturas']
+    facturas = datos['facturas']
+    filas_extra = max(0, len(facturas) - (fila_fin - fila_inicio + 1))
+    if filas_extra:
+        _insertar_filas_facturas(ws, fila_fin, filas_extra)
+
+    # Campos del certificado (los vacíos se dejan como están en la plantilla)
+    valores = dict(datos, numero_certificado=numero_certificado)
+    for campo, fila, columna, convertir in plan['campos']:
+        valor = valores.get(campo)
+        if valor is None or valor == "":
+            continue
+        if fila > fila_fin:
+            fila += filas_extra
+        ws.cell(row=fila, column=columna, value=convertir(valor) if convertir else valor)
+
+    # Facturas
+    for fila, factura in enumerate(facturas, start=fila_inicio):
+        for clave, columna in plan['columnas_facturas']:
+            ws.cell(row=fila, column=columna, value=factura[clave])
+
+    # Estado y comentario cuando el certificado no está activo, en un recuadro rojo
+    if plan['estado'] and 'estado' in datos and datos['estado'] != 'Activo':
+        min_col, min_row, max_col, max_row = plan['estado']
+        if min_row > fila_fin:
+            min_row, max_row = min_row + filas_extra, max_row + filas_extra
+        ws.merge_cells(start_row=min_row, start_column=min_col, end_row=max_row, end_column=max_col)
+        cell = ws.cell(row=min_row, column=min_col)
+        cell.value = f"⚠️ ESTADO DEL CERTIFICADO: {datos['estado']}\n\n📝 Comentario: {datos.get('comentario_estado') or 'Ninguno'}"
+        cell.font = Font(bold=True, color="FF0000", size=12)
+        cell.alignment = Alignment(wrap_text=True, vertical='top')
+
+        lado_rojo = Side(style='thin', color='FF0000')
+        borde_rojo = Border(left=lado_rojo, right=lado_rojo, top=lado_rojo, bottom=lado_rojo)
+        for fila in ws.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col):
+            for celda in fila:
+                celda.border = borde_rojo
+
+    # Guardar el archivo en memoria
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+
+    return output
+
+# ==================== INFORME EN PDF ====================
+
+# Disposición del PDF (milímetros sobre A4) y textos fijos del certificado
+DISPOSICION_PDF = {
+    'margen': 15,
+    'logo': {'x': 15, 'y': 12, 'ancho': 28},
+    'encabezado_x': 50,
+    'columnas_facturas': (70, 45, 35, 30),
+    'alto_linea': 7,
+}
+TEXTO_CERTIFICACION = ("Certificamos que los valores de las facturas que se relacionan corresponden a los documentos "
+                       "legales debidamente autorizados y que se ajustan a la obra de referencia.")
+FIRMAS = (("Esp. Inversiones", "Ing. Yenny Sánchez Aguilar"),
+          ("Jefe Grupo Técnico UBI Obras Varias.", "Ing. Osvaldo Sánchez Breff"))
+
+# Recursos compartidos entre todos los PDF del proceso: el logo se lee y decodifica una sola vez
+@lru_cache(maxsize=1)
+def _recursos_pdf():
+    logo = None
+    if os.path.exists(LOGO_PATH):
+        with Image.open(LOGO_PATH) as imagen:
+            logo = imagen.convert("RGBA")
+            logo.load()
+    return {'logo': logo}
+
+# Las fuentes estándar del PDF solo cubren latin-1: se descartan los emojis y demás símbolos
+def _texto_pdf(valor):
+    return str(valor if valor is not None else "").encode("latin-1", "ignore").decode("latin-1").strip()
+
+# Función para crear el informe en PDF a partir de los mismos datos que el informe en Excel
+def generar_informe_pdf(datos, numero_certificado):
+    recursos = _recursos_pdf()
+    disposicion = DISPOSICION_PDF
+    alto = disposicion['alto_linea']
+
+    pdf = FPDF(format="A4", unit="mm")
+    pdf.set_margins(disposicion['margen'], disposicion['margen'], disposicion['margen'])
+    pdf.set_auto_page_break(auto=True, margin=20)
+    pdf.set_title(f"Certificado {numero_certificado} - {_texto_pdf(datos.get('nombre_obra'))}")
+    pdf.add_page()
+
+    # Encabezado con logo, entidad y fecha
+    if recursos['logo'] is not None:
+        pdf.image(recursos['logo'], x=disposicion['logo']['x'], y=disposicion['logo']['y'], w=disposicion['logo']['ancho'])
+    pdf.set_xy(disposicion['encabezado_x'], 15)
+    pdf.set_font("Helvetica", "B", 14)
+    pdf.cell(0, alto, "Inmobiliaria ALMEST", new_x=XPos.LEFT, new_y=YPos.NEXT)
+    pdf.set_font("Helvetica", "", 12)
+    pdf.cell(0, alto, "UBI Obras Varias", new_x=XPos.LEFT, new_y=YPos.NEXT)
+    fecha = datos.get('fecha')
+    if fecha:
+        texto_fecha = fecha.strftime("%d/%m/%Y") if isinstance(fecha, (date, datetime)) else str(fecha)
+        pdf.cell(0, alto, f"Fecha: {texto_fecha}", align="R", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_y(max(pdf.get_y(), 45))
+
+    pdf.set_font("Helvetica", "", 10)
+    pdf.multi_cell(0, 5, TEXTO_CERTIFICACION, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(4)
+    pdf.set_font("Helvetica", "B", 13)
+    pdf.cell(0, alto + 1, f"CERTIFICACION DE FACTURAS No. {numero_certificado}", align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(3)
+
+    # Datos del contrato y de la obra
+    campos = [
+        ("Contrato No", datos.get('contrato')),
+        ("Contratista", datos.get('contratista')),
+        ("Obra", datos.get('obra')),
+        ("Código de Obra", datos.get('codigo_obra')),
+        ("Aprobación", datos.get('aprobacion')),
+        ("Valor total Ctto", f"{datos['valor_contrato']:,.2f} MN" if datos.get('valor_contrato') else ""),
+        ("Valor Pagado", f"{datos['valor_pagado']:,.2f} MN" if datos.get('valor_pagado') else ""),
+    ]
+    for etiqueta, valor in campos:
+        pdf.set_font("Helvetica", "B", 10)
+        pdf.cell(40, alto, _texto_pdf(etiqueta) + ":")
+        pdf.set_font("Helvetica", "", 10)
+        pdf.cell(0, alto, _texto_pdf(valor), new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(3)
+
+    # Tabla de facturas (se parte en varias páginas si hace falta, repitiendo el encabezado)
+    pdf.set_font("Helvetica", "", 9)
+    with pdf.table(col_widths=disposicion['columnas_facturas'], text_align=("LEFT", "LEFT", "RIGHT", "LEFT"),
+                   line_height=6, repeat_headings=1) as tabla:
+        encabezado = tabla.row()
+        for titulo in ("Proveedor", "Factura", "Importe", "Código"):
+            encabezado.cell(titulo)
+        for factura in datos['facturas']:
+            fila = tabla.row()
+            fila.cell(_texto_pdf(factura['proveedor']))
+            fila.cell(_texto_pdf(factura['factura']))
+            fila.cell(f"{factura['importe']:,.2f}")
+            fila.cell(_texto_pdf(factura['codigo']))
+    pdf.ln(2)
+    pdf.set_font("Helvetica", "B", 11)
+    pdf.cell(0, alto, f"TOTAL DE FACTURAS: {datos['total_facturas']:,.2f} CUP", align="R", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    # Estado y comentario cuando el certificado no está activo
+    if 'estado' in datos and datos['estado'] != 'Activo':
+        pdf.ln(4)
+        pdf.set_draw_color(255, 0, 0)
+        pdf.set_text_color(255, 0, 0)
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.multi_cell(0, 6, f"ESTADO DEL CERTIFICADO: {_texto_pdf(datos['estado'])}\n"
+                             f"Comentario: {_texto_pdf(datos.get('comentario_estado') or 'Ninguno')}",
+                       border=1, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.set_draw_color(0, 0, 0)
+        pdf.set_text_color(0, 0, 0)
+
+    # Firmas
+    if pdf.get_y() > pdf.h - 50:
+        pdf.add_page()
+    pdf.ln(15)
+    ancho_firma = (pdf.w - 2 * disposicion['margen']) / 2
+    y_firmas = pdf.get_y()
+    for indice, (cargo, nombre) in enumerate(FIRMAS):
+        pdf.set_xy(disposicion['margen'] + indice * ancho_firma, y_firmas)
+        pdf.set_font("Helvetica", "", 10)
+        pdf.cell(ancho_firma, 6, "Firma: ____________________", new_x=XPos.LEFT, new_y=YPos.NEXT)
+        pdf.cell(ancho_firma, 6, _texto_pdf(cargo), new_x=XPos.LEFT, new_y=YPos.NEXT)
+        pdf.set_font("Helvetica", "B", 10)
+        pdf.cell(ancho_firma, 6, _texto_pdf(nombre), new_x=XPos.LEFT, new_y=YPos.NEXT)
+
+    return BytesIO(bytes(pdf.output()))
+
+# ==================== FLUJO DE GENERACIÓN ====================
+
+# Formatos de salida disponibles: función que lo genera, tipo MIME y extensión
+RENDERIZADORES = {
+    'xlsx': {
+        'funcion': generar_informe_excel,
+        'mime': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        'nombre': "Excel",
+    },
+    'pdf': {
+        'funcion': generar_informe_pdf,
+        'mime': "application/pdf",
+        'nombre': "PDF",
+    },
+}
+FORMATOS_POR_DEFECTO = ('xlsx', 'pdf')
+
+# Función para generar un certificado en varios formatos a la vez. Devuelve {formato: BytesIO}.
+def generar_informes(datos, numero_certificado, formatos=FORMATOS_POR_DEFECTO):
+    if len(formatos) == 1:
+        return {formatos[0]: RENDERIZADORES[formatos[0]]['funcion'](datos, numero_certificado)}
+    futuros = {formato: _EJECUTOR_FORMATOS.submit(RENDERIZADORES[formato]['funcion'], datos, numero_certificado)
+               for formato in formatos}
+    return {formato: futuro.result() for formato, futuro in futuros.items()}
+
+# Función para obtener la ruta de un formato a partir de la ruta guardada del Excel
+# (sirve también para certificados archivados dentro de un zip anual)
+def ruta_informe(archivo_path, formato):
+    base, _ = os.path.splitext(archivo_path)
+    return f"{base}.{formato}"
+
+# Función para reconstruir los datos del informe de un certificado guardado
+def datos_informe_desde_db(certificado_id):
+    certificado = get_certificado_by_id(certificado_id)
+    if certificado is None:
+        return None, None
+    facturas = [{'proveedor': proveedor, 'factura': numero_factura, 'importe': importe, 'codigo': codigo or ''}
+                for proveedor, numero_factura, importe, codigo in get_facturas_by_certificado_id(certificado_id)]
+    fecha = datetime.strptime(certificado[3], "%Y-%m-%d").date() if certificado[3] else None
+    datos = {
+        'fecha': fecha,
+        'contrato': certificado[4],
+        'contratista': certificado[5],
+        'obra': f"{certificado[14]} {certificado[13]}",
+        'codigo_obra': f"{certificado[14]}02",
+        'nombre_obra': certificado[13],
+        'aprobacion': certificado[15],
+        'plantilla': certificado[17],
+        'valor_contrato': certificado[6],
+        'valor_pagado': certificado[7],
+        'facturas': facturas,
+        'total_facturas': certificado[8] or 0.0,
+        'estado': certificado[11] or 'Activo',
+        'comentario_estado': certificado[12],
+    }
+    return datos, certificado
+
+# Trabajo de un proceso del lote: genera y guarda los formatos pedidos de un certificado
+def _generar_certificado_guardado(certificado_id, formatos, db_name):
+    base_datos.DB_NAME = db_name
+    datos, certificado = datos_informe_desde_db(certificado_id)
+    if datos is None or not certificado[9] or ZIP_SEPARADOR in certificado[9]:
+        return []
+    rutas = []
+    # Dentro de un proceso del lote los formatos se generan y suben uno tras otro: el paralelismo ya lo
+    # dan los procesos (y los hilos de transferencia del proceso padre no sobreviven al fork)
+    for formato in formatos:
+        contenido = RENDERIZADORES[formato]['funcion'](datos, certificado[1])
+        ruta = ruta_informe(normalizar_clave(certificado[9]), formato)
+        get_almacenamiento().guardar(ruta, contenido.getvalue())
+        rutas.append(ruta)
+    return rutas
+
+# Función para regenerar en lote los informes de certificados guardados, repartidos en varios procesos
+# (los certificados de años archivados se omiten porque son de solo lectura)
+def generar_lote(certificado_ids, formatos=FORMATOS_POR_DEFECTO, procesos=None):
+    procesos = procesos or os.cpu_count() or 1
+    if procesos == 1:
+        resultados = [_generar_certificado_guardado(certificado_id, formatos, base_datos.DB_NAME)
+                      for certificado_id in certificado_ids]
+        return [ruta for rutas in resultados for ruta in rutas]
+    # Los certificados se reparten en bloques para no pagar un viaje entre procesos por cada uno
+    bloque = max(1, len(certificado_ids) // (procesos * 4))
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        resultados = ejecutor.map(_generar_certificado_guardado, certificado_ids,
+                                  [formatos] * len(certificado_ids), [base_datos.DB_NAME] * len(certificado_ids),
+                                  chunksize=bloque)
+        return [ruta for rutas in resultados for ruta in rutas]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera en lote los informes de certificados guardados.")
+    parser.add_argument("ids", nargs="*", type=int, help="IDs de los certificados (por defecto, todos)")
+    parser.add_argument("--formatos", nargs="+", choices=list(RENDERIZADORES), default=['pdf'])
+    parser.add_argument("--procesos", type=int, default=None)
+    args = parser.parse_args()
+
+    base_datos.init_db()
+    ids = args.ids or [certificado[0] for certificado in base_datos.get_certificados_by_obra()]
+    rutas = generar_lote(ids, tuple(args.formatos), args.procesos)
+    print(f"{len(rutas)} archivo(s) generados para {len(ids)} certificado(s)")
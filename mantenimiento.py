@@ -0,0 +1,367 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from datetime import datetime
+
+import base_datos
+from base_datos import (
+    CONSULTA_ETIQUETAS, buscar_certificados_con_filtros, con_reintentos, conectar, get_facturas_by_certificado_id,
+    reporte_facturas_duplicadas,
+)
+from configuracion import valor_configuracion
+
+# Cada cuántas horas corresponde un mantenimiento completo (0 = solo a mano o por consola)
+MANTENIMIENTO_INTERVALO_HORAS = valor_configuracion("mantenimiento_intervalo_horas", 24.0)
+# Cada cuántos minutos el proceso de la aplicación revisa si corresponde un mantenimiento
+MANTENIMIENTO_REVISION_MINUTOS = valor_configuracion("mantenimiento_revision_minutos", 10.0)
+# Un mantenimiento 'EN_CURSO' más antiguo que esto se considera abandonado (el proceso se cayó)
+MANTENIMIENTO_ABANDONADO_HORAS = 2
+
+# Respaldos: directorio de las copias fechadas y cuántas se conservan
+RESPALDOS_DIR = valor_configuracion("respaldos_dir", "respaldos")
+RESPALDOS_CONSERVAR = valor_configuracion("respaldos_conservar", 7)
+
+# Vacuum incremental: páginas liberadas por paso (cada paso es una escritura corta) y pausa entre pasos,
+# para que las escrituras de los usuarios se intercalen
+VACUUM_PAGINAS_POR_PASO = 500
+VACUUM_PAUSA = 0.05
+# Filas que ANALYZE examina por índice: estadísticas aproximadas, suficientes para el planificador y en poco tiempo
+ANALISIS_LIMITE = 1000
+# Veces que se ejecuta cada consulta de referencia al medir la latencia (se informa la mediana)
+LATENCIA_REPETICIONES = 5
+
+TAREAS = ('analizar', 'vacuum', 'checkpoint', 'respaldo')
+
+# Función para crear la tabla con el registro de los mantenimientos
+def _crear_tabla_mantenimientos(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS mantenimientos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        fin TIMESTAMP,
+        estado TEXT NOT NULL,   -- 'EN_CURSO', 'COMPLETADO' o 'ERROR'
+        tareas TEXT NOT NULL,
+        resultado TEXT,         -- JSON con el estado de la base y la latencia antes y después
+        error TEXT
+    )''')
+
+# Función para obtener el tamaño y la fragmentación del archivo de la base
+def estado_base_datos():
+    conn = conectar()
+    paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+    tamano_pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+    paginas_libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    ruta_wal = f"{base_datos.DB_NAME}-wal"
+    return {
+        'bytes': paginas * tamano_pagina,
+        'paginas': paginas,
+        'paginas_libres': paginas_libres,
+        'wal_bytes': os.path.getsize(ruta_wal) if os.path.exists(ruta_wal) else 0,
+        'vacuum_incremental': auto_vacuum == 2,
+    }
+
+# ==================== LATENCIA DE CONSULTAS ====================
+
+# Función para ejecutar la consulta del índice de etiquetas de los selectores
+def _consulta_etiquetas():
+    conn = conectar()
+    filas = conn.execute(CONSULTA_ETIQUETAS.format(esquema='main')).fetchall()
+    conn.close()
+    return filas
+
+# Función para elegir los parámetros de las consultas de referencia: la obra con más certificados
+# y el último certificado
+def _parametros_latencia():
+    conn = conectar()
+    obra = conn.execute("""SELECT obra_id FROM certificados GROUP BY obra_id
+                           ORDER BY COUNT(*) DESC LIMIT 1""").fetchone()
+    certificado_id = conn.execute("SELECT MAX(id) FROM certificados").fetchone()[0]
+    conn.close()
+    return (obra[0] if obra else None), certificado_id
+
+# Consultas de referencia de la aplicación (las de las páginas más usadas y de la API)
+def _consultas_latencia():
+    obra_id, certificado_id = _parametros_latencia()
+    return {
+        'listado': buscar_certificados_con_filtros,
+        'filtro_obra_estado': lambda: buscar_certificados_con_filtros(obras_ids=[obra_id], estados=['Activo']),
+        'facturas_certificado': lambda: get_facturas_by_certificado_id(certificado_id),
+        'etiquetas': _consulta_etiquetas,
+        'facturas_duplicadas': reporte_facturas_duplicadas,
+    }
+
+# Función para medir la latencia de las consultas de referencia: {consulta: mediana en ms}
+def medir_latencia(repeticiones=LATENCIA_REPETICIONES):
+    latencias = {}
+    for nombre, consulta in _consultas_latencia().items():
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            consulta()
+            tiempos.append(time.perf_counter() - inicio)
+        latencias[nombre] = round(statistics.median(tiempos) * 1000, 3)
+    return latencias
+
+# ==================== TAREAS ====================
+
+# Función para actualizar las estadísticas del planificador de consultas
+@con_reintentos
+def analizar():
+    conn = conectar()
+    conn.execute(f"PRAGMA analysis_limit = {ANALISIS_LIMITE}")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+# Función para pasar a vacuum incremental una base creada antes de que init_db lo activara. Requiere
+# un VACUUM completo (una sola vez): durante esos segundos los usuarios pueden leer pero no escribir, así
+# que solo se hace en un mantenimiento pedido a mano, nunca desde el programado.
+@con_reintentos
+def _activar_vacuum_incremental(convertir):
+    conn = conectar()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        if not convertir:
+            return None
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+# Función para liberar un paso de páginas libres; devuelve las páginas liberadas
+@con_reintentos
+def _paso_vacuum():
+    conn = conectar()
+    try:
+        antes = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if antes:
+            # executescript ejecuta el pragma hasta el final (execute liberaría una sola página)
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGINAS_POR_PASO});")
+        return antes - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+# Función para devolver al sistema de archivos el espacio de las filas eliminadas, por pasos cortos.
+# Con convertir=False una base que todavía no está en modo incremental se deja como está
+# ('vacuum_completo' es None: la conversión queda pendiente).
+def vacuum_incremental(convertir=True):
+    convertida = _activar_vacuum_incremental(convertir)
+    if convertida is None:
+        return {'vacuum_completo': None, 'paginas_liberadas': 0}
+    liberadas = 0
+    while True:
+        paso = _paso_vacuum()
+        if not paso:
+            break
+        liberadas += paso
+        time.sleep(VACUUM_PAUSA)
+    return {'vacuum_completo': convertida, 'paginas_liberadas': liberadas}
+
+# Función para pasar al archivo principal las páginas del WAL. PASSIVE no espera a nadie: lo que esté
+# en uso por un lector se copia en el siguiente checkpoint.
+def checkpoint():
+    conn = conectar()
+    ocupada, paginas_wal, copiadas = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    conn.close()
+    return {'bloqueado': bool(ocupada), 'paginas_wal': paginas_wal, 'paginas_copiadas': copiadas}
+
+# Función para listar los respaldos existentes, del más reciente al más antiguo: [(ruta, bytes, fecha)]
+def listar_respaldos(directorio=None):
+    directorio = directorio or RESPALDOS_DIR
+    nombre = os.path.splitext(os.path.basename(base_datos.DB_NAME))[0]
+    rutas = sorted(glob.glob(os.path.join(glob.escape(directorio), f"{nombre}_*.db")), reverse=True)
+    return [(ruta, os.path.getsize(ruta), datetime.fromtimestamp(os.path.getmtime(ruta))) for ruta in rutas]
+
+# Función para copiar la base en línea a un respaldo fechado (API de respaldo de SQLite) y aplicar la
+# retención. En modo WAL la copia es una única transacción de lectura: ve un estado consistente de la
+# base y no bloquea a quienes escriben mientras tanto.
+def respaldar(directorio=None, conservar=None):
+    directorio = directorio or RESPALDOS_DIR
+    conservar = RESPALDOS_CONSERVAR if conservar is None else conservar
+    os.makedirs(directorio, exist_ok=True)
+    nombre = os.path.splitext(os.path.basename(base_datos.DB_NAME))[0]
+    ruta = os.path.join(directorio, f"{nombre}_{datetime.now():%Y%m%d_%H%M%S_%f}.db")
+    # Creación exclusiva: dos respaldos simultáneos (uno manual y el programado) nunca comparten el archivo
+    open(ruta, "x").close()
+
+    origen = conectar()
+    destino = sqlite3.connect(ruta)
+    try:
+        origen.backup(destino)
+        # El respaldo es un único archivo autónomo (sin -wal) y se comprueba antes de darlo por bueno
+        destino.execute("PRAGMA journal_mode = DELETE")
+        verificacion = destino.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        destino.close()
+        origen.close()
+    if verificacion != "ok":
+        os.remove(ruta)
+        raise RuntimeError(f"El respaldo {ruta} no pasó la verificación: {verificacion}")
+
+    eliminados = []
+    for ruta_anterior, _, _ in listar_respaldos(directorio)[max(conservar, 1):]:
+        os.remove(ruta_anterior)
+        eliminados.append(ruta_anterior)
+    return {'ruta': ruta, 'bytes': os.path.getsize(ruta), 'eliminados': eliminados}
+
+# ==================== EJECUCIÓN ====================
+
+# Función para registrar el inicio de un mantenimiento. Devuelve su id, o None si otro proceso (u otra
+# instancia de la aplicación) ya tiene uno en curso o, con si_corresponde, si el último es reciente.
+@con_reintentos
+def _iniciar_registro(tareas, si_corresponde):
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        _crear_tabla_mantenimientos(conn)
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""SELECT COUNT(*) FROM mantenimientos
+                     WHERE estado = 'EN_CURSO' AND inicio > datetime('now', ?)""",
+                  (f"-{MANTENIMIENTO_ABANDONADO_HORAS} hours",))
+        en_curso = c.fetchone()[0]
+        reciente = 0
+        if si_corresponde:
+            c.execute("""SELECT COUNT(*) FROM mantenimientos
+                         WHERE estado = 'COMPLETADO' AND inicio > datetime('now', ?)""",
+                      (f"-{MANTENIMIENTO_INTERVALO_HORAS} hours",))
+            reciente = c.fetchone()[0]
+        if en_curso or reciente:
+            conn.rollback()
+            return None
+        c.execute("INSERT INTO mantenimientos (estado, tareas) VALUES ('EN_CURSO', ?)", (",".join(tareas),))
+        mantenimiento_id = c.lastrowid
+        conn.commit()
+        return mantenimiento_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@con_reintentos
+def _finalizar_registro(mantenimiento_id, estado, resultado, error=None):
+    conn = conectar()
+    conn.execute("""UPDATE mantenimientos SET fin = CURRENT_TIMESTAMP, estado = ?, resultado = ?, error = ?
+                    WHERE id = ?""", (estado, json.dumps(resultado), error, mantenimiento_id))
+    conn.commit()
+    conn.close()
+
+# Función para ejecutar el mantenimiento: mide la latencia de las consultas de referencia, ejecuta las
+# tareas (estadísticas, vacuum incremental, checkpoint del WAL y respaldo) y vuelve a medir. Devuelve el
+# resultado, que también queda en la tabla mantenimientos, o None si no correspondía ejecutarlo.
+# convertir_vacuum permite el VACUUM completo de la conversión a modo incremental (ver vacuum_incremental).
+def ejecutar_mantenimiento(tareas=TAREAS, si_corresponde=False, repeticiones=LATENCIA_REPETICIONES,
+                           convertir_vacuum=True):
+    mantenimiento_id = _iniciar_registro(tareas, si_corresponde)
+    if mantenimiento_id is None:
+        return None
+    resultado = {}
+    try:
+        # Cualquier error, también al medir, queda en la fila: una fila 'EN_CURSO' huérfana bloquearía el
+        # mantenimiento programado hasta que se considerara abandonada
+        resultado['estado_antes'] = estado_base_datos()
+        resultado['latencia_antes'] = medir_latencia(repeticiones)
+        if 'analizar' in tareas:
+            analizar()
+        if 'vacuum' in tareas:
+            resultado['vacuum'] = vacuum_incremental(convertir_vacuum)
+        if 'checkpoint' in tareas:
+            resultado['checkpoint'] = checkpoint()
+        # El respaldo va al final, para que la copia quede compacta y con las estadísticas al día
+        if 'respaldo' in tareas:
+            resultado['respaldo'] = respaldar()
+        resultado['estado_despues'] = estado_base_datos()
+        resultado['latencia_despues'] = medir_latencia(repeticiones)
+    except Exception as e:
+        _finalizar_registro(mantenimiento_id, 'ERROR', resultado, str(e))
+        raise
+    _finalizar_registro(mantenimiento_id, 'COMPLETADO', resultado)
+    return resultado
+
+# Función para obtener los últimos mantenimientos: [(id, inicio, fin, estado, tareas, resultado, error)]
+def get_mantenimientos(limite=20):
+    conn = conectar()
+    _crear_tabla_mantenimientos(conn)
+    filas = conn.execute("""SELECT id, inicio, fin, estado, tareas, resultado, error FROM mantenimientos
+                            ORDER BY id DESC LIMIT ?""", (limite,)).fetchall()
+    conn.close()
+    return [(id_, inicio, fin, estado, tareas, json.loads(resultado) if resultado else None, error)
+            for id_, inicio, fin, estado, tareas, resultado, error in filas]
+
+# Función para comparar la latencia antes y después: [(consulta, ms antes, ms después, variación %)]
+def comparar_latencia(resultado):
+    antes, despues = resultado.get('latencia_antes', {}), resultado.get('latencia_despues', {})
+    return [(consulta, antes[consulta], despues[consulta],
+             round((despues[consulta] - antes[consulta]) / antes[consulta] * 100, 1) if antes[consulta] else None)
+            for consulta in antes if consulta in despues]
+
+# Último error del mantenimiento programado en este proceso: (fecha, mensaje) o None
+_error_programado = None
+
+# Función para obtener el último error del mantenimiento programado en este proceso. Los errores de las
+# tareas quedan además en la fila del mantenimiento; este también cubre los de antes de registrarlo
+# (por ejemplo, la base bloqueada o inaccesible), que no tienen fila.
+def get_error_programado():
+    return _error_programado
+
+# Hilo del proceso que revisa periódicamente si corresponde un mantenimiento. Trabaja en segundo plano y
+# con escrituras cortas, así que los usuarios no esperan; si hay varias instancias, solo una lo ejecuta.
+def _ciclo_mantenimiento():
+    global _error_programado
+    while True:
+        time.sleep(MANTENIMIENTO_REVISION_MINUTOS * 60)
+        try:
+            # Sin la conversión a vacuum incremental, que bloquearía las escrituras de los usuarios
+            if ejecutar_mantenimiento(si_corresponde=True, convertir_vacuum=False) is not None:
+                _error_programado = None
+        except Exception as e:
+            _error_programado = (datetime.now(), str(e))
+
+_hilo_mantenimiento = None
+
+# Función para iniciar el mantenimiento programado en el proceso (una sola vez; nada si el intervalo es 0)
+def iniciar_mantenimiento_programado():
+    global _hilo_mantenimiento
+    if MANTENIMIENTO_INTERVALO_HORAS <= 0 or _hilo_mantenimiento is not None:
+        return _hilo_mantenimiento
+    _hilo_mantenimiento = threading.Thread(target=_ciclo_mantenimiento, name="mantenimiento", daemon=True)
+    _hilo_mantenimiento.start()
+    return _hilo_mantenimiento
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base: estadísticas, vacuum, checkpoint y respaldos.")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+    parser_ejecutar = subparsers.add_parser("ejecutar", help="Ejecuta el mantenimiento ahora")
+    parser_ejecutar.add_argument("--tareas", nargs="+", choices=TAREAS, default=list(TAREAS))
+    parser_ejecutar.add_argument("--si-corresponde", action="store_true",
+                                 help="Solo si el último mantenimiento es más antiguo que el intervalo (para cron)")
+    subparsers.add_parser("respaldos", help="Lista los respaldos existentes")
+    args = parser.parse_args()
+
+    if args.accion == "ejecutar":
+        base_datos.init_db()
+        resultado = ejecutar_mantenimiento(tuple(args.tareas), args.si_corresponde)
+        if resultado is None:
+            print("No corresponde ejecutar el mantenimiento (hay uno en curso o el último es reciente)")
+        else:
+            antes, despues = resultado['estado_antes'], resultado['estado_despues']
+            print(f"Base: {antes['bytes']:,} -> {despues['bytes']:,} bytes, páginas libres "
+                  f"{antes['paginas_libres']} -> {despues['paginas_libres']}, WAL {antes['wal_bytes']:,} -> "
+                  f"{despues['wal_bytes']:,} bytes")
+            if 'respaldo' in resultado:
+                print(f"Respaldo: {resultado['respaldo']['ruta']} ({resultado['respaldo']['bytes']:,} bytes), "
+                      f"{len(resultado['respaldo']['eliminados'])} respaldo(s) antiguo(s) eliminados")
+            for consulta, ms_antes, ms_despues, variacion in comparar_latencia(resultado):
+                print(f"  {consulta}: {ms_antes:.2f} ms -> {ms_despues:.2f} ms"
+                      + (f" ({variacion:+.1f} %)" if variacion is not None else ""))
+    else:
+        for ruta, tamano, fecha in listar_respaldos():
+            print(f"{fecha:%Y-%m-%d %H:%M:%S}  {tamano:>12,}  {ruta}")
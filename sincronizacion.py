@@ -0,0 +1,442 @@
+import argparse
+import gzip
+import json
+import uuid
+from datetime import datetime
+
+from base_datos import (
+    CERTIFICADOS_DIR, COLUMNAS_CERTIFICADO, ZIP_SEPARADOR, conectar, con_reintentos, init_db,
+    get_certificado_archivado, invalidar_catalogo_obras, _fijar_contexto_historial, _reemplazar_facturas,
+)
+from configuracion import valor_configuracion
+
+# Identificador de esta instalación en los paquetes de cambios (por defecto se genera uno y se guarda en la base)
+SITIO = valor_configuracion("sitio")
+DESTINO_POR_DEFECTO = "central"
+FORMATO_PAQUETE = 1
+
+# Columnas de un certificado que viajan en el paquete (la obra viaja por su código, que es el mismo en todas las sedes)
+COLUMNAS_PAQUETE = ['id', 'numero_certificado', 'fecha', 'contrato', 'contratista', 'valor_contrato', 'valor_pagado',
+                    'total_facturas', 'archivo_path', 'fecha_generacion', 'estado', 'comentario_estado']
+# Posición de cada columna en las tuplas de get_certificado_by_id / get_certificado_archivado
+POSICIONES_PAQUETE = [0, 1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+
+# Cambios pendientes de enviar: por cada certificado tocado después de la secuencia enviada, su último cambio
+# y su último cambio que no sea el archivado del año (un certificado que solo se archivó no se reenvía)
+CONSULTA_CAMBIOS = f"""
+    SELECT r.certificado_id, r.secuencia, r.modificado, {COLUMNAS_CERTIFICADO},
+           o.nombre, o.codigo, o.aprobacion, c.version, o.plantilla
+    FROM (SELECT certificado_id, MAX(secuencia) AS secuencia,
+                 MAX(CASE WHEN operacion != 'ARCHIVADO' THEN secuencia END) AS modificado
+          FROM registro_cambios
+          WHERE secuencia > ? AND secuencia <= ?
+          GROUP BY certificado_id) r
+    LEFT JOIN certificados c ON c.id = r.certificado_id
+    LEFT JOIN obras o ON o.id = c.obra_id
+    ORDER BY r.secuencia
+"""
+
+# Función para crear las tablas propias de la sincronización (identidad de la sede, envíos confirmados,
+# correspondencia de certificados recibidos de otras sedes y conflictos pendientes)
+def _crear_tablas_sincronizacion(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS identidad_sitio (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        sitio TEXT NOT NULL
+    )''')
+    conn.execute("INSERT OR IGNORE INTO identidad_sitio (id, sitio) VALUES (1, ?)", (uuid.uuid4().hex[:12],))
+    conn.execute('''CREATE TABLE IF NOT EXISTS envios_sincronizacion (
+        destino TEXT PRIMARY KEY,
+        secuencia INTEGER NOT NULL,
+        fecha_envio TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS certificados_replicados (
+        origen TEXT NOT NULL,
+        origen_id INTEGER NOT NULL,
+        certificado_id INTEGER NOT NULL,
+        secuencia_origen INTEGER NOT NULL, -- último cambio de la sede aplicado aquí
+        version_local INTEGER NOT NULL,    -- versión local tras aplicarlo (si cambia, se editó aquí)
+        PRIMARY KEY (origen, origen_id)
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS origenes_sincronizacion (
+        origen TEXT PRIMARY KEY,
+        secuencia INTEGER NOT NULL,
+        fecha_importacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS conflictos_sincronizacion (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        origen TEXT NOT NULL,
+        origen_id INTEGER NOT NULL,
+        secuencia_origen INTEGER NOT NULL,
+        obra_codigo INTEGER,
+        numero_certificado INTEGER,
+        motivo TEXT NOT NULL,
+        datos TEXT NOT NULL,
+        resuelto INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (origen, origen_id, secuencia_origen)
+    )''')
+    conn.commit()
+
+# Función para obtener el identificador de esta sede
+def get_sitio():
+    conn = conectar()
+    _crear_tablas_sincronizacion(conn)
+    sitio = SITIO or conn.execute("SELECT sitio FROM identidad_sitio WHERE id = 1").fetchone()[0]
+    conn.close()
+    return sitio
+
+# ==================== EXPORTACIÓN (SEDES) ====================
+
+# Función para convertir una tupla de certificado y sus facturas en una fila del paquete
+def _fila_paquete(secuencia, certificado, facturas):
+    valores = [certificado[posicion] for posicion in POSICIONES_PAQUETE]
+    return [secuencia, certificado[14]] + valores + [[list(factura) for factura in facturas]]
+
+# Función para generar el paquete de cambios (JSON comprimido con gzip) desde la última secuencia confirmada
+# para el destino, o desde la indicada. No marca nada como enviado: ver confirmar_envio.
+# Devuelve (contenido, resumen).
+def generar_paquete(destino=DESTINO_POR_DEFECTO, desde=None):
+    sitio = get_sitio()
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        if desde is None:
+            fila = c.execute("SELECT secuencia FROM envios_sincronizacion WHERE destino = ?", (destino,)).fetchone()
+            desde = fila[0] if fila else 0
+        # Los cambios y las facturas se leen en la misma transacción de lectura que la secuencia final
+        c.execute("BEGIN")
+        hasta = c.execute("SELECT COALESCE(MAX(secuencia), 0) FROM registro_cambios").fetchone()[0]
+        cambios = c.execute(CONSULTA_CAMBIOS, (desde, hasta)).fetchall()
+
+        vivos = {fila[3]: fila for fila in cambios if fila[3] is not None}
+        facturas = {certificado_id: [] for certificado_id in vivos}
+        c.execute("""SELECT certificado_id, proveedor, numero_factura, importe, codigo FROM facturas
+                     WHERE certificado_id IN (SELECT value FROM json_each(?)) ORDER BY id""",
+                  (json.dumps(list(vivos)),))
+        for certificado_id, *factura in c.fetchall():
+            facturas[certificado_id].append(factura)
+
+        # De los certificados que ya no están en la base viva interesa su última imagen del historial
+        ausentes = [fila[0] for fila in cambios if fila[3] is None and fila[2] is not None]
+        ultimas = {}
+        for certificado_id in ausentes:
+            c.execute("""SELECT h.operacion, h.numero_certificado, o.codigo FROM historial_certificados h
+                         LEFT JOIN obras o ON o.id = h.obra_id
+                         WHERE h.id = ? ORDER BY h.hist_id DESC LIMIT 1""", (certificado_id,))
+            ultimas[certificado_id] = c.fetchone()
+        obras = {fila[17]: [fila[17], fila[16], fila[18], fila[20]] for fila in vivos.values()}
+        conn.commit()
+    finally:
+        conn.close()
+
+    certificados, eliminados = [], []
+    for certificado_id, secuencia, modificado, *_ in cambios:
+        if modificado is None:
+            continue
+        if certificado_id in vivos:
+            certificados.append(_fila_paquete(secuencia, vivos[certificado_id][3:], facturas[certificado_id]))
+        elif ultimas.get(certificado_id) and ultimas[certificado_id][0] == 'DELETE':
+            _, numero_certificado, obra_codigo = ultimas[certificado_id]
+            eliminados.append([certificado_id, secuencia, obra_codigo, numero_certificado])
+        elif ultimas.get(certificado_id) and ultimas[certificado_id][0] == 'ARCHIVADO':
+            # Modificado y luego archivado antes de sincronizar: se envía desde su base anual
+            certificado, facturas_archivadas = get_certificado_archivado(certificado_id)
+            if certificado is not None:
+                obras.setdefault(certificado[14], [certificado[14], certificado[13], certificado[15], certificado[17]])
+                certificados.append(_fila_paquete(secuencia, certificado, facturas_archivadas))
+
+    paquete = {
+        'formato': FORMATO_PAQUETE, 'origen': sitio, 'destino': destino, 'desde': desde, 'hasta': hasta,
+        'generado': datetime.now().isoformat(timespec='seconds'), 'columnas': COLUMNAS_PAQUETE,
+        'obras': list(obras.values()), 'certificados': certificados, 'eliminados': eliminados,
+    }
+    contenido = gzip.compress(json.dumps(paquete, separators=(',', ':'), default=str).encode('utf-8'))
+    resumen = {'desde': desde, 'hasta': hasta, 'certificados': len(certificados), 'eliminados': len(eliminados),
+               'bytes': len(contenido)}
+    return contenido, resumen
+
+# Función para registrar que los cambios hasta la secuencia dada ya se entregaron al destino
+def confirmar_envio(destino, hasta):
+    conn = conectar()
+    _crear_tablas_sincronizacion(conn)
+    c = conn.cursor()
+    c.execute("""INSERT INTO envios_sincronizacion (destino, secuencia) VALUES (?, ?)
+                 ON CONFLICT (destino) DO UPDATE SET secuencia = MAX(secuencia, excluded.secuencia),
+                                                     fecha_envio = CURRENT_TIMESTAMP""", (destino, hasta))
+    conn.commit()
+    conn.close()
+
+# Función para generar el paquete en un archivo y darlo por enviado
+def exportar_cambios(ruta, destino=DESTINO_POR_DEFECTO, completo=False):
+    contenido, resumen = generar_paquete(destino, desde=0 if completo else None)
+    with open(ruta, "wb") as f:
+        f.write(contenido)
+    confirmar_envio(destino, resumen['hasta'])
+    return resumen
+
+# ==================== IMPORTACIÓN (CENTRAL) ====================
+
+# Función para obtener el id local de una obra por su código, creándola si no existe.
+# Devuelve (id o None si el nombre ya lo usa otra obra, si se creó).
+def _resolver_obra(c, codigo, nombre, aprobacion, plantilla):
+    fila = c.execute("SELECT id FROM obras WHERE codigo = ?", (codigo,)).fetchone()
+    if fila:
+        return fila[0], False
+    existe_nombre = c.execute("SELECT 1 FROM obras WHERE nombre = ?", (nombre,)).fetchone()
+    if existe_nombre:
+        return None, False
+    c.execute("INSERT INTO obras (nombre, codigo, aprobacion, plantilla) VALUES (?, ?, ?, ?)",
+              (nombre, codigo, aprobacion, plantilla))
+    return c.lastrowid, True
+
+# Función para escribir un certificado recibido (nuevo o actualizado) con sus facturas dentro de una
+# transacción abierta. Devuelve (id local, versión local).
+def _aplicar_certificado(c, obra_id, datos, facturas, certificado_id=None):
+    # Los informes no viajan en el paquete: la ruta apunta a certificados_generados aunque en la sede
+    # el certificado ya estuviera archivado, y el informe se regenera en la central
+    archivo_path = datos['archivo_path']
+    if archivo_path and ZIP_SEPARADOR in archivo_path:
+        archivo_path = f"{CERTIFICADOS_DIR}/{archivo_path.split(ZIP_SEPARADOR)[-1]}"
+    valores = (datos['fecha'], datos['contrato'], datos['contratista'], datos['valor_contrato'], datos['valor_pagado'],
+               datos['total_facturas'], archivo_path, datos['estado'], datos['comentario_estado'])
+    if certificado_id is None:
+        c.execute("""INSERT INTO certificados
+                     (fecha, contrato, contratista, valor_contrato, valor_pagado, total_facturas, archivo_path,
+                      estado, comentario_estado, numero_certificado, obra_id, fecha_generacion)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                  valores + (datos['numero_certificado'], obra_id, datos['fecha_generacion']))
+        certificado_id = c.lastrowid
+    else:
+        c.execute("""UPDATE certificados
+                     SET fecha = ?, contrato = ?, contratista = ?, valor_contrato = ?, valor_pagado = ?,
+                         total_facturas = ?, archivo_path = ?, estado = ?, comentario_estado = ?, version = version + 1
+                     WHERE id = ?""", valores + (certificado_id,))
+    _reemplazar_facturas(c, certificado_id, [
+        {'proveedor': proveedor, 'factura': numero_factura, 'importe': importe, 'codigo': codigo}
+        for proveedor, numero_factura, importe, codigo in facturas
+    ])
+    version = c.execute("SELECT version FROM certificados WHERE id = ?", (certificado_id,)).fetchone()[0]
+    return certificado_id, version
+
+# Función para registrar un conflicto (una sola vez por cambio de la sede, aunque el paquete se importe de nuevo)
+def _registrar_conflicto(c, origen, origen_id, secuencia, obra_codigo, numero_certificado, motivo, datos):
+    c.execute("""INSERT OR IGNORE INTO conflictos_sincronizacion
+                 (origen, origen_id, secuencia_origen, obra_codigo, numero_certificado, motivo, datos)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)""",
+              (origen, origen_id, secuencia, obra_codigo, numero_certificado, motivo,
+               json.dumps(datos, separators=(',', ':'), default=str)))
+
+# Función para importar un paquete de cambios de una sede. Cada certificado se identifica por la sede de
+# origen y su id allí; uno nuevo choca si la central ya tiene ese (obra, número de certificado), y uno
+# actualizado o eliminado choca si la central lo modificó desde la última sincronización. Los conflictos
+# no se aplican: quedan registrados para resolverlos a mano. Todo el paquete se aplica en una transacción.
+@con_reintentos
+def importar_paquete(contenido):
+    paquete = json.loads(gzip.decompress(contenido))
+    if paquete.get('formato') != FORMATO_PAQUETE:
+        raise ValueError(f"Formato de paquete no soportado: {paquete.get('formato')}")
+    origen = paquete['origen']
+    if origen == get_sitio():
+        raise ValueError("El paquete fue generado en esta misma sede")
+
+    columnas = paquete['columnas']
+    resumen = {'origen': origen, 'insertados': [], 'actualizados': [], 'eliminados': 0, 'omitidos': 0,
+               'conflictos': 0, 'obras_creadas': []}
+    conn = conectar()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        # En el historial de la central estos cambios quedan como 'SINCRONIZACION'
+        _fijar_contexto_historial(c, 'SINCRONIZACION')
+        obras = {codigo: (codigo, nombre, aprobacion, plantilla) for codigo, nombre, aprobacion, plantilla in paquete['obras']}
+        obras_locales = {}
+
+        for secuencia, obra_codigo, *valores, facturas in paquete['certificados']:
+            datos = dict(zip(columnas, valores))
+            c.execute("""SELECT certificado_id, secuencia_origen, version_local FROM certificados_replicados
+                         WHERE origen = ? AND origen_id = ?""", (origen, datos['id']))
+            replica = c.fetchone()
+            if replica and secuencia <= replica[1]:
+                resumen['omitidos'] += 1
+                continue
+
+            if obra_codigo not in obras_locales:
+                obras_locales[obra_codigo], creada = _resolver_obra(c, *obras[obra_codigo])
+                if creada:
+                    resumen['obras_creadas'].append(obra_codigo)
+            obra_id = obras_locales[obra_codigo]
+            motivo = None
+            if obra_id is None:
+                motivo = (f"La obra {obras[obra_codigo][1]} ({obra_codigo}) no existe en la central y su nombre "
+                          f"ya lo usa otra obra")
+            elif replica:
+                local = c.execute("SELECT version FROM certificados WHERE id = ?", (replica[0],)).fetchone()
+                if local is None:
+                    motivo = "El certificado ya no está en la base viva de la central (eliminado o archivado)"
+                elif local[0] != replica[2]:
+                    motivo = "El certificado fue modificado en la central desde la última sincronización"
+            elif c.execute("SELECT 1 FROM certificados WHERE obra_id = ? AND numero_certificado = ?",
+                           (obra_id, datos['numero_certificado'])).fetchone():
+                motivo = f"La central ya tiene el certificado #{datos['numero_certificado']} de esta obra"
+            if motivo:
+                _registrar_conflicto(c, origen, datos['id'], secuencia, obra_codigo, datos['numero_certificado'], motivo,
+                                     {'obra': obras[obra_codigo], 'certificado': datos, 'facturas': facturas})
+                resumen['conflictos'] += 1
+                continue
+
+            certificado_id, version = _aplicar_certificado(c, obra_id, datos, facturas, replica[0] if replica else None)
+            resumen['actualizados' if replica else 'insertados'].append(certificado_id)
+            c.execute("""INSERT OR REPLACE INTO certificados_replicados
+                         (origen, origen_id, certificado_id, secuencia_origen, version_local) VALUES (?, ?, ?, ?, ?)""",
+                      (origen, datos['id'], certificado_id, secuencia, version))
+
+        for origen_id, secuencia, obra_codigo, numero_certificado in paquete['eliminados']:
+            c.execute("""SELECT certificado_id, secuencia_origen, version_local FROM certificados_replicados
+                         WHERE origen = ? AND origen_id = ?""", (origen, origen_id))
+            replica = c.fetchone()
+            if replica is None or secuencia <= replica[1]:
+                resumen['omitidos'] += 1
+                continue
+            local = c.execute("SELECT version FROM certificados WHERE id = ?", (replica[0],)).fetchone()
+            if local is not None and local[0] != replica[2]:
+                _registrar_conflicto(c, origen, origen_id, secuencia, obra_codigo, numero_certificado,
+                                     "El certificado se eliminó en la sede pero fue modificado en la central",
+                                     {'eliminado': True})
+                resumen['conflictos'] += 1
+                continue
+            if local is not None:
+                c.execute("DELETE FROM facturas WHERE certificado_id = ?", (replica[0],))
+                c.execute("DELETE FROM certificados WHERE id = ?", (replica[0],))
+                resumen['eliminados'] += 1
+            c.execute("UPDATE certificados_replicados SET secuencia_origen = ? WHERE origen = ? AND origen_id = ?",
+                      (secuencia, origen, origen_id))
+
+        _fijar_contexto_historial(c, None)
+        c.execute("""INSERT INTO origenes_sincronizacion (origen, secuencia) VALUES (?, ?)
+                     ON CONFLICT (origen) DO UPDATE SET secuencia = MAX(secuencia, excluded.secuencia),
+                                                        fecha_importacion = CURRENT_TIMESTAMP""",
+                  (origen, paquete['hasta']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    # Las obras nuevas deben aparecer en los selectores de este proceso sin esperar a otro cambio
+    if resumen['obras_creadas']:
+        invalidar_catalogo_obras()
+    return resumen
+
+# Función para listar los conflictos de sincronización (por defecto, solo los pendientes)
+def get_conflictos_sincronizacion(pendientes=True):
+    conn = conectar()
+    _crear_tablas_sincronizacion(conn)
+    c = conn.cursor()
+    c.execute(f"""SELECT id, fecha_registro, origen, origen_id, obra_codigo, numero_certificado, motivo, datos, resuelto
+                  FROM conflictos_sincronizacion {'WHERE resuelto = 0' if pendientes else ''}
+                  ORDER BY id""")
+    conflictos = c.fetchall()
+    conn.close()
+    return conflictos
+
+# Función para resolver un conflicto. Con aceptar_sede=True se aplica la versión de la sede sobre la de la
+# central (solo si el certificado ya estaba replicado); si no, se conserva la de la central y los próximos
+# cambios de la sede sobre ese certificado vuelven a aplicarse a partir de ella.
+@con_reintentos
+def resolver_conflicto(conflicto_id, aceptar_sede=False):
+    conn = conectar()
+    _crear_tablas_sincronizacion(conn)
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""SELECT origen, origen_id, secuencia_origen, obra_codigo, datos FROM conflictos_sincronizacion
+                     WHERE id = ? AND resuelto = 0""", (conflicto_id,))
+        fila = c.fetchone()
+        if fila is None:
+            raise ValueError(f"No hay un conflicto pendiente con id {conflicto_id}")
+        origen, origen_id, secuencia, obra_codigo, datos = fila
+        datos = json.loads(datos)
+        c.execute("SELECT certificado_id FROM certificados_replicados WHERE origen = ? AND origen_id = ?",
+                  (origen, origen_id))
+        replica = c.fetchone()
+        local = c.execute("SELECT version FROM certificados WHERE id = ?", (replica[0],)).fetchone() if replica else None
+
+        if aceptar_sede:
+            if local is None:
+                raise ValueError("Solo se puede aplicar la versión de la sede a un certificado que ya existe en la central")
+            _fijar_contexto_historial(c, 'SINCRONIZACION')
+            if datos.get('eliminado'):
+                c.execute("DELETE FROM facturas WHERE certificado_id = ?", (replica[0],))
+                c.execute("DELETE FROM certificados WHERE id = ?", (replica[0],))
+                version = local[0]
+            else:
+                obra_id = c.execute("SELECT obra_id FROM certificados WHERE id = ?", (replica[0],)).fetchone()[0]
+                _, version = _aplicar_certificado(c, obra_id, datos['certificado'], datos['facturas'], replica[0])
+            _fijar_contexto_historial(c, None)
+            c.execute("""UPDATE certificados_replicados SET secuencia_origen = ?, version_local = ?
+                         WHERE origen = ? AND origen_id = ?""", (secuencia, version, origen, origen_id))
+        elif local is not None:
+            c.execute("""UPDATE certificados_replicados SET secuencia_origen = MAX(secuencia_origen, ?), version_local = ?
+                         WHERE origen = ? AND origen_id = ?""", (secuencia, local[0], origen, origen_id))
+        c.execute("UPDATE conflictos_sincronizacion SET resuelto = 1 WHERE id = ?", (conflicto_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Función para obtener el estado de la sincronización de esta sede: envíos confirmados por destino
+# (con los certificados con cambios pendientes de enviar) y últimos paquetes importados por sede de origen
+def get_estado_sincronizacion():
+    sitio = get_sitio()
+    conn = conectar()
+    c = conn.cursor()
+    c.execute("""SELECT e.destino, e.secuencia, e.fecha_envio,
+                        (SELECT COUNT(DISTINCT r.certificado_id) FROM registro_cambios r WHERE r.secuencia > e.secuencia)
+                 FROM envios_sincronizacion e ORDER BY e.destino""")
+    envios = c.fetchall()
+    c.execute("SELECT origen, secuencia, fecha_importacion FROM origenes_sincronizacion ORDER BY origen")
+    origenes = c.fetchall()
+    conn.close()
+    return {'sitio': sitio, 'envios': envios, 'origenes': origenes}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincroniza los certificados entre sedes mediante paquetes de cambios.")
+    subparsers = parser.add_subparsers(dest="accion", required=True)
+    exportar = subparsers.add_parser("exportar", help="Genera el paquete con los cambios desde el último envío")
+    exportar.add_argument("ruta")
+    exportar.add_argument("--destino", default=DESTINO_POR_DEFECTO)
+    exportar.add_argument("--completo", action="store_true", help="Incluye todos los certificados, no solo los cambios")
+    importar = subparsers.add_parser("importar", help="Aplica en esta base un paquete recibido de una sede")
+    importar.add_argument("rutas", nargs="+")
+    importar.add_argument("--generar-informes", action="store_true",
+                          help="Regenera el Excel y el PDF de los certificados recibidos")
+    subparsers.add_parser("conflictos", help="Lista los conflictos pendientes")
+    args = parser.parse_args()
+
+    init_db()
+    if args.accion == "exportar":
+        resumen = exportar_cambios(args.ruta, args.destino, args.completo)
+        print(f"Sede {get_sitio()}: {resumen['certificados']} certificado(s) y {resumen['eliminados']} eliminación(es) "
+              f"(hasta el cambio {resumen['hasta']}) en {args.ruta} ({resumen['bytes']} bytes)")
+    elif args.accion == "importar":
+        for ruta in args.rutas:
+            with open(ruta, "rb") as f:
+                resumen = importar_paquete(f.read())
+            print(f"{ruta} (sede {resumen['origen']}): {len(resumen['insertados'])} nuevo(s), "
+                  f"{len(resumen['actualizados'])} actualizado(s), {resumen['eliminados']} eliminado(s), "
+                  f"{resumen['omitidos']} ya aplicado(s), {resumen['conflictos']} conflicto(s)")
+            if resumen['obras_creadas']:
+                print(f"  obra(s) creada(s): {', '.join(map(str, resumen['obras_creadas']))}")
+            if args.generar_informes and (resumen['insertados'] or resumen['actualizados']):
+                import informes
+                informes.generar_lote(resumen['insertados'] + resumen['actualizados'], informes.FORMATOS_POR_DEFECTO)
+            from validacion import validar_certificados_guardados
+            for _, fila in validar_certificados_guardados(resumen['insertados'] + resumen['actualizados']).iterrows():
+                print(f"  certificado {fila['certificado_id']} (obra {fila['obra']}, #{fila['numero_certificado']}): "
+                      f"{fila['mensaje']}")
+    else:
+        for conflicto_id, fecha, origen, origen_id, obra_codigo, numero, motivo, _, _ in get_conflictos_sincronizacion():
+            print(f"[{conflicto_id}] {fecha} sede {origen} certificado {origen_id} "
+                  f"(obra {obra_codigo}, #{numero}): {motivo}")
@@ -0,0 +1,268 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from base_datos import clave_factura, conectar, get_version_datos
+
+# Diferencia máxima (en CUP) entre dos importes que se considera redondeo
+TOLERANCIA_IMPORTES = 0.01
+
+# Columnas que usan las reglas. Cualquier lote (la base completa, un paquete importado o un certificado
+# en edición) se valida construyendo estas dos tablas; en facturas, clave_factura se calcula si falta.
+COLUMNAS_CERTIFICADOS = ['id', 'obra_id', 'obra', 'numero_certificado', 'fecha', 'contrato', 'valor_contrato',
+                         'valor_pagado', 'total_facturas', 'estado', 'aprobacion_desde', 'aprobacion_hasta']
+COLUMNAS_FACTURAS = ['certificado_id', 'proveedor', 'numero_factura', 'importe', 'clave_factura']
+
+# Tipo de las columnas de texto durante la validación
+TEXTO = "string[pyarrow]"
+
+# Columnas del reporte: una fila por cada incumplimiento de una regla
+COLUMNAS_REPORTE = ['certificado_id', 'obra', 'numero_certificado', 'fecha', 'regla', 'mensaje']
+
+CONSULTA_CERTIFICADOS = """
+    SELECT c.id, c.obra_id, o.nombre AS obra, c.numero_certificado, c.fecha, c.contrato, c.valor_contrato,
+           c.valor_pagado, c.total_facturas, c.estado, o.aprobacion_desde, o.aprobacion_hasta
+    FROM certificados c
+    JOIN obras o ON c.obra_id = o.id
+    {filtro}
+"""
+CONSULTA_FACTURAS = """
+    SELECT f.certificado_id, f.proveedor, f.numero_factura, f.importe, f.clave_factura
+    FROM facturas f
+    JOIN certificados c ON f.certificado_id = c.id
+    {filtro}
+"""
+
+# Función para dar formato a una serie de importes en los mensajes
+def _importes(serie):
+    return serie.map("{:,.2f}".format).astype(str)
+
+# Función para dar formato a una serie de fechas en los mensajes (… si no hay fecha)
+def _fechas(serie):
+    return serie.dt.strftime("%d/%m/%Y").fillna("…")
+
+# Función para armar el resultado de una regla: los certificados que la incumplen con su mensaje
+# (uno por certificado, o el mismo texto para todos)
+def _incumplimientos(certificado_ids, mensajes):
+    if isinstance(mensajes, pd.Series):
+        mensajes = mensajes.to_numpy()
+    # Entero también cuando no hay incumplimientos, para que el reporte concatenado no pase a decimal
+    return pd.DataFrame({'certificado_id': np.asarray(certificado_ids, dtype=np.int64), 'mensaje': mensajes})
+
+# ==================== REGLAS ====================
+# Cada regla recibe las tablas preparadas por _preparar_tablas y evalúa todas las filas a la vez.
+# Devuelve un DataFrame (certificado_id, mensaje) con una fila por incumplimiento.
+
+# El total de facturas guardado en el certificado coincide con la suma de sus facturas
+def _regla_totales(certificados, facturas):
+    diferencia = (certificados['total_facturas'] - certificados['suma_facturas']).abs()
+    incumple = certificados[diferencia > TOLERANCIA_IMPORTES]
+    return _incumplimientos(
+        incumple['id'],
+        "El total de facturas (" + _importes(incumple['total_facturas']) + ") no coincide con la suma de sus "
+        "facturas (" + _importes(incumple['suma_facturas']) + ")")
+
+# Lo pagado no supera el valor del contrato: ni en el propio certificado ni acumulado, en orden de fecha,
+# entre los certificados activos del mismo contrato en la obra (un valor de contrato 0 significa sin definir)
+def _regla_pagado_contrato(certificados, facturas):
+    ordenados = certificados.sort_values(['obra_id', 'contrato_clave', 'fecha', 'numero_certificado'], na_position='last')
+    activo = ordenados['estado'] == 'Activo'
+    acumulado = (ordenados['valor_pagado'].where(activo, 0.0)
+                 .groupby([ordenados['obra_id'], ordenados['contrato_clave']]).cumsum())
+    pagado = acumulado.where(activo, ordenados['valor_pagado'])
+    incumple = (ordenados['valor_contrato'] > 0) & (pagado > ordenados['valor_contrato'] + TOLERANCIA_IMPORTES)
+    inicio = pd.Series(np.where(activo[incumple], "El pagado acumulado del contrato (", "El valor pagado ("),
+                       index=pagado[incumple].index, dtype=object)
+    return _incumplimientos(
+        ordenados.loc[incumple, 'id'],
+        inicio + _importes(pagado[incumple]) + ") supera el valor del contrato ("
+        + _importes(ordenados.loc[incumple, 'valor_contrato']) + ")")
+
+# La fecha del certificado cae dentro del período de aprobación de la obra (si la obra lo tiene definido)
+def _regla_fecha_aprobacion(certificados, facturas):
+    fecha = certificados['fecha']
+    incumple = certificados[(fecha < certificados['aprobacion_desde']) | (fecha > certificados['aprobacion_hasta'])]
+    return _incumplimientos(
+        incumple['id'],
+        "La fecha " + _fechas(incumple['fecha']) + " está fuera del período de aprobación de la obra ("
+        + _fechas(incumple['aprobacion_desde']) + " - " + _fechas(incumple['aprobacion_hasta']) + ")")
+
+# Cada factura tiene proveedor, número e importe positivo
+def _regla_facturas_completas(certificados, facturas):
+    sin_importe = ~(facturas['importe'] > 0)
+    return pd.concat([
+        _incumplimientos(facturas.loc[facturas['proveedor'] == "", 'certificado_id'], "Hay una factura sin proveedor"),
+        _incumplimientos(facturas.loc[facturas['numero_factura'] == "", 'certificado_id'], "Hay una factura sin número"),
+        _incumplimientos(facturas.loc[sin_importe, 'certificado_id'],
+                         "La factura " + facturas.loc[sin_importe, 'numero_factura'] + " tiene un importe no positivo"),
+    ], ignore_index=True)
+
+# Una misma factura (proveedor y número normalizados) no se certifica dos veces en certificados activos,
+# ni en certificados distintos ni repetida dentro del mismo certificado
+def _regla_facturas_unicas(certificados, facturas):
+    activos = certificados.loc[certificados['estado'] == 'Activo'].set_index('id')['numero_certificado']
+    en_activos = facturas[facturas['certificado_id'].isin(activos.index)]
+    repetidas = en_activos[en_activos.duplicated('clave_factura', keep=False)].copy()
+    if repetidas.empty:
+        return _incumplimientos([], [])
+    repetidas['numero_certificado'] = repetidas['certificado_id'].map(activos)
+    repetidas['veces'] = repetidas.groupby('clave_factura')['clave_factura'].transform('size')
+    # Números de los certificados donde aparece (un certificado todavía sin guardar no tiene número)
+    repetidas['certificados'] = (repetidas.groupby('clave_factura')['numero_certificado']
+                                 .transform(lambda numeros: ", ".join(f"#{int(n)}" for n in numeros.dropna().unique())))
+    repetidas['certificados'] = repetidas['certificados'].where(repetidas['certificados'] == "",
+                                                                " (" + repetidas['certificados'] + ")")
+    return _incumplimientos(
+        repetidas['certificado_id'],
+        "La factura " + repetidas['proveedor'] + " - " + repetidas['numero_factura'] + " aparece "
+        + repetidas['veces'].astype(str) + " veces en certificados activos" + repetidas['certificados'])
+
+# Reglas de consistencia, en el orden en que se informan
+REGLAS = {
+    'totales': {
+        'descripcion': "El total de facturas coincide con la suma de sus facturas",
+        'funcion': _regla_totales,
+    },
+    'pagado_contrato': {
+        'descripcion': "Lo pagado no supera el valor del contrato",
+        'funcion': _regla_pagado_contrato,
+    },
+    'fecha_aprobacion': {
+        'descripcion': "La fecha está dentro del período de aprobación de la obra",
+        'funcion': _regla_fecha_aprobacion,
+    },
+    'facturas_completas': {
+        'descripcion': "Cada factura tiene proveedor, número e importe positivo",
+        'funcion': _regla_facturas_completas,
+    },
+    'facturas_unicas': {
+        'descripcion': "Ninguna factura se certifica dos veces",
+        'funcion': _regla_facturas_unicas,
+    },
+}
+
+# ==================== MOTOR ====================
+
+# Función para normalizar los tipos de las tablas y agregar las columnas derivadas que usan las reglas
+def _preparar_tablas(certificados, facturas):
+    certificados = certificados[COLUMNAS_CERTIFICADOS].copy()
+    for columna in ('fecha', 'aprobacion_desde', 'aprobacion_hasta'):
+        certificados[columna] = pd.to_datetime(certificados[columna], errors='coerce', format='ISO8601')
+    for columna in ('valor_contrato', 'valor_pagado', 'total_facturas'):
+        certificados[columna] = pd.to_numeric(certificados[columna], errors='coerce').fillna(0.0)
+    # Los textos se pasan a cadenas de Arrow para recortarlos y compararlos sin recorrerlos en Python
+    certificados['contrato_clave'] = certificados['contrato'].fillna("").astype(str).astype(TEXTO).str.strip().str.upper()
+
+    facturas = facturas.reindex(columns=COLUMNAS_FACTURAS).copy()
+    for columna in ('proveedor', 'numero_factura'):
+        facturas[columna] = facturas[columna].fillna("").astype(TEXTO).str.strip()
+    facturas['importe'] = pd.to_numeric(facturas['importe'], errors='coerce')
+    sin_clave = facturas['clave_factura'].isna()
+    if sin_clave.any():
+        facturas.loc[sin_clave, 'clave_factura'] = [
+            clave_factura(proveedor, numero) for proveedor, numero
+            in zip(facturas.loc[sin_clave, 'proveedor'], facturas.loc[sin_clave, 'numero_factura'])]
+
+    suma_facturas = facturas.groupby('certificado_id')['importe'].sum()
+    certificados['suma_facturas'] = certificados['id'].map(suma_facturas).fillna(0.0)
+    return certificados, facturas
+
+# Función para validar un lote de certificados con sus facturas en una sola pasada por regla.
+# Devuelve el reporte (COLUMNAS_REPORTE) con una fila por incumplimiento, ordenado por certificado.
+def validar_certificados(certificados, facturas, reglas=None):
+    certificados, facturas = _preparar_tablas(certificados, facturas)
+    resultados = []
+    for codigo in reglas or REGLAS:
+        incumplimientos = REGLAS[codigo]['funcion'](certificados, facturas)
+        incumplimientos['regla'] = codigo
+        resultados.append(incumplimientos)
+    reporte = pd.concat(resultados, ignore_index=True).merge(
+        certificados[['id', 'obra', 'numero_certificado', 'fecha']], left_on='certificado_id', right_on='id')
+    reporte['orden_regla'] = reporte['regla'].map({codigo: orden for orden, codigo in enumerate(REGLAS)})
+    reporte = reporte.sort_values(['certificado_id', 'orden_regla'], kind='stable')
+    return reporte[COLUMNAS_REPORTE].reset_index(drop=True)
+
+# Función para leer de la base viva los certificados y facturas a validar (todos, o los de ciertas obras;
+# con_facturas=False deja la tabla de facturas vacía)
+def cargar_certificados(obra_ids=None, con_facturas=True):
+    filtro, parametros = "", []
+    if obra_ids is not None:
+        obra_ids = list(obra_ids)
+        filtro = f"WHERE c.obra_id IN ({', '.join('?' * len(obra_ids))})"
+        parametros = obra_ids
+    conn = conectar()
+    certificados = pd.read_sql_query(CONSULTA_CERTIFICADOS.format(filtro=filtro), conn, params=parametros)
+    if con_facturas:
+        facturas = pd.read_sql_query(CONSULTA_FACTURAS.format(filtro=filtro), conn, params=parametros)
+    else:
+        facturas = pd.DataFrame(columns=COLUMNAS_FACTURAS)
+    conn.close()
+    return certificados, facturas
+
+# Reporte de consistencia de toda la base viva, recalculado solo cuando cambian los datos
+@st.cache_data(show_spinner=False, max_entries=1)
+def _reporte_consistencia(version):
+    return validar_certificados(*cargar_certificados())
+
+# Función para obtener el reporte de consistencia de toda la base viva
+def reporte_consistencia():
+    return _reporte_consistencia(get_version_datos())
+
+# Función para validar los certificados indicados (por ejemplo, los de un paquete importado) en el contexto
+# de sus obras: las reglas acumuladas por contrato tienen en cuenta los demás certificados de la obra
+def validar_certificados_guardados(certificado_ids):
+    certificado_ids = set(certificado_ids)
+    if not certificado_ids:
+        return pd.DataFrame(columns=COLUMNAS_REPORTE)
+    conn = conectar()
+    marcadores = ', '.join('?' * len(certificado_ids))
+    obra_ids = [fila[0] for fila in conn.execute(
+        f"SELECT DISTINCT obra_id FROM certificados WHERE id IN ({marcadores})", list(certificado_ids))]
+    conn.close()
+    reporte = validar_certificados(*cargar_certificados(obra_ids))
+    return reporte[reporte['certificado_id'].isin(certificado_ids)].reset_index(drop=True)
+
+# Función para validar un certificado nuevo o editado antes de guardarlo, frente a los demás certificados
+# de su obra. Las facturas repetidas en otros certificados ya las informa validar_facturas_duplicadas, así
+# que de los demás certificados no se leen las facturas. Devuelve los mensajes para la interfaz.
+def validar_cambio_certificado(obra_id, fecha, contrato, valor_contrato, valor_pagado, total_facturas,
+                               facturas_data, estado='Activo', certificado_id=None):
+    certificados, _ = cargar_certificados([obra_id], con_facturas=False)
+    conn = conectar()
+    nombre_obra, aprobacion_desde, aprobacion_hasta = conn.execute(
+        "SELECT nombre, aprobacion_desde, aprobacion_hasta FROM obras WHERE id = ?", (obra_id,)).fetchone()
+    conn.close()
+    # Un certificado nuevo todavía no tiene id ni número
+    candidato_id = certificado_id if certificado_id is not None else -1
+    numero_certificado = certificados.loc[certificados['id'] == candidato_id, 'numero_certificado'].max()
+    candidato = pd.DataFrame([{
+        'id': candidato_id, 'obra_id': obra_id, 'obra': nombre_obra, 'numero_certificado': numero_certificado,
+        'fecha': fecha, 'contrato': contrato, 'valor_contrato': valor_contrato, 'valor_pagado': valor_pagado,
+        'total_facturas': total_facturas, 'estado': estado,
+        'aprobacion_desde': aprobacion_desde, 'aprobacion_hasta': aprobacion_hasta,
+    }], columns=COLUMNAS_CERTIFICADOS)
+    otros = certificados[certificados['id'] != candidato_id]
+    certificados = pd.concat([otros, candidato], ignore_index=True) if len(otros) else candidato
+    facturas = pd.DataFrame({
+        'certificado_id': candidato_id,
+        'proveedor': [factura['proveedor'] for factura in facturas_data],
+        'numero_factura': [factura['factura'] for factura in facturas_data],
+        'importe': [factura['importe'] for factura in facturas_data],
+    }, columns=COLUMNAS_FACTURAS)
+    reporte = validar_certificados(certificados, facturas)
+    return [f"❌ {mensaje}" for mensaje in reporte.loc[reporte['certificado_id'] == candidato_id, 'mensaje']]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Valida la consistencia de todos los certificados de la base viva.")
+    parser.add_argument("--csv", help="Guarda el reporte completo en este archivo CSV")
+    args = parser.parse_args()
+
+    reporte = validar_certificados(*cargar_certificados())
+    for codigo, regla in REGLAS.items():
+        incumplimientos = reporte[reporte['regla'] == codigo]
+        print(f"{regla['descripcion']}: {incumplimientos['certificado_id'].nunique()} certificado(s) con problemas")
+    if args.csv:
+        reporte.to_csv(args.csv, index=False)
+        print(f"Reporte guardado en {args.csv} ({len(reporte)} fila(s))")